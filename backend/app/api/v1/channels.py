@@ -3,18 +3,228 @@ Channels API Endpoints
 RESTful API for managing device channels
 """
 
-from fastapi import APIRouter, HTTPException, Query
-from typing import Optional
+from fastapi import APIRouter, HTTPException, Query, Request
+from typing import Dict, List, Optional
 from uuid import UUID
+from datetime import datetime, timedelta, timezone
 import math
 import json
 
-from app.models.channel import Channel, ChannelCreate, ChannelUpdate, ChannelListResponse
-from app.database import get_db_connection
+import asyncpg
+
+from app.models.channel import (
+    Channel,
+    ChannelCreate,
+    ChannelUpdate,
+    ChannelListResponse,
+    ChannelSummary,
+    ChannelSummaryDevice,
+    ChannelSummaryMetric,
+)
+from app.models import PercentilesResponse
+from app.database import get_db_connection, get_read_connection, mark_written
+from app.config import settings
+from app.cache import TTLCache, MISSING
+from app.statements import statements
+from app import invalidation
+from app.audit import audit_log
+from app.auth import check_tenant
+from app.services.search import search_pattern
+from app.services.percentiles import DEFAULT_PERCENTILES, range_percentiles, resolve_query
 
 router = APIRouter(prefix="/api/v1/channels", tags=["channels"])
 
 
+# =====================================================
+# CANONICAL STATEMENTS
+# Fixed SQL text per query shape: optional filters use "$n IS NULL OR ..."
+# and partial updates use COALESCE, so every request reuses the same
+# prepared statement instead of producing a new variant per input.
+# =====================================================
+
+_CHANNEL_FILTER = """
+    c.tenant_id = $1
+    AND ($2::text IS NULL OR c.name ILIKE $2 OR c.description ILIKE $2)
+"""
+
+COUNT_CHANNELS = statements.register("channels.count", f"""
+    SELECT COUNT(*)
+    FROM channels c
+    WHERE {_CHANNEL_FILTER}
+""")
+
+LIST_CHANNELS = statements.register("channels.list", f"""
+    SELECT
+        c.*,
+        COUNT(DISTINCT d.id) FILTER (WHERE d.id IS NOT NULL) as device_count,
+        COUNT(DISTINCT d.id) FILTER (WHERE d.status = 'online') as online_count
+    FROM channels c
+    LEFT JOIN devices d ON d.channel_id = c.id
+    WHERE {_CHANNEL_FILTER}
+    GROUP BY c.id
+    ORDER BY c.created_at DESC
+    LIMIT $3 OFFSET $4
+""")
+
+GET_CHANNEL = statements.register("channels.get", """
+    SELECT
+        c.*,
+        COUNT(DISTINCT d.id) FILTER (WHERE d.id IS NOT NULL) as device_count,
+        COUNT(DISTINCT d.id) FILTER (WHERE d.status = 'online') as online_count
+    FROM channels c
+    LEFT JOIN devices d ON d.channel_id = c.id
+    WHERE c.id = $1 AND c.tenant_id = $2
+    GROUP BY c.id
+""")
+
+CHANNEL_EXISTS = statements.register("channels.exists", """
+    SELECT id FROM channels WHERE id = $1 AND tenant_id = $2
+""")
+
+CHANNEL_NAME_EXISTS = statements.register("channels.name_exists", """
+    SELECT id FROM channels
+    WHERE tenant_id = $1 AND name = $2
+""")
+
+INSERT_CHANNEL = statements.register("channels.insert", """
+    INSERT INTO channels (
+        tenant_id, name, description, icon, color, metadata
+    )
+    VALUES ($1, $2, $3, $4, $5, $6)
+    RETURNING *
+""")
+
+# NULL parameters leave the column unchanged; the tenant check is part of
+# the WHERE clause, so no separate existence query is needed. The row
+# before and after the update also comes back as jsonb ("previous",
+# "current") for the audit log, from the same statement.
+UPDATE_CHANNEL = statements.register("channels.update", """
+    WITH previous AS (
+        SELECT * FROM channels WHERE id = $1 AND tenant_id = $2 FOR UPDATE
+    )
+    UPDATE channels c
+    SET
+        name = COALESCE($3, c.name),
+        description = COALESCE($4, c.description),
+        icon = COALESCE($5, c.icon),
+        color = COALESCE($6, c.color),
+        metadata = COALESCE($7::jsonb, c.metadata),
+        updated_at = NOW()
+    FROM previous
+    WHERE c.id = previous.id
+    RETURNING c.*, to_jsonb(previous) AS previous, to_jsonb(c) AS current
+""")
+
+DELETE_CHANNEL = statements.register("channels.delete", """
+    DELETE FROM channels WHERE id = $1 AND tenant_id = $2
+    RETURNING *
+""")
+
+LIST_CHANNEL_DEVICES = statements.register("channels.devices", """
+    SELECT * FROM devices
+    WHERE channel_id = $1
+        AND ($2::text IS NULL OR status = $2)
+    ORDER BY name
+""")
+
+# ===== CHANNEL SUMMARY =====
+
+SPARKLINE_HOURS = 24
+SPARKLINE_BUCKET_SECONDS = 3600
+
+SUMMARY_DEVICES = statements.register("channels.summary_devices", """
+    SELECT id::text AS id, name, status, last_seen, device_type_id::text AS device_type_id
+    FROM devices
+    WHERE channel_id = $1 AND tenant_id = $2
+    ORDER BY name
+""")
+
+# Hourly averages and the latest point of every (device, metric) of the
+# channel since $3, in one statement. device_data_hourly is a materialized
+# view refreshed periodically, so hours before its last refreshed bucket
+# come from it and that (possibly partial) bucket onwards is aggregated from
+# device_data. A metric quiet since the refresh takes its latest point from
+# its last hour via the (device_id, time) index.
+_SUMMARY_SERIES = """
+    WITH bounds AS (
+        {bounds}
+    ),
+    tail AS (
+        SELECT d.device_id, d.metric_name, d.time, d.value, d.unit
+        FROM device_data d, bounds
+        WHERE d.tenant_id = $1
+            AND d.device_id = ANY($2::uuid[])
+            AND d.time >= bounds.tail_start
+    ),
+    buckets AS (
+        {hourly}
+        SELECT device_id, metric_name, time_bucket('1 hour', time) AS bucket, AVG(value) AS avg_value
+        FROM tail
+        GROUP BY 1, 2, 3
+    ),
+    series AS (
+        SELECT
+            device_id,
+            metric_name,
+            array_agg(bucket ORDER BY bucket) AS buckets,
+            array_agg(avg_value ORDER BY bucket) AS averages,
+            MAX(bucket) AS last_bucket
+        FROM buckets
+        GROUP BY device_id, metric_name
+    ),
+    tail_latest AS (
+        SELECT DISTINCT ON (device_id, metric_name) device_id, metric_name, value, unit, time
+        FROM tail
+        ORDER BY device_id, metric_name, time DESC
+    )
+    SELECT
+        s.device_id::text AS device_id,
+        s.metric_name,
+        s.buckets,
+        s.averages,
+        COALESCE(l.value, q.value) AS latest_value,
+        COALESCE(l.unit, q.unit) AS unit,
+        COALESCE(l.time, q.time) AS latest_time
+    FROM series s
+    LEFT JOIN tail_latest l ON l.device_id = s.device_id AND l.metric_name = s.metric_name
+    LEFT JOIN LATERAL (
+        SELECT d.value, d.unit, d.time
+        FROM device_data d
+        WHERE l.time IS NULL
+            AND d.tenant_id = $1
+            AND d.device_id = s.device_id
+            AND d.metric_name = s.metric_name
+            AND d.time >= s.last_bucket
+            AND d.time < s.last_bucket + INTERVAL '1 hour'
+        ORDER BY d.time DESC
+        LIMIT 1
+    ) q ON TRUE
+"""
+
+SUMMARY_SERIES = statements.register("channels.summary_series", _SUMMARY_SERIES.format(
+    bounds="""SELECT GREATEST($3::timestamptz, COALESCE(MAX(bucket), $3::timestamptz)) AS tail_start
+        FROM device_data_hourly""",
+    hourly="""SELECT h.device_id, h.metric_name, h.bucket, h.avg_value
+        FROM device_data_hourly h, bounds
+        WHERE h.tenant_id = $1
+            AND h.device_id = ANY($2::uuid[])
+            AND h.bucket >= $3
+            AND h.bucket < bounds.tail_start
+        UNION ALL""",
+))
+
+# Same without the view, for while it has not been populated yet (it is
+# recreated WITH NO DATA by the tenant partitioning swap)
+SUMMARY_SERIES_RAW = statements.register("channels.summary_series_raw", _SUMMARY_SERIES.format(
+    bounds="SELECT $3::timestamptz AS tail_start",
+    hourly="",
+))
+
+# Summaries by channel id; short-lived, and dropped on channel writes
+_summaries = TTLCache("channel_summary", settings.CACHE_MAX_ENTRIES, settings.CHANNEL_SUMMARY_TTL_SECONDS)
+invalidation.subscribe("channel", _summaries)
+
+
 @router.get("/", response_model=ChannelListResponse)
 async def list_channels(
     tenant_id: UUID = Query(..., description="Tenant ID for filtering"),
@@ -25,41 +235,18 @@ async def list_channels(
     """
     List all channels for a tenant with pagination and search
     """
-    async with get_db_connection() as conn:
-        # Build WHERE clause
-        where_conditions = ["c.tenant_id = $1"]
-        params = [str(tenant_id)]
-
-        if search:
-            where_conditions.append("(c.name ILIKE $2 OR c.description ILIKE $2)")
-            params.append(f"%{search}%")
-
-        where_clause = " AND ".join(where_conditions)
+    async with get_read_connection(tenant_id) as conn:
+        # Served by the trigram indexes on name and description
+        pattern = search_pattern(search)
 
         # Get total count
-        count_query = f"""
-            SELECT COUNT(*)
-            FROM channels c
-            WHERE {where_clause}
-        """
-        total = await conn.fetchval(count_query, *params)
+        total = await statements.fetchval(conn, COUNT_CHANNELS, str(tenant_id), pattern)
 
         # Get paginated channels with device counts
         offset = (page - 1) * page_size
-        query = f"""
-            SELECT
-                c.*,
-                COUNT(DISTINCT d.id) FILTER (WHERE d.id IS NOT NULL) as device_count,
-                COUNT(DISTINCT d.id) FILTER (WHERE d.status = 'online') as online_count
-            FROM channels c
-            LEFT JOIN devices d ON d.channel_id = c.id
-            WHERE {where_clause}
-            GROUP BY c.id
-            ORDER BY c.created_at DESC
-            LIMIT ${len(params) + 1} OFFSET ${len(params) + 2}
-        """
-
-        channels = await conn.fetch(query, *params, page_size, offset)
+        channels = await statements.fetch(
+            conn, LIST_CHANNELS, str(tenant_id), pattern, page_size, offset
+        )
 
         total_pages = math.ceil(total / page_size) if total > 0 else 1
 
@@ -88,19 +275,8 @@ async def get_channel(
     """
     Get a specific channel by ID
     """
-    async with get_db_connection() as conn:
-        query = """
-            SELECT
-                c.*,
-                COUNT(DISTINCT d.id) FILTER (WHERE d.id IS NOT NULL) as device_count,
-                COUNT(DISTINCT d.id) FILTER (WHERE d.status = 'online') as online_count
-            FROM channels c
-            LEFT JOIN devices d ON d.channel_id = c.id
-            WHERE c.id = $1 AND c.tenant_id = $2
-            GROUP BY c.id
-        """
-
-        channel = await conn.fetchrow(query, str(channel_id), str(tenant_id))
+    async with get_read_connection(tenant_id) as conn:
+        channel = await statements.fetchrow(conn, GET_CHANNEL, str(channel_id), str(tenant_id))
 
         if not channel:
             raise HTTPException(
@@ -123,18 +299,17 @@ def parse_channel_record(record) -> Channel:
 
 
 @router.post("/", response_model=Channel, status_code=201)
-async def create_channel(channel: ChannelCreate):
+async def create_channel(channel: ChannelCreate, request: Request):
     """
     Create a new channel
     """
+    check_tenant(request, channel.tenant_id)
     try:
         async with get_db_connection() as conn:
             # Check for duplicate channel name in tenant
-            check_query = """
-                SELECT id FROM channels
-                WHERE tenant_id = $1 AND name = $2
-            """
-            existing = await conn.fetchval(check_query, str(channel.tenant_id), channel.name)
+            existing = await statements.fetchval(
+                conn, CHANNEL_NAME_EXISTS, str(channel.tenant_id), channel.name
+            )
 
             if existing:
                 raise HTTPException(
@@ -143,16 +318,9 @@ async def create_channel(channel: ChannelCreate):
                 )
 
             # Insert new channel
-            insert_query = """
-                INSERT INTO channels (
-                    tenant_id, name, description, icon, color, metadata
-                )
-                VALUES ($1, $2, $3, $4, $5, $6)
-                RETURNING *
-            """
-
-            new_channel = await conn.fetchrow(
-                insert_query,
+            new_channel = await statements.fetchrow(
+                conn,
+                INSERT_CHANNEL,
                 str(channel.tenant_id),
                 channel.name,
                 channel.description,
@@ -161,7 +329,13 @@ async def create_channel(channel: ChannelCreate):
                 json.dumps(channel.metadata or {})
             )
 
-            return parse_channel_record(new_channel)
+        # Published after the connection is released (publish takes its own)
+        mark_written(channel.tenant_id)
+        await invalidation.publish("channel", new_channel["id"])
+        audit_log.record(
+            "create", "channel", new_channel["id"], channel.tenant_id, after=dict(new_channel), request=request
+        )
+        return parse_channel_record(new_channel)
     except HTTPException:
         raise
     except Exception as e:
@@ -177,95 +351,68 @@ async def create_channel(channel: ChannelCreate):
 async def update_channel(
     channel_id: UUID,
     channel_update: ChannelUpdate,
+    request: Request,
     tenant_id: UUID = Query(..., description="Tenant ID for verification"),
 ):
     """
     Update a channel
     """
+    if not channel_update.model_dump(exclude_none=True):
+        # No updates provided, just return existing channel
+        return await get_channel(channel_id, tenant_id)
+
     async with get_db_connection() as conn:
-        # Verify channel exists and belongs to tenant
-        check_query = "SELECT id FROM channels WHERE id = $1 AND tenant_id = $2"
-        exists = await conn.fetchval(check_query, str(channel_id), str(tenant_id))
+        updated_channel = await statements.fetchrow(
+            conn,
+            UPDATE_CHANNEL,
+            str(channel_id),
+            str(tenant_id),
+            channel_update.name,
+            channel_update.description,
+            channel_update.icon,
+            channel_update.color,
+            json.dumps(channel_update.metadata) if channel_update.metadata is not None else None,
+        )
 
-        if not exists:
+        if not updated_channel:
             raise HTTPException(
                 status_code=404,
                 detail=f"Channel {channel_id} not found or does not belong to tenant"
             )
 
-        # Build update query dynamically
-        updates = []
-        params = []
-        param_count = 1
-
-        if channel_update.name is not None:
-            updates.append(f"name = ${param_count}")
-            params.append(channel_update.name)
-            param_count += 1
-
-        if channel_update.description is not None:
-            updates.append(f"description = ${param_count}")
-            params.append(channel_update.description)
-            param_count += 1
-
-        if channel_update.icon is not None:
-            updates.append(f"icon = ${param_count}")
-            params.append(channel_update.icon)
-            param_count += 1
-
-        if channel_update.color is not None:
-            updates.append(f"color = ${param_count}")
-            params.append(channel_update.color)
-            param_count += 1
-
-        if channel_update.metadata is not None:
-            updates.append(f"metadata = ${param_count}")
-            params.append(json.dumps(channel_update.metadata))
-            param_count += 1
-
-        if not updates:
-            # No updates provided, just return existing channel
-            return await get_channel(channel_id, tenant_id)
-
-        updates.append(f"updated_at = NOW()")
-
-        query = f"""
-            UPDATE channels
-            SET {', '.join(updates)}
-            WHERE id = ${param_count}
-            RETURNING *
-        """
-        params.append(str(channel_id))
-
-        updated_channel = await conn.fetchrow(query, *params)
-
-        return parse_channel_record(updated_channel)
+    mark_written(tenant_id)
+    await invalidation.publish("channel", channel_id)
+    audit_log.record(
+        "update", "channel", channel_id, tenant_id,
+        before=json.loads(updated_channel["previous"]), after=json.loads(updated_channel["current"]),
+        request=request
+    )
+    return parse_channel_record(updated_channel)
 
 
 @router.delete("/{channel_id}", status_code=204)
 async def delete_channel(
     channel_id: UUID,
+    request: Request,
     tenant_id: UUID = Query(..., description="Tenant ID for verification"),
 ):
     """
     Delete a channel (devices will be reassigned to Uncategorized, not deleted)
     """
     async with get_db_connection() as conn:
-        # Verify channel exists and belongs to tenant
-        check_query = "SELECT id FROM channels WHERE id = $1 AND tenant_id = $2"
-        exists = await conn.fetchval(check_query, str(channel_id), str(tenant_id))
+        # Delete channel (CASCADE will handle channel_id in devices table via SET NULL)
+        deleted = await statements.fetchrow(conn, DELETE_CHANNEL, str(channel_id), str(tenant_id))
 
-        if not exists:
+        if not deleted:
             raise HTTPException(
                 status_code=404,
                 detail=f"Channel {channel_id} not found or does not belong to tenant"
             )
 
-        # Delete channel (CASCADE will handle channel_id in devices table via SET NULL)
-        delete_query = "DELETE FROM channels WHERE id = $1"
-        await conn.execute(delete_query, str(channel_id))
-
-        return None
+    mark_written(tenant_id)
+    await invalidation.publish("channel", channel_id)
+    audit_log.record("delete", "channel", channel_id, tenant_id, before=dict(deleted), request=request)
+    return None
 
 
 @router.get("/{channel_id}/devices")
@@ -277,10 +424,9 @@ async def get_channel_devices(
     """
     Get all devices in a channel
     """
-    async with get_db_connection() as conn:
+    async with get_read_connection(tenant_id) as conn:
         # Verify channel exists
-        channel_check = "SELECT id FROM channels WHERE id = $1 AND tenant_id = $2"
-        channel_exists = await conn.fetchval(channel_check, str(channel_id), str(tenant_id))
+        channel_exists = await statements.fetchval(conn, CHANNEL_EXISTS, str(channel_id), str(tenant_id))
 
         if not channel_exists:
             raise HTTPException(
@@ -288,22 +434,136 @@ async def get_channel_devices(
                 detail=f"Channel {channel_id} not found"
             )
 
-        # Build query
-        where_conditions = ["channel_id = $1"]
-        params = [str(channel_id)]
+        devices = await statements.fetch(conn, LIST_CHANNEL_DEVICES, str(channel_id), status)
 
-        if status:
-            where_conditions.append(f"status = ${len(params) + 1}")
-            params.append(status)
+        return {"devices": [dict(device) for device in devices]}
 
-        where_clause = " AND ".join(where_conditions)
 
-        query = f"""
-            SELECT * FROM devices
-            WHERE {where_clause}
-            ORDER BY name
-        """
+async def _fetch_summary_series(conn, tenant_id: UUID, device_ids: List[str], window_start: datetime):
+    try:
+        return await statements.fetch(conn, SUMMARY_SERIES, str(tenant_id), device_ids, window_start)
+    except asyncpg.ObjectNotInPrerequisiteStateError:
+        # device_data_hourly not populated yet
+        return await statements.fetch(conn, SUMMARY_SERIES_RAW, str(tenant_id), device_ids, window_start)
+
+
+def _summary_metric(row, window_start: datetime) -> ChannelSummaryMetric:
+    sparkline: List[Optional[float]] = [None] * SPARKLINE_HOURS
+    for bucket, average in zip(row["buckets"], row["averages"]):
+        slot = int((bucket - window_start).total_seconds()) // SPARKLINE_BUCKET_SECONDS
+        if 0 <= slot < SPARKLINE_HOURS:
+            sparkline[slot] = average
+    return ChannelSummaryMetric(
+        metric_name=row["metric_name"],
+        unit=row["unit"],
+        latest_value=row["latest_value"],
+        latest_time=row["latest_time"],
+        sparkline=sparkline,
+    )
+
+
+@router.get("/{channel_id}/summary", response_model=ChannelSummary)
+async def get_channel_summary(
+    channel_id: UUID,
+    tenant_id: UUID = Query(..., description="Tenant ID for verification"),
+):
+    """
+    Channel dashboard in one call
 
-        devices = await conn.fetch(query, *params)
+    Channel info and counts, each device's status and last_seen, and per
+    device metric the latest value plus hourly averages over the last 24
+    hours. Computed with three set-based queries whatever the number of
+    devices, and cached for CHANNEL_SUMMARY_TTL_SECONDS.
+    """
+    key = str(channel_id)
+    summary = _summaries.get(key)
+    if summary is not MISSING and summary.channel.tenant_id == tenant_id:
+        return summary
 
-        return {"devices": [dict(device) for device in devices]}
+    generation = _summaries.generation
+    now = datetime.now(timezone.utc)
+    window_start = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=SPARKLINE_HOURS - 1)
+
+    async with get_read_connection(tenant_id) as conn:
+        channel = await statements.fetchrow(conn, GET_CHANNEL, key, str(tenant_id))
+        if not channel:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Channel {channel_id} not found or does not belong to tenant"
+            )
+        devices = await statements.fetch(conn, SUMMARY_DEVICES, key, str(tenant_id))
+        series = []
+        if devices:
+            series = await _fetch_summary_series(
+                conn, tenant_id, [device["id"] for device in devices], window_start
+            )
+
+    metrics: Dict[str, List[ChannelSummaryMetric]] = {}
+    for row in series:
+        metrics.setdefault(row["device_id"], []).append(_summary_metric(row, window_start))
+    status_counts: Dict[str, int] = {}
+    summary_devices = []
+    for device in devices:
+        device_status = device["status"] or "unknown"
+        status_counts[device_status] = status_counts.get(device_status, 0) + 1
+        summary_devices.append(ChannelSummaryDevice(
+            **dict(device),
+            metrics=sorted(metrics.get(device["id"], []), key=lambda metric: metric.metric_name),
+        ))
+
+    summary = ChannelSummary(
+        channel=parse_channel_record(channel),
+        status_counts=status_counts,
+        window_start=window_start,
+        bucket_seconds=SPARKLINE_BUCKET_SECONDS,
+        devices=summary_devices,
+        generated_at=now,
+    )
+    _summaries.set(key, summary, generation)
+    return summary
+
+
+# ===== CHANNEL PERCENTILES =====
+
+CHANNEL_DEVICE_IDS = statements.register("channels.device_ids", """
+    SELECT id FROM devices WHERE channel_id = $1 AND tenant_id = $2
+""")
+
+
+@router.get("/{channel_id}/percentiles", response_model=PercentilesResponse)
+async def get_channel_percentiles(
+    channel_id: UUID,
+    tenant_id: UUID = Query(..., description="Tenant ID for verification"),
+    metric_name: str = Query(..., min_length=1, max_length=100, description="Metric name"),
+    start_time: Optional[datetime] = Query(None, description="Range start, ISO 8601 (default: 24 hours before end_time)"),
+    end_time: Optional[datetime] = Query(None, description="Range end, exclusive, ISO 8601 (default: now)"),
+    percentiles: str = Query(DEFAULT_PERCENTILES, description="Comma separated percentiles, 0-100"),
+):
+    """
+    Percentiles of a metric across all of a channel's devices
+
+    The devices' rollup sketches are merged into one, so this is the
+    percentile of the pooled values (not an average of per-device
+    percentiles), within relative_accuracy (1%) of the exact value.
+    """
+    try:
+        start_time, end_time, requested = resolve_query(start_time, end_time, percentiles)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async with get_read_connection(tenant_id) as conn:
+        channel = await statements.fetchrow(conn, GET_CHANNEL, str(channel_id), str(tenant_id))
+        if not channel:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Channel {channel_id} not found or does not belong to tenant"
+            )
+        device_ids = [row["id"] for row in await statements.fetch(conn, CHANNEL_DEVICE_IDS, str(channel_id), str(tenant_id))]
+        result = await range_percentiles(conn, tenant_id, device_ids, metric_name, start_time, end_time, requested)
+    return PercentilesResponse(
+        metric_name=metric_name,
+        start_time=start_time,
+        end_time=end_time,
+        device_count=len(device_ids),
+        **result
+    )
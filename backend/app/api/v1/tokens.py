@@ -0,0 +1,116 @@
+"""
+API Tokens Endpoints
+Issue, list and revoke tokens for programmatic access
+"""
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from typing import List
+from uuid import UUID
+import json
+
+from app.models.token import ApiToken, ApiTokenCreate, ApiTokenCreated
+from app.auth import check_tenant, generate_token, hash_token
+from app.database import get_db_connection
+from app.statements import statements
+from app import invalidation
+from app.audit import audit_log
+
+router = APIRouter(prefix="/api/v1/tokens", tags=["tokens"])
+
+
+_TOKEN_COLUMNS = "id, tenant_id, user_id, name, scopes, last_used_at, expires_at, is_active, created_at"
+
+INSERT_TOKEN = statements.register("api_tokens.insert", f"""
+    INSERT INTO api_tokens (tenant_id, user_id, name, token_hash, scopes, expires_at)
+    VALUES ($1, $2, $3, $4, $5::jsonb, $6)
+    RETURNING {_TOKEN_COLUMNS}
+""")
+
+LIST_TOKENS = statements.register("api_tokens.list", f"""
+    SELECT {_TOKEN_COLUMNS}
+    FROM api_tokens
+    WHERE tenant_id = $1
+    ORDER BY created_at DESC
+""")
+
+REVOKE_TOKEN = statements.register("api_tokens.revoke", f"""
+    UPDATE api_tokens SET is_active = false
+    WHERE id = $1 AND tenant_id = $2
+    RETURNING token_hash, {_TOKEN_COLUMNS}
+""")
+
+
+def parse_token_record(record) -> dict:
+    """DB record to ApiToken fields (scopes arrive as JSON text)"""
+    data = dict(record)
+    data.pop("token_hash", None)
+    if isinstance(data.get("scopes"), str):
+        data["scopes"] = json.loads(data["scopes"])
+    return data
+
+
+@router.post("/", response_model=ApiTokenCreated, status_code=201)
+async def create_token(token: ApiTokenCreate, request: Request):
+    """
+    Issue an API token
+
+    The token itself is only returned here; the database keeps its
+    SHA-256 hash. Send it as "Authorization: Bearer <token>".
+    """
+    check_tenant(request, token.tenant_id)
+    secret = generate_token()
+    async with get_db_connection() as conn:
+        created = await statements.fetchrow(
+            conn,
+            INSERT_TOKEN,
+            str(token.tenant_id),
+            str(token.user_id) if token.user_id else None,
+            token.name,
+            hash_token(secret),
+            json.dumps(token.scopes),
+            token.expires_at,
+        )
+    audit_log.record("create", "api_token", created["id"], token.tenant_id, after=dict(created), request=request)
+    return ApiTokenCreated(**parse_token_record(created), token=secret)
+
+
+@router.get("/", response_model=List[ApiToken])
+async def list_tokens(
+    tenant_id: UUID = Query(..., description="Tenant ID for filtering"),
+):
+    """
+    List a tenant's API tokens (without secrets)
+    """
+    async with get_db_connection() as conn:
+        tokens = await statements.fetch(conn, LIST_TOKENS, str(tenant_id))
+    return [ApiToken(**parse_token_record(token)) for token in tokens]
+
+
+@router.delete("/{token_id}", response_model=ApiToken)
+async def revoke_token(
+    token_id: UUID,
+    request: Request,
+    tenant_id: UUID = Query(..., description="Tenant ID for verification"),
+):
+    """
+    Revoke an API token
+
+    Takes effect on every worker as soon as the invalidation arrives
+    (with INVALIDATION_ENABLED off, within AUTH_TOKEN_CACHE_TTL_SECONDS).
+    """
+    async with get_db_connection() as conn:
+        revoked = await statements.fetchrow(conn, REVOKE_TOKEN, str(token_id), str(tenant_id))
+
+    if not revoked:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Token {token_id} not found or does not belong to tenant"
+        )
+
+    # Also published by the api_tokens trigger; this applies it locally at once
+    await invalidation.publish("api_token", revoked["token_hash"])
+    audit_log.record(
+        "update", "api_token", token_id, tenant_id,
+        before={"is_active": True}, after={"is_active": False}, request=request
+    )
+    return ApiToken(**parse_token_record(revoked))
@@ -0,0 +1,311 @@
+"""
+Audit Log
+Non-blocking capture of create/update/delete events, flushed to audit_logs in batches
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import Request
+
+from app.config import settings
+from app.database import get_db_connection, POOL_BACKGROUND
+from app.metrics import registry
+from app.statements import statements
+
+
+logger = logging.getLogger(__name__)
+
+# Never written to the audit trail
+REDACTED_FIELDS = frozenset({"device_key", "device_secret"})
+REDACTED = "[redacted]"
+
+# A foreign spill file untouched for this long belongs to a worker that
+# stopped, and is replayed by whichever worker finds it first
+SPILL_CLAIM_SECONDS = 300.0
+
+# Events carry a client-generated id, so replaying a spilled batch that was
+# partly stored before a crash does not duplicate rows
+INSERT_AUDIT_LOGS = statements.register("audit_logs.insert", """
+    INSERT INTO audit_logs (
+        id, tenant_id, user_id, action, resource_type, resource_id,
+        changes, ip_address, user_agent, status, error_message, created_at
+    )
+    SELECT
+        e.id, e.tenant_id, e.user_id, e.action, e.resource_type, e.resource_id,
+        e.changes::jsonb, e.ip_address::inet, e.user_agent, e.status, e.error_message, e.created_at
+    FROM unnest(
+        $1::uuid[], $2::uuid[], $3::uuid[], $4::text[], $5::text[], $6::uuid[],
+        $7::text[], $8::text[], $9::text[], $10::text[], $11::text[], $12::timestamptz[]
+    ) AS e(
+        id, tenant_id, user_id, action, resource_type, resource_id,
+        changes, ip_address, user_agent, status, error_message, created_at
+    )
+    ON CONFLICT (id) DO NOTHING
+""")
+
+# One audit_logs row, in INSERT_AUDIT_LOGS column order (created_at as ISO text
+# while queued, so spilled events round-trip through JSON unchanged)
+AuditEvent = Tuple[
+    str, Optional[str], Optional[str], str, str, Optional[str],
+    str, Optional[str], Optional[str], str, Optional[str], str,
+]
+
+
+def _redact(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: REDACTED if key in REDACTED_FIELDS else value for key, value in row.items()}
+
+
+def diff(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Changes recorded for an event
+
+    Creates keep the new row ("after"), deletes the old one ("before") and
+    updates only the fields whose value changed, on both sides.
+    Credentials are redacted.
+    """
+    if before is None or after is None:
+        return {key: _redact(row) for key, row in (("before", before), ("after", after)) if row is not None}
+    changed = [key for key, value in after.items() if key in before and before[key] != value]
+    return {
+        "before": _redact({key: before[key] for key in changed}),
+        "after": _redact({key: after[key] for key in changed}),
+    }
+
+
+class AuditWriter:
+    """
+    Bounded in-memory queue of audit events with a background flusher
+
+    record() only appends to the queue, so a mutation never waits on the
+    audit insert. The flusher writes up to AUDIT_BATCH_SIZE events per
+    statement every AUDIT_FLUSH_INTERVAL_SECONDS (or as soon as a batch
+    fills). If the insert fails, the batch is appended to this worker's
+    spill file (JSON lines under AUDIT_SPILL_DIR) and replayed after the
+    next successful flush. When the queue is full new events are dropped
+    and counted. stop() flushes whatever is queued.
+    """
+
+    def __init__(self):
+        self._queue: Deque[AuditEvent] = deque()
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._spill_path = os.path.join(settings.AUDIT_SPILL_DIR, f"audit-{os.getpid()}.jsonl")
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.failures = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="audit-writer")
+
+    async def stop(self):
+        """Stop the flusher and write (or spill) everything still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        while self._queue:
+            await self._flush()
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            "queued": len(self._queue),
+            "max_queued": settings.AUDIT_QUEUE_SIZE,
+            "written": self.written,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+            "failures": self.failures,
+        }
+
+    def record(
+        self,
+        action: str,
+        resource_type: str,
+        resource_id: Optional[Any],
+        tenant_id: Optional[Any],
+        before: Optional[Dict[str, Any]] = None,
+        after: Optional[Dict[str, Any]] = None,
+        request: Optional[Request] = None,
+        user_id: Optional[Any] = None,
+    ):
+        """
+        Queue an audit event (never blocks, never raises)
+
+        Args:
+            action: "create", "update" or "delete"
+            resource_type: e.g. "device" or "channel"
+            resource_id: Changed row id
+            tenant_id: Tenant owning the row
+            before: Row before the change (None for creates)
+            after: Row after the change (None for deletes)
+            request: Request, for the client address, user agent and (if
+                authenticated with an API token) the acting user
+            user_id: Acting user, if known otherwise
+        """
+        if not settings.AUDIT_ENABLED:
+            return
+        if user_id is None and request is not None:
+            principal = getattr(request.state, "principal", None)
+            user_id = principal.user_id if principal is not None else None
+        if len(self._queue) >= settings.AUDIT_QUEUE_SIZE:
+            self.dropped += 1
+            return
+        self._queue.append((
+            str(uuid.uuid4()),
+            str(tenant_id) if tenant_id is not None else None,
+            str(user_id) if user_id is not None else None,
+            action,
+            resource_type,
+            str(resource_id) if resource_id is not None else None,
+            json.dumps(diff(before, after), default=str),
+            request.client.host if request is not None and request.client else None,
+            request.headers.get("user-agent") if request is not None else None,
+            "success",
+            None,
+            datetime.now(timezone.utc).isoformat(),
+        ))
+        if len(self._queue) >= settings.AUDIT_BATCH_SIZE:
+            self._ready.set()
+
+    async def record_many(
+        self,
+        action: str,
+        resource_type: str,
+        events: Iterable[Tuple[Any, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]],
+        tenant_id: Optional[Any],
+        request: Optional[Request] = None,
+    ):
+        """
+        Queue one audit event per row of a bulk change
+
+        Unlike record(), a full queue is not dropped from: a batch is
+        flushed (or spilled) in the caller first, so large bulk operations
+        are audited completely and pay for it themselves.
+
+        Args:
+            action: "create", "update" or "delete"
+            resource_type: e.g. "device"
+            events: (resource id, before, after) per changed row
+            tenant_id: Tenant owning the rows
+            request: Request, as for record()
+        """
+        if not settings.AUDIT_ENABLED:
+            return
+        for resource_id, before, after in events:
+            if len(self._queue) >= settings.AUDIT_QUEUE_SIZE:
+                await self._flush()
+            self.record(action, resource_type, resource_id, tenant_id, before=before, after=after, request=request)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout=settings.AUDIT_FLUSH_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._ready.clear()
+            try:
+                while self._queue:
+                    if not await self._flush():
+                        break
+                else:
+                    await self._replay_spilled()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Audit flush failed: %s", e)
+
+    async def _insert(self, events: List[AuditEvent]):
+        columns = [list(column) for column in zip(*events)]
+        columns[-1] = [datetime.fromisoformat(value) for value in columns[-1]]
+        async with get_db_connection(POOL_BACKGROUND) as conn:
+            await statements.fetch(conn, INSERT_AUDIT_LOGS, *columns)
+
+    async def _flush(self) -> bool:
+        """Write one batch; spill it on failure. Returns whether the insert succeeded"""
+        batch = [self._queue.popleft() for _ in range(min(settings.AUDIT_BATCH_SIZE, len(self._queue)))]
+        try:
+            await self._insert(batch)
+        except Exception as e:
+            self.failures += 1
+            logger.warning("Audit insert failed (%s); spilling %d events to %s", e, len(batch), self._spill_path)
+            await asyncio.to_thread(self._spill, batch)
+            return False
+        self.written += len(batch)
+        return True
+
+    def _spill(self, events: List[AuditEvent]):
+        try:
+            os.makedirs(settings.AUDIT_SPILL_DIR, exist_ok=True)
+            with open(self._spill_path, "a", encoding="utf-8") as spill:
+                spill.writelines(json.dumps(event) + "\n" for event in events)
+            self.spilled += len(events)
+        except OSError as e:
+            self.dropped += len(events)
+            logger.error("Could not spill %d audit events: %s", len(events), e)
+
+    def _claim_spilled(self) -> List[str]:
+        """Rename replayable spill files (ours, and stale ones of stopped workers) for replay"""
+        try:
+            names = os.listdir(settings.AUDIT_SPILL_DIR)
+        except FileNotFoundError:
+            return []
+        claimed = []
+        now = time.time()
+        own = os.path.basename(self._spill_path)
+        for name in names:
+            path = os.path.join(settings.AUDIT_SPILL_DIR, name)
+            try:
+                if name.endswith(".replay"):
+                    # Left by a replay that failed part-way (ours or a stopped worker's)
+                    if name.startswith(f"{own}.") or now - os.path.getmtime(path) > SPILL_CLAIM_SECONDS:
+                        claimed.append(path)
+                elif name.endswith(".jsonl") and (name == own or now - os.path.getmtime(path) > SPILL_CLAIM_SECONDS):
+                    target = f"{os.path.join(settings.AUDIT_SPILL_DIR, own)}.{uuid.uuid4().hex}.replay"
+                    os.rename(path, target)
+                    claimed.append(target)
+            except OSError:
+                continue  # claimed by another worker in the meantime
+        return claimed
+
+    async def _replay_spilled(self):
+        for path in await asyncio.to_thread(self._claim_spilled):
+            with open(path, encoding="utf-8") as spill:
+                events = [tuple(json.loads(line)) for line in spill if line.strip()]
+            for start in range(0, len(events), settings.AUDIT_BATCH_SIZE):
+                await self._insert(events[start:start + settings.AUDIT_BATCH_SIZE])
+            os.remove(path)
+            self.replayed += len(events)
+            logger.info("Replayed %d spilled audit events from %s", len(events), path)
+
+
+# Process-wide writer
+audit_log = AuditWriter()
+
+
+@registry.register_collector
+def _collect_audit_metrics():
+    yield (
+        "iotlinker_audit_events", "counter", "Audit events by outcome",
+        [
+            ("_total", {"outcome": "written"}, audit_log.written),
+            ("_total", {"outcome": "dropped"}, audit_log.dropped),
+            ("_total", {"outcome": "spilled"}, audit_log.spilled),
+            ("_total", {"outcome": "replayed"}, audit_log.replayed),
+        ],
+    )
+    yield (
+        "iotlinker_audit_queued", "gauge", "Audit events waiting to be written",
+        [("", {}, len(audit_log._queue))],
+    )
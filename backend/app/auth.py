@@ -0,0 +1,284 @@
+"""
+API Token Authentication
+Bearer tokens verified by hash against api_tokens through an in-process cache
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import secrets
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, FrozenSet, Optional
+from uuid import UUID
+
+from fastapi import HTTPException, Request, status
+
+from app.cache import TTLCache, MISSING
+from app.config import settings
+from app.database import get_db_connection, POOL_BACKGROUND
+from app.statements import statements
+from app import invalidation
+
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PREFIX = "iotl_"
+
+GET_TOKEN = statements.register("api_tokens.verify", """
+    SELECT id::text AS id, tenant_id::text AS tenant_id, user_id::text AS user_id, scopes, expires_at
+    FROM api_tokens
+    WHERE token_hash = $1
+        AND is_active
+        AND (expires_at IS NULL OR expires_at > NOW())
+""")
+
+TOUCH_TOKENS = statements.register("api_tokens.touch", """
+    UPDATE api_tokens t
+    SET last_used_at = GREATEST(t.last_used_at, u.used)
+    FROM unnest($1::uuid[], $2::timestamptz[]) AS u(id, used)
+    WHERE t.id = u.id
+""")
+
+
+@dataclass(frozen=True)
+class TokenPrincipal:
+    """The caller behind a verified API token"""
+    token_id: str
+    tenant_id: str
+    user_id: Optional[str]
+    scopes: FrozenSet[str]
+    expires_at: Optional[datetime]
+
+
+def generate_token() -> str:
+    """New random API token (shown to its owner once; only the hash is stored)"""
+    return TOKEN_PREFIX + secrets.token_urlsafe(32)
+
+
+def hash_token(token: str) -> str:
+    """
+    token_hash of a token
+
+    Tokens are 256-bit random strings, so a single SHA-256 is enough (a
+    slow password hash would only add latency to every request).
+    """
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+# Verified tokens and unknown/revoked ones, by token hash. Unknown hashes
+# have their own short-lived cache, so a flood of bogus tokens neither
+# reaches the database every time nor evicts valid entries. Token changes
+# are published by a trigger on api_tokens (migration 20241213000015). While
+# they cannot be received, both keep caching with a short TTL rather than
+# adding a lookup to every request.
+_tokens = TTLCache(
+    "api_tokens", settings.AUTH_TOKEN_CACHE_SIZE, settings.AUTH_TOKEN_CACHE_TTL_SECONDS,
+    outage_ttl_seconds=settings.AUTH_TOKEN_OUTAGE_TTL_SECONDS,
+)
+_unknown_tokens = TTLCache(
+    "api_tokens_unknown", settings.AUTH_TOKEN_CACHE_SIZE, settings.AUTH_NEGATIVE_CACHE_TTL_SECONDS,
+    outage_ttl_seconds=min(settings.AUTH_NEGATIVE_CACHE_TTL_SECONDS, settings.AUTH_TOKEN_OUTAGE_TTL_SECONDS),
+)
+invalidation.subscribe("api_token", _tokens)
+invalidation.subscribe("api_token", _unknown_tokens)
+
+
+async def verify_token(token: str) -> Optional[TokenPrincipal]:
+    """Principal of an active, unexpired token, or None"""
+    token_hash = hash_token(token)
+    principal = _tokens.get(token_hash)
+    if principal is MISSING:
+        if _unknown_tokens.get(token_hash) is not MISSING:
+            return None
+        generation, unknown_generation = _tokens.generation, _unknown_tokens.generation
+        async with get_db_connection() as conn:
+            row = await statements.fetchrow(conn, GET_TOKEN, token_hash)
+        if row is None:
+            _unknown_tokens.set(token_hash, True, unknown_generation)
+            return None
+        principal = TokenPrincipal(
+            token_id=row["id"],
+            tenant_id=row["tenant_id"],
+            user_id=row["user_id"],
+            scopes=frozenset(_scopes(row["scopes"])),
+            expires_at=row["expires_at"],
+        )
+        _tokens.set(token_hash, principal, generation)
+    if principal.expires_at is not None and principal.expires_at <= datetime.now(timezone.utc):
+        return None
+    last_used.touch(principal.token_id)
+    return principal
+
+
+def _scopes(value: Any):
+    # jsonb arrives as text
+    if isinstance(value, str):
+        value = json.loads(value)
+    return value or ()
+
+
+# =====================================================
+# REQUEST DEPENDENCY
+# =====================================================
+
+# Endpoints that authenticate the device itself (device_key) instead
+_device_endpoints = set()
+
+
+def device_authenticated(endpoint: Callable) -> Callable:
+    """Exempt an endpoint from token auth; it checks device credentials itself"""
+    _device_endpoints.add(endpoint)
+    return endpoint
+
+
+def _unauthorized(detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+async def authenticate(request: Request) -> Optional[TokenPrincipal]:
+    """
+    Router dependency verifying the Authorization: Bearer token
+
+    A presented token must be valid; requests without one are rejected
+    only when AUTH_REQUIRED is set. The caller's tenant must match any
+    tenant_id query parameter (other tenants are checked by the endpoints
+    with check_tenant()). The principal is left in request.state.principal.
+
+    Raises:
+        HTTPException: 401 for a missing or invalid token, 403 for another tenant
+    """
+    route = request.scope.get("route")
+    if getattr(route, "endpoint", None) in _device_endpoints:
+        return None
+
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if not token or scheme.lower() != "bearer":
+        if settings.AUTH_REQUIRED:
+            raise _unauthorized("Missing bearer token")
+        return None
+
+    principal = await verify_token(token.strip())
+    if principal is None:
+        raise _unauthorized("Invalid or revoked token")
+
+    tenant_id = request.query_params.get("tenant_id")
+    if tenant_id is not None:
+        try:
+            same_tenant = UUID(tenant_id) == UUID(principal.tenant_id)
+        except ValueError:
+            same_tenant = True  # rejected by parameter validation instead
+        if not same_tenant:
+            raise _forbidden()
+
+    request.state.principal = principal
+    return principal
+
+
+def check_tenant(request: Request, tenant_id: Any):
+    """
+    Reject a tenant other than the caller's
+
+    authenticate() only sees tenant_id query parameters; endpoints call
+    this for tenants arriving in a body or owning a device or channel
+    named in the path. Requests without a token pass (see AUTH_REQUIRED).
+
+    Args:
+        request: Request (principal left by authenticate())
+        tenant_id: Tenant the request acts on (UUID or its string)
+
+    Raises:
+        HTTPException: 403 for another tenant
+    """
+    principal = getattr(request.state, "principal", None)
+    if principal is None:
+        return
+    try:
+        same_tenant = UUID(str(tenant_id)) == UUID(principal.tenant_id)
+    except ValueError:
+        same_tenant = False  # not a tenant id at all, so not the caller's
+    if not same_tenant:
+        raise _forbidden()
+
+
+def _forbidden() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail="Token does not grant access to this tenant"
+    )
+
+
+# =====================================================
+# DEBOUNCED last_used_at
+# =====================================================
+
+class LastUsedWriter:
+    """
+    Batches last_used_at updates of verified tokens
+
+    touch() only records the time in memory; every
+    AUTH_LAST_USED_FLUSH_SECONDS the latest use of each token is written in
+    one UPDATE, and once more on shutdown.
+    """
+
+    def __init__(self):
+        self._pending: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+
+    def touch(self, token_id: str):
+        self._pending[token_id] = time.time()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="token-last-used")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.warning("Could not write token last_used_at on shutdown: %s", e)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.AUTH_LAST_USED_FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Token last_used_at flush failed: %s", e)
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            async with get_db_connection(POOL_BACKGROUND) as conn:
+                await statements.fetchval(
+                    conn,
+                    TOUCH_TOKENS,
+                    list(pending),
+                    [datetime.fromtimestamp(used, timezone.utc) for used in pending.values()],
+                )
+        except BaseException:
+            # Retry with the next flush; newer uses recorded meanwhile win
+            for token_id, used in pending.items():
+                if self._pending.get(token_id, 0.0) < used:
+                    self._pending[token_id] = used
+            raise
+        self.flushes += 1
+
+
+# Process-wide writer
+last_used = LastUsedWriter()
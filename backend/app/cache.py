@@ -0,0 +1,151 @@
+"""
+In-Process Caches
+Bounded LRU caches with TTL, hit/miss counters and named registration
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from app.metrics import registry
+
+
+# Sentinel for misses, so None can be cached (e.g. "device has no channel")
+MISSING = object()
+
+# Every cache created through TTLCache, by name (for metrics and resync)
+_caches: Dict[str, "TTLCache"] = {}
+
+# Cleared while cross-worker invalidations cannot be received (see
+# app.invalidation). Caches that rely on them are then emptied and either
+# bypassed or limited to their outage TTL, so no worker serves entries
+# another worker may have changed for long; caches nothing invalidates (such
+# as ingest replays) are unaffected.
+_invalidations_live = True
+
+
+class TTLCache:
+    """
+    LRU cache whose entries expire after ttl_seconds
+
+    Entries are dropped explicitly through invalidate()/clear() when the
+    underlying row changes (see app.invalidation); the TTL only bounds
+    staleness if an invalidation is ever missed. To avoid caching a value
+    read before a concurrent invalidation, read `generation` before loading
+    and pass it to set(), which then skips the write if anything was
+    invalidated in between.
+
+    While invalidations cannot be received, a cache subscribed to them is
+    bypassed, or keeps caching with outage_ttl_seconds if one is given.
+    """
+
+    def __init__(self, name: str, max_size: int, ttl_seconds: float, outage_ttl_seconds: Optional[float] = None):
+        if name in _caches:
+            raise ValueError(f"Cache '{name}' is already registered")
+        self.name = name
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.outage_ttl_seconds = outage_ttl_seconds
+        # Set by app.invalidation.subscribe()
+        self.invalidated = False
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        _caches[name] = self
+
+    def get(self, key: Hashable) -> Any:
+        """Cached value, or MISSING if absent, expired or caching is suspended"""
+        if self._ttl() is None:
+            self.misses += 1
+            return MISSING
+        entry = self._data.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return MISSING
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None):
+        ttl = self._ttl()
+        if ttl is None or (generation is not None and generation != self.generation):
+            return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def _ttl(self) -> Optional[float]:
+        """TTL of new entries, None while the cache is suspended"""
+        if _invalidations_live or not self.invalidated:
+            return self.ttl_seconds
+        return self.outage_ttl_seconds
+
+    def invalidate(self, key: Hashable):
+        self.generation += 1
+        self._data.pop(key, None)
+
+    def clear(self):
+        self.generation += 1
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+def get_cache(name: str) -> Optional[TTLCache]:
+    return _caches.get(name)
+
+
+def get_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Stats of every registered cache"""
+    return {name: cache.get_stats() for name, cache in _caches.items()}
+
+
+def clear_invalidated():
+    """Drop every entry of the caches relying on invalidations (after a missed-invalidation window)"""
+    for cache in _caches.values():
+        if cache.invalidated:
+            cache.clear()
+
+
+def set_invalidations_live(live: bool):
+    """Resume, or empty and suspend, the caches relying on invalidations"""
+    global _invalidations_live
+    _invalidations_live = live
+    if not live:
+        clear_invalidated()
+
+
+@registry.register_collector
+def _collect_cache_metrics():
+    caches = list(_caches.values())
+    yield (
+        "iotlinker_cache_lookups", "counter", "In-process cache lookups by result",
+        [
+            sample
+            for cache in caches
+            for sample in (
+                ("_total", {"cache": cache.name, "result": "hit"}, cache.hits),
+                ("_total", {"cache": cache.name, "result": "miss"}, cache.misses),
+            )
+        ],
+    )
+    yield (
+        "iotlinker_cache_entries", "gauge", "Entries currently held per cache",
+        [("", {"cache": cache.name}, len(cache)) for cache in caches],
+    )
@@ -25,6 +25,88 @@ class Settings(BaseSettings):
 
     # Database Configuration
     DATABASE_URL: str
+    DB_COMMAND_TIMEOUT: float = 60.0
+
+    # Database Pools (one budget per traffic class; acquire timeouts in seconds)
+    DB_POOL_INGEST_MIN_SIZE: int = 2
+    DB_POOL_INGEST_MAX_SIZE: int = 10
+    DB_POOL_INGEST_ACQUIRE_TIMEOUT: float = 0.5
+    DB_POOL_INTERACTIVE_MIN_SIZE: int = 2
+    DB_POOL_INTERACTIVE_MAX_SIZE: int = 10
+    DB_POOL_INTERACTIVE_ACQUIRE_TIMEOUT: float = 2.0
+    DB_POOL_BACKGROUND_MIN_SIZE: int = 1
+    DB_POOL_BACKGROUND_MAX_SIZE: int = 6
+    DB_POOL_BACKGROUND_ACQUIRE_TIMEOUT: float = 30.0
+
+    # Optional streaming read replica for read-only queries (see app.database).
+    # Reads fall back to the primary while the replica is unreachable or lags
+    # by more than DB_REPLICA_MAX_LAG_SECONDS, and for a tenant for that long
+    # after this worker wrote on its behalf (read-your-writes)
+    DATABASE_REPLICA_URL: Optional[str] = None
+    DB_POOL_REPLICA_MIN_SIZE: int = 2
+    DB_POOL_REPLICA_MAX_SIZE: int = 10
+    DB_POOL_REPLICA_ACQUIRE_TIMEOUT: float = 2.0
+    DB_REPLICA_MAX_LAG_SECONDS: float = 5.0
+    DB_REPLICA_CHECK_INTERVAL_SECONDS: float = 2.0
+
+    # Ingest rate limits (token buckets, in data points per second / burst size)
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_DEVICE_RATE: float = 50.0
+    RATE_LIMIT_DEVICE_BURST: float = 500.0
+    RATE_LIMIT_TENANT_RATE: float = 2000.0
+    RATE_LIMIT_TENANT_BURST: float = 10000.0
+    RATE_LIMIT_GLOBAL_RATE: float = 20000.0
+    RATE_LIMIT_GLOBAL_BURST: float = 50000.0
+    RATE_LIMIT_MAX_KEYS: int = 100000
+
+    # Adaptive load shedding of reads when pool acquire wait climbs
+    SHEDDING_ENABLED: bool = True
+    SHEDDING_WAIT_THRESHOLD_MS: float = 100.0
+
+    # In-process caches and cross-worker invalidation (LISTEN/NOTIFY)
+    CACHE_TTL_SECONDS: float = 300.0
+    CACHE_MAX_ENTRIES: int = 50000
+    INVALIDATION_ENABLED: bool = True
+    CHANNEL_SUMMARY_TTL_SECONDS: float = 5.0  # dashboard summaries; device changes show up after this
+
+    # Bulk device provisioning and updates
+    BULK_PROVISION_MAX_DEVICES: int = 50000
+    BULK_UPDATE_CHUNK_SIZE: int = 1000
+    BULK_JOB_LEASE_SECONDS: float = 60.0  # a job whose worker died is resumed by another after this
+
+    # Ingest idempotency (channels override the policy with metadata.ingest_on_conflict)
+    INGEST_ON_CONFLICT: str = "ignore"  # "ignore" or "update" (last write wins)
+    INGEST_REPLAY_TTL_SECONDS: float = 600.0
+    BACKFILL_CHUNK_POINTS: int = 5000  # records written and acknowledged per transaction
+    SENSOR_SCHEMA_VALIDATION: bool = True  # reject points that break their device type's sensor_schema
+
+    # Hot window: recent points per (device, metric) in memory, serving
+    # short-range reads of GET /devices/{id}/data. Each worker only sees
+    # its own ingest, so enable it only with a single API worker.
+    HOT_WINDOW_ENABLED: bool = False
+    HOT_WINDOW_SERIES_POINTS: int = 3600  # ring capacity per series
+    HOT_WINDOW_MAX_BYTES: int = 64 * 1024 * 1024  # least recently used series are evicted above this
+
+    # Device search (per-tenant in-memory prefix index for type-ahead)
+    SEARCH_INDEX_ENABLED: bool = True
+    SEARCH_INDEX_MAX_TENANTS: int = 200
+    SEARCH_INDEX_MAX_DEVICES: int = 50000  # larger tenants use the database prefix query
+
+    # API token auth (Authorization: Bearer). Off: tokens are verified when
+    # sent but not required, so existing clients keep working.
+    AUTH_REQUIRED: bool = False
+    AUTH_TOKEN_CACHE_SIZE: int = 10000
+    AUTH_TOKEN_CACHE_TTL_SECONDS: float = 60.0  # revocations also arrive via invalidation
+    AUTH_NEGATIVE_CACHE_TTL_SECONDS: float = 5.0
+    AUTH_TOKEN_OUTAGE_TTL_SECONDS: float = 5.0  # token cache TTL while invalidations are not received
+    AUTH_LAST_USED_FLUSH_SECONDS: float = 60.0
+
+    # Audit log (events are queued in memory and written in batches)
+    AUDIT_ENABLED: bool = True
+    AUDIT_QUEUE_SIZE: int = 10000  # events beyond this are dropped (and counted)
+    AUDIT_BATCH_SIZE: int = 500
+    AUDIT_FLUSH_INTERVAL_SECONDS: float = 1.0
+    AUDIT_SPILL_DIR: str = "data/audit-spill"  # batches that could not be written, replayed later
 
     # Pagination
     DEFAULT_PAGE_SIZE: int = 20
@@ -33,6 +115,51 @@ class Settings(BaseSettings):
     # Logging
     LOG_LEVEL: str = "INFO"
 
+    # Request profiling (opt-in; adds Server-Timing headers and budget warnings)
+    PROFILING_ENABLED: bool = False
+    PROFILING_MAX_CALLS: int = 10
+    PROFILING_MAX_DURATION_MS: float = 500.0
+    PROFILING_REPEAT_THRESHOLD: int = 3
+    PROFILING_SAMPLE_RATE: float = 0.05
+    PROFILING_DUMP_DIR: str = "data/profiles"
+
+    # Background Jobs
+    JOBS_ENABLED: bool = True
+
+    # Durable local job queue for deferred work such as webhooks (see app.jobs.queue)
+    JOB_QUEUE_PATH: str = "data/jobs.sqlite3"  # shared by the API workers of a host
+    JOB_QUEUE_WORKERS: int = 4  # jobs run concurrently per API worker
+    JOB_QUEUE_MAX_DEPTH: int = 100000  # pending jobs beyond this are rejected (and counted)
+    JOB_QUEUE_MAX_ATTEMPTS: int = 8  # then the job is dead-lettered
+    JOB_QUEUE_BACKOFF_SECONDS: float = 2.0  # doubles per attempt
+    JOB_QUEUE_MAX_BACKOFF_SECONDS: float = 600.0
+    JOB_QUEUE_TIMEOUT_SECONDS: float = 30.0
+    JOB_QUEUE_POLL_SECONDS: float = 1.0
+
+    # Predictive Maintenance Scoring
+    PREDICTION_JOB_INTERVAL_MINUTES: int = 60
+    PREDICTION_LOOKBACK_HOURS: int = 168
+    PREDICTION_RECENT_HOURS: int = 24
+    PREDICTION_WORKERS: int = 2
+
+    # Retention (per-tenant overrides live in the retention_policies table)
+    RETENTION_JOB_INTERVAL_MINUTES: int = 1440
+    RETENTION_RAW_DAYS: int = 30
+    RETENTION_MINUTE_DAYS: Optional[int] = 180
+    RETENTION_HOURLY_DAYS: Optional[int] = None  # None = keep forever
+    RETENTION_REFRESH_AGGREGATES: bool = True
+
+    # Hourly/daily rollup views (with percentile sketches); 0 leaves the
+    # refresh to something else, e.g. pg_cron
+    ROLLUP_REFRESH_INTERVAL_MINUTES: int = 60
+    ROLLUP_REFRESH_TIMEOUT_SECONDS: float = 1800.0
+
+    # Cold-tier Parquet archive (local path or pyarrow URI, e.g. s3://bucket/prefix)
+    ARCHIVE_ENABLED: bool = False
+    ARCHIVE_AFTER_DAYS: int = 14
+    ARCHIVE_URI: str = "data/archive"
+    ARCHIVE_JOB_INTERVAL_MINUTES: int = 1440
+
     model_config = SettingsConfigDict(
         env_file=".env",
         case_sensitive=True
@@ -3,81 +3,544 @@ Database Connection and Utilities
 Provides Supabase client and database connection helpers
 """
 
-from supabase import create_client, Client
+from fastapi import HTTPException
 from app.config import settings
-from typing import Optional
+from typing import Optional, Dict, Any, TYPE_CHECKING
+from bisect import bisect_left
+import asyncio
+import logging
+import math
+import threading
+import time
 import asyncpg
 from contextlib import asynccontextmanager
 
+from app.statements import statements
+from app.metrics import DB_QUERY_DURATION, histogram_samples, instrument_httpx_client, registry
+from app import profiling
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+logger = logging.getLogger(__name__)
+
 
 # Supabase Client (singleton)
-_supabase_client: Optional[Client] = None
+_supabase_client: Optional["Client"] = None
+_supabase_lock = threading.Lock()
 
 
-def get_supabase() -> Client:
+def get_supabase() -> "Client":
     """
     Get Supabase client instance (singleton pattern)
 
+    supabase (and httpx with it) is imported on first use rather than at
+    module import, which keeps worker cold start short; warm_up() creates
+    the client in the background right after startup.
+
     Returns:
         Client: Supabase client
     """
     global _supabase_client
 
     if _supabase_client is None:
-        # Create Supabase client without options to avoid proxy issues
-        _supabase_client = create_client(
-            settings.SUPABASE_URL,
-            settings.SUPABASE_SERVICE_KEY
-        )
+        # warm_up() may be creating it in a worker thread at the same time
+        with _supabase_lock:
+            if _supabase_client is None:
+                from supabase import create_client
+
+                # Create Supabase client without options to avoid proxy issues
+                client = create_client(
+                    settings.SUPABASE_URL,
+                    settings.SUPABASE_SERVICE_KEY
+                )
+                instrument_httpx_client(client.postgrest.session)
+                profiling.instrument_httpx_client(client.postgrest.session)
+                _supabase_client = client
 
     return _supabase_client
 
 
-# AsyncPG Connection Pool
-_db_pool: Optional[asyncpg.Pool] = None
+# AsyncPG Connection Pools
+#
+# Traffic is split into named pools so one class of work cannot starve
+# another: telemetry ingest, interactive API reads/writes, and background
+# jobs each get their own connection budget and acquire timeout. The
+# optional replica pool connects to DATABASE_REPLICA_URL and is only used
+# through get_read_connection().
+POOL_INGEST = "ingest"
+POOL_INTERACTIVE = "interactive"
+POOL_BACKGROUND = "background"
+POOL_REPLICA = "replica"
+POOL_NAMES = (POOL_INGEST, POOL_INTERACTIVE, POOL_BACKGROUND)
 
+# Upper bounds (seconds) of the acquire-wait histogram buckets
+ACQUIRE_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
 
-async def init_db_pool():
-    """Initialize database connection pool"""
-    global _db_pool
+# Smoothing of the recent acquire-wait average: weight of each new sample,
+# and the time constant (seconds) over which the average decays when idle
+ACQUIRE_WAIT_ALPHA = 0.2
+ACQUIRE_WAIT_DECAY_SECONDS = 5.0
 
-    if _db_pool is None:
-        _db_pool = await asyncpg.create_pool(
-            dsn=settings.DATABASE_URL,
-            min_size=2,
-            max_size=10,
-            command_timeout=60
+_db_pools: Dict[str, asyncpg.Pool] = {}
+_pool_locks: Dict[str, asyncio.Lock] = {}
+
+
+class PoolExhaustedError(HTTPException):
+    """Raised when a connection cannot be acquired within the pool's timeout"""
+
+    def __init__(self, pool_name: str):
+        super().__init__(
+            status_code=503,
+            detail=f"Database pool '{pool_name}' is saturated, retry shortly",
+            headers={"Retry-After": "1"},
         )
+        self.pool_name = pool_name
+
+
+class PoolStats:
+    """Acquire counters, wait-time histogram and recent wait average for one pool"""
+
+    __slots__ = ("waiters", "acquires", "timeouts", "wait_sum", "bucket_counts", "wait_ewma", "wait_updated")
+
+    def __init__(self):
+        self.waiters = 0
+        self.acquires = 0
+        self.timeouts = 0
+        self.wait_sum = 0.0
+        self.bucket_counts = [0] * (len(ACQUIRE_WAIT_BUCKETS) + 1)
+        self.wait_ewma = 0.0
+        self.wait_updated = time.monotonic()
+
+    def observe(self, seconds: float):
+        self.acquires += 1
+        self.wait_sum += seconds
+        self.bucket_counts[bisect_left(ACQUIRE_WAIT_BUCKETS, seconds)] += 1
+        now = time.monotonic()
+        self.wait_ewma = self.recent_wait(now) * (1 - ACQUIRE_WAIT_ALPHA) + seconds * ACQUIRE_WAIT_ALPHA
+        self.wait_updated = now
+
+    def recent_wait(self, now: float) -> float:
+        """Smoothed acquire wait, decayed towards zero while nothing is acquired"""
+        return self.wait_ewma * math.exp((self.wait_updated - now) / ACQUIRE_WAIT_DECAY_SECONDS)
+
+
+_pool_stats: Dict[str, PoolStats] = {name: PoolStats() for name in POOL_NAMES + (POOL_REPLICA,)}
+
 
-    return _db_pool
+def _stats_pool_names():
+    """Pools reported in stats and metrics (the replica only when configured)"""
+    return POOL_NAMES + (POOL_REPLICA,) if settings.DATABASE_REPLICA_URL else POOL_NAMES
+
+
+async def _init_connection(conn: asyncpg.Connection):
+    """Per-connection setup run by asyncpg when a pool opens a connection"""
+    await statements.prepare_all(conn)
+
+
+def _pool_settings(name: str) -> Dict[str, float]:
+    """Sizing and timeouts for a named pool from Settings"""
+    prefix = f"DB_POOL_{name.upper()}"
+    return {
+        "min_size": getattr(settings, f"{prefix}_MIN_SIZE"),
+        "max_size": getattr(settings, f"{prefix}_MAX_SIZE"),
+        "acquire_timeout": getattr(settings, f"{prefix}_ACQUIRE_TIMEOUT"),
+    }
+
+
+async def init_db_pool(name: str = POOL_INTERACTIVE) -> asyncpg.Pool:
+    """
+    Initialize (once) and return a named database connection pool
+
+    Args:
+        name: Pool name (ingest, interactive, background or replica)
+
+    Returns:
+        asyncpg.Pool
+    """
+    pool = _db_pools.get(name)
+    if pool is not None:
+        return pool
+
+    lock = _pool_locks.setdefault(name, asyncio.Lock())
+    async with lock:
+        if name not in _db_pools:
+            config = _pool_settings(name)
+            _db_pools[name] = await asyncpg.create_pool(
+                dsn=settings.DATABASE_REPLICA_URL if name == POOL_REPLICA else settings.DATABASE_URL,
+                min_size=config["min_size"],
+                max_size=config["max_size"],
+                command_timeout=settings.DB_COMMAND_TIMEOUT,
+                init=_init_connection,
+            )
+    return _db_pools[name]
+
+
+async def init_db_pools():
+    """Initialize all primary pools concurrently (the replica monitor opens the replica's)"""
+    await asyncio.gather(*(init_db_pool(name) for name in POOL_NAMES))
 
 
 async def close_db_pool():
-    """Close database connection pool"""
-    global _db_pool
+    """Close all database connection pools"""
+    if _warm_up_task is not None and not _warm_up_task.done():
+        _warm_up_task.cancel()
+        await asyncio.gather(_warm_up_task, return_exceptions=True)
+    pools = list(_db_pools.values())
+    _db_pools.clear()
+    await asyncio.gather(*(pool.close() for pool in pools))
 
-    if _db_pool is not None:
-        await _db_pool.close()
-        _db_pool = None
+
+async def warm_up():
+    """
+    Open all pools and create the Supabase client, without blocking startup
+
+    Started as a task from the application lifespan so the worker serves
+    /health immediately; requests arriving earlier simply wait on the
+    same lazy initialisation. Failures are logged and retried lazily by
+    the next request (or the next readiness probe).
+    """
+    try:
+        await asyncio.gather(init_db_pools(), asyncio.to_thread(get_supabase))
+        logger.info("Warm-up finished: pools %s ready", ", ".join(_db_pools))
+    except Exception as e:
+        logger.warning("Warm-up failed: %s", e)
+
+
+_warm_up_task: Optional[asyncio.Task] = None
+
+
+def start_warm_up() -> asyncio.Task:
+    """Start warm_up() in the background unless it is already running"""
+    global _warm_up_task
+    if _warm_up_task is None or _warm_up_task.done():
+        _warm_up_task = asyncio.create_task(warm_up(), name="warm-up")
+    return _warm_up_task
+
+
+def get_readiness() -> Dict[str, Any]:
+    """Which dependencies are initialised; ready only when all of them are"""
+    pools = {name: name in _db_pools for name in POOL_NAMES}
+    supabase_ready = _supabase_client is not None
+    return {
+        "ready": all(pools.values()) and supabase_ready,
+        "pools": pools,
+        "supabase": supabase_ready,
+    }
+
+
+async def _acquire(pool: str):
+    """Acquire a connection from a named pool, recording the wait; returns (pool, connection)"""
+    db_pool = await init_db_pool(pool)
+    stats = _pool_stats[pool]
+    stats.waiters += 1
+    started = time.perf_counter()
+    try:
+        connection = await db_pool.acquire(timeout=_pool_settings(pool)["acquire_timeout"])
+    except asyncio.TimeoutError:
+        stats.timeouts += 1
+        raise PoolExhaustedError(pool)
+    finally:
+        stats.waiters -= 1
+        stats.observe(time.perf_counter() - started)
+    return db_pool, connection
 
 
 @asynccontextmanager
-async def get_db_connection():
+async def get_db_connection(pool: str = POOL_INTERACTIVE):
     """
-    Get database connection from pool (async context manager)
+    Get database connection from a named pool (async context manager)
+
+    Raises PoolExhaustedError (HTTP 503) if no connection frees up within the
+    pool's acquire timeout, so overload is shed quickly instead of queueing.
 
     Usage:
         async with get_db_connection() as conn:
             result = await conn.fetch("SELECT * FROM devices")
+
+        async with get_db_connection(POOL_BACKGROUND) as conn:
+            ...
+    """
+    db_pool, connection = await _acquire(pool)
+    try:
+        # Profiled requests get a wrapper that records each query
+        yield profiling.ProfiledConnection(connection) if profiling.is_active() else connection
+    finally:
+        await db_pool.release(connection)
+
+
+def get_pool_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Snapshot of every named pool
+
+    Returns:
+        Per pool: size, in_use, idle, waiters, acquires, timeouts and a
+        cumulative acquire-wait histogram keyed by bucket upper bound
+    """
+    snapshot = {}
+    for name in _stats_pool_names():
+        pool = _db_pools.get(name)
+        stats = _pool_stats[name]
+        size = pool.get_size() if pool else 0
+        idle = pool.get_idle_size() if pool else 0
+
+        cumulative, histogram = 0, {}
+        for bound, count in zip(ACQUIRE_WAIT_BUCKETS + (float("inf"),), stats.bucket_counts):
+            cumulative += count
+            histogram["+Inf" if bound == float("inf") else str(bound)] = cumulative
+
+        snapshot[name] = {
+            "size": size,
+            "max_size": _pool_settings(name)["max_size"],
+            "in_use": size - idle,
+            "idle": idle,
+            "waiters": stats.waiters,
+            "acquires": stats.acquires,
+            "timeouts": stats.timeouts,
+            "acquire_wait_seconds_sum": round(stats.wait_sum, 6),
+            "acquire_wait_recent_seconds": round(stats.recent_wait(time.monotonic()), 6),
+            "acquire_wait_histogram": histogram,
+        }
+    return snapshot
+
+
+def get_recent_acquire_wait(pool: str) -> float:
+    """Smoothed recent acquire wait (seconds) of a named pool, for load shedding"""
+    return _pool_stats[pool].recent_wait(time.monotonic())
+
+
+@registry.register_collector
+def _collect_pool_metrics():
+    sizes, in_use, waiters, timeouts, waits = [], [], [], [], []
+    for name in _stats_pool_names():
+        pool = _db_pools.get(name)
+        stats = _pool_stats[name]
+        labels = {"pool": name}
+        size = pool.get_size() if pool else 0
+        sizes.append(("", labels, size))
+        in_use.append(("", labels, size - (pool.get_idle_size() if pool else 0)))
+        waiters.append(("", labels, stats.waiters))
+        timeouts.append(("_total", labels, stats.timeouts))
+        waits.extend(histogram_samples(labels, ACQUIRE_WAIT_BUCKETS, stats.bucket_counts, stats.wait_sum))
+
+    yield "iotlinker_db_pool_size", "gauge", "Open connections per pool", sizes
+    yield "iotlinker_db_pool_in_use", "gauge", "Checked-out connections per pool", in_use
+    yield "iotlinker_db_pool_waiters", "gauge", "Tasks waiting to acquire a connection", waiters
+    yield "iotlinker_db_pool_acquire_timeouts", "counter", "Acquires that timed out (HTTP 503)", timeouts
+    yield "iotlinker_db_pool_acquire_wait_seconds", "histogram", "Time spent waiting for a connection", waits
+
+
+# =====================================================
+# READ REPLICA ROUTING
+# =====================================================
+
+# Replay lag of a streaming replica in seconds. With everything received
+# replayed the replica is caught up, however old the last transaction is;
+# a server that is not in recovery (DATABASE_REPLICA_URL pointing at a
+# primary or a pooler in front of it) has no lag.
+REPLICA_LAG = statements.register("replica.lag", """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 'Infinity')
+    END::float8 AS lag_seconds
+""")
+
+# Errors on a replica connection that take the replica out of rotation
+REPLICA_CONNECTION_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError, asyncpg.InterfaceError)
+
+# Bound on remembered read-your-writes keys before expired ones are pruned
+MAX_STICKY_KEYS = 10000
+
+
+class ReplicaMonitor:
+    """
+    Decides whether a read may go to the replica
+
+    Every DB_REPLICA_CHECK_INTERVAL_SECONDS the replica reports its replay
+    lag; it serves reads while the last check succeeded (recently) and the
+    lag is within DB_REPLICA_MAX_LAG_SECONDS. A failed check, or a
+    connection error on a routed read, takes it out of rotation until the
+    next good check.
+
+    mark_written() keeps a key (a tenant id) on the primary for
+    DB_REPLICA_MAX_LAG_SECONDS after a write, the longest the replica can
+    be behind while it is in rotation. Keys are per worker: a read served
+    by another worker is only bounded by the lag.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._written: Dict[str, float] = {}
+        self._checked = 0.0
+        self.healthy = False
+        self.lag_seconds: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.failovers = 0
+        self.reads = {"replica": 0, "primary": 0}
+
+    def start(self):
+        if self._task is None and settings.DATABASE_REPLICA_URL:
+            self._task = asyncio.create_task(self._run(), name="replica-monitor")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.healthy = False
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "configured": bool(settings.DATABASE_REPLICA_URL),
+            "running": self._task is not None,
+            "healthy": self.usable(None),
+            "lag_seconds": self.lag_seconds,
+            "max_lag_seconds": settings.DB_REPLICA_MAX_LAG_SECONDS,
+            "last_error": self.last_error,
+            "failovers": self.failovers,
+            "sticky_keys": len(self._written),
+            "reads": dict(self.reads),
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                await self.check()
+            except asyncio.CancelledError:
+                raise
+            except PoolExhaustedError:
+                pass  # busy, not down; the last result stands
+            except Exception as e:
+                self.mark_down(e)
+            await asyncio.sleep(settings.DB_REPLICA_CHECK_INTERVAL_SECONDS)
+
+    async def check(self):
+        """Measure the replica's lag and update its health"""
+        async with get_db_connection(POOL_REPLICA) as conn:
+            lag = await statements.fetchval(conn, REPLICA_LAG)
+        self._checked = time.monotonic()
+        self.lag_seconds = lag
+        healthy = lag <= settings.DB_REPLICA_MAX_LAG_SECONDS
+        if healthy != self.healthy:
+            if healthy:
+                logger.info("Read replica in rotation (lag %.3fs)", lag)
+            else:
+                logger.warning("Read replica lags %.3fs; reads go to the primary", lag)
+        self.last_error = None if healthy else f"lag {lag:.3f}s"
+        self.healthy = healthy
+
+    def mark_down(self, error: BaseException):
+        """Take the replica out of rotation until the next good check"""
+        if self.healthy:
+            self.failovers += 1
+            logger.warning("Read replica failed (%s); reads go to the primary", error)
+        self.healthy = False
+        self.last_error = str(error) or type(error).__name__
+
+    def mark_written(self, key: Any):
+        if not settings.DATABASE_REPLICA_URL:
+            return
+        now = time.monotonic()
+        if len(self._written) >= MAX_STICKY_KEYS:
+            self._written = {k: until for k, until in self._written.items() if until > now}
+        self._written[str(key)] = now + settings.DB_REPLICA_MAX_LAG_SECONDS
+
+    def usable(self, key: Optional[Any]) -> bool:
+        """Whether a read (on behalf of key) may use the replica now"""
+        if not self.healthy:
+            return False
+        now = time.monotonic()
+        # A monitor that stopped checking must not keep the replica in rotation
+        if now - self._checked > 3 * settings.DB_REPLICA_CHECK_INTERVAL_SECONDS:
+            return False
+        return key is None or self._written.get(str(key), 0.0) <= now
+
+
+# Process-wide replica state
+replica = ReplicaMonitor()
+
+
+def mark_written(key: Any):
+    """
+    Note a committed write on behalf of key (a tenant id)
+
+    get_read_connection() calls with the same key read from the primary
+    until the replica has caught up with the write.
+    """
+    replica.mark_written(key)
+
+
+@asynccontextmanager
+async def get_read_connection(sticky_key: Optional[Any] = None, pool: str = POOL_INTERACTIVE):
+    """
+    Get a connection for read-only queries (async context manager)
+
+    Served by the replica while it is healthy, within the lag bound and
+    sticky_key has not written recently; otherwise (and if the replica
+    cannot be reached or its pool is saturated) by the named primary pool.
+
+    Args:
+        sticky_key: Key passed to mark_written() by writes this read must see
+        pool: Primary pool to fall back to
+
+    Usage:
+        async with get_read_connection(tenant_id) as conn:
+            rows = await statements.fetch(conn, LIST_CHANNELS, ...)
     """
-    pool = await init_db_pool()
-    async with pool.acquire() as connection:
-        yield connection
+    acquired = None
+    if replica.usable(sticky_key):
+        try:
+            acquired = await _acquire(POOL_REPLICA)
+        except PoolExhaustedError:
+            pass
+        except Exception as e:
+            replica.mark_down(e)
+    on_replica = acquired is not None
+    if not on_replica:
+        acquired = await _acquire(pool)
+    replica.reads["replica" if on_replica else "primary"] += 1
+
+    db_pool, connection = acquired
+    try:
+        yield profiling.ProfiledConnection(connection) if profiling.is_active() else connection
+    except REPLICA_CONNECTION_ERRORS as e:
+        # The failed read is not retried; later ones go to the primary
+        if on_replica:
+            replica.mark_down(e)
+        raise
+    finally:
+        await db_pool.release(connection)
+
+
+@registry.register_collector
+def _collect_replica_metrics():
+    if not settings.DATABASE_REPLICA_URL:
+        return
+    yield (
+        "iotlinker_db_replica_healthy", "gauge", "Whether reads may be routed to the replica",
+        [("", {}, int(replica.usable(None)))],
+    )
+    if replica.lag_seconds is not None:
+        yield (
+            "iotlinker_db_replica_lag_seconds", "gauge", "Replay lag at the last replica check",
+            [("", {}, replica.lag_seconds)],
+        )
+    yield (
+        "iotlinker_db_replica_failovers", "counter", "Times the replica was taken out of rotation",
+        [("_total", {}, replica.failovers)],
+    )
+    yield (
+        "iotlinker_db_reads", "counter", "Routed reads by server",
+        [("_total", {"target": target}, count) for target, count in replica.reads.items()],
+    )
+
+
+_ADHOC_QUERY_DURATION = DB_QUERY_DURATION.labels("adhoc")
 
 
 async def execute_query(query: str, *args):
     """
-    Execute a query and return results
+    Execute a read-only query and return results (on the replica when usable)
 
     Args:
         query: SQL query string
@@ -86,13 +549,14 @@ async def execute_query(query: str, *args):
     Returns:
         List of records
     """
-    async with get_db_connection() as conn:
-        return await conn.fetch(query, *args)
+    async with get_read_connection() as conn:
+        with _ADHOC_QUERY_DURATION.time():
+            return await conn.fetch(query, *args)
 
 
 async def execute_one(query: str, *args):
     """
-    Execute a query and return single result
+    Execute a read-only query and return single result (on the replica when usable)
 
     Args:
         query: SQL query string
@@ -101,8 +565,9 @@ async def execute_one(query: str, *args):
     Returns:
         Single record or None
     """
-    async with get_db_connection() as conn:
-        return await conn.fetchrow(query, *args)
+    async with get_read_connection() as conn:
+        with _ADHOC_QUERY_DURATION.time():
+            return await conn.fetchrow(query, *args)
 
 
 async def execute_write(query: str, *args):
@@ -117,4 +582,5 @@ async def execute_write(query: str, *args):
         Status message
     """
     async with get_db_connection() as conn:
-        return await conn.execute(query, *args)
+        with _ADHOC_QUERY_DURATION.time():
+            return await conn.execute(query, *args)
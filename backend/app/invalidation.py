@@ -0,0 +1,154 @@
+"""
+Cross-Worker Cache Invalidation
+Publishes change events with Postgres NOTIFY and applies them from a LISTEN connection
+"""
+
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import asyncpg
+
+from app.cache import TTLCache, clear_invalidated, set_invalidations_live
+from app.config import settings
+from app.database import execute_write
+
+
+logger = logging.getLogger(__name__)
+
+# Postgres channel carrying {"entity": ..., "id": ...} payloads
+CHANNEL = "iotlinker_invalidate"
+
+# How often the idle LISTEN connection is pinged to detect a dead socket
+HEALTHCHECK_SECONDS = 10.0
+MAX_BACKOFF_SECONDS = 30.0
+
+# entity name ("device", "channel", ...) -> caches keyed by that entity's id
+_subscribers: Dict[str, List[TTLCache]] = defaultdict(list)
+
+
+def subscribe(entity: str, cache: TTLCache):
+    """Invalidate cache entries keyed by entity id whenever that entity changes"""
+    cache.invalidated = True
+    _subscribers[entity].append(cache)
+
+
+def apply(entity: str, entity_id: Optional[str]):
+    """Apply a change event locally (id None drops the whole cache)"""
+    for cache in _subscribers.get(entity, ()):
+        if entity_id is None:
+            cache.clear()
+        else:
+            cache.invalidate(entity_id)
+
+
+async def publish(entity: str, entity_id: Optional[Any]):
+    """
+    Invalidate an entity on this worker and notify every other worker
+
+    Call after the write has committed. If NOTIFY fails, other workers
+    converge when their cache TTL expires.
+
+    Args:
+        entity: Entity name, e.g. "device" or "channel"
+        entity_id: Changed row id (None = everything of that entity)
+    """
+    entity_id = str(entity_id) if entity_id is not None else None
+    apply(entity, entity_id)
+    if not settings.INVALIDATION_ENABLED:
+        return
+    try:
+        await execute_write(
+            "SELECT pg_notify($1, $2)", CHANNEL, json.dumps({"entity": entity, "id": entity_id})
+        )
+    except Exception as e:
+        logger.warning("Failed to publish %s invalidation for %s: %s", entity, entity_id, e)
+
+
+class InvalidationListener:
+    """
+    Dedicated LISTEN connection applying other workers' change events
+
+    Runs outside the pools so it is never starved by request traffic.
+    Notifications sent while the connection is down are lost, so subscribed
+    caches are emptied and suspended (or limited to their outage TTL)
+    whenever it is not connected, and start empty after every (re)connect;
+    reconnects back off exponentially.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self.connected = False
+        self.received = 0
+        self.reconnects = 0
+
+    def start(self):
+        if self._task is None:
+            set_invalidations_live(False)
+            self._task = asyncio.create_task(self._run(), name="invalidation-listener")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            "connected": self.connected,
+            "received": self.received,
+            "reconnects": self.reconnects,
+        }
+
+    def _on_notify(self, conn, pid, channel, payload):
+        self.received += 1
+        try:
+            event = json.loads(payload)
+            apply(event["entity"], event.get("id"))
+        except (ValueError, KeyError) as e:
+            logger.warning("Ignoring malformed invalidation %r: %s", payload, e)
+
+    async def _run(self):
+        backoff = 1.0
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(settings.DATABASE_URL)
+                lost = asyncio.Event()
+                conn.add_termination_listener(lambda _conn: lost.set())
+                await conn.add_listener(CHANNEL, self._on_notify)
+
+                # Resync: anything published before LISTEN took effect was missed
+                clear_invalidated()
+                set_invalidations_live(True)
+                self.connected = True
+                backoff = 1.0
+                logger.info("Listening for cache invalidations on %s", CHANNEL)
+
+                while not lost.is_set():
+                    try:
+                        await asyncio.wait_for(lost.wait(), timeout=HEALTHCHECK_SECONDS)
+                    except asyncio.TimeoutError:
+                        await conn.execute("SELECT 1", timeout=5)
+                raise ConnectionError("listen connection closed")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Invalidation listener disconnected: %s; retrying in %.0fs", e, backoff)
+            finally:
+                if self.connected:
+                    self.connected = False
+                    set_invalidations_live(False)
+                if conn is not None and not conn.is_closed():
+                    conn.terminate()
+
+            self.reconnects += 1
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+
+
+# Process-wide listener
+listener = InvalidationListener()
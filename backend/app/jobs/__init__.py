@@ -0,0 +1,33 @@
+"""
+Background jobs package
+"""
+
+from app.jobs.scheduler import Scheduler, scheduler
+from app.jobs.queue import JobQueue, job_queue
+
+# Job modules pull in numpy/pyarrow; import them on first attribute access
+# so that importing the scheduler stays cheap at worker startup
+_LAZY = {
+    "run_predictive_maintenance": "app.jobs.predictive_maintenance",
+    "run_retention_pipeline": "app.jobs.retention",
+    "run_archive": "app.jobs.archive",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        import importlib
+
+        return getattr(importlib.import_module(_LAZY[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = [
+    "Scheduler",
+    "scheduler",
+    "JobQueue",
+    "job_queue",
+    "run_predictive_maintenance",
+    "run_retention_pipeline",
+    "run_archive"
+]
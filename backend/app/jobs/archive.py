@@ -0,0 +1,128 @@
+"""
+Cold-Tier Archiver
+Exports old device_data chunks to Parquet, then drops them from the hypertable
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from app.config import settings
+from app.database import get_db_connection, POOL_BACKGROUND
+from app.jobs.retention import EXPIRED_CHUNKS_QUERY, DOWNSAMPLE_QUERY, DROP_CHUNKS_QUERY
+from app.services.archive import PartitionWriter, file_size
+from app import invalidation
+
+
+logger = logging.getLogger(__name__)
+
+EXPORT_BATCH_SIZE = 20_000
+
+# Read straight from the chunk table; ordering by device then time keeps each
+# device's rows contiguous so Parquet row-group statistics prune well.
+EXPORT_QUERY = """
+    SELECT
+        tenant_id::text AS tenant_id,
+        device_id::text AS device_id,
+        metric_name,
+        time,
+        value,
+        unit,
+        metadata::text AS metadata,
+        quality_score
+    FROM {chunk}
+    ORDER BY tenant_id, device_id, time
+"""
+
+MANIFEST_QUERY = """
+    INSERT INTO device_data_archive (tenant_id, day, uri, row_count, size_bytes)
+    VALUES ($1, $2, $3, $4, $5)
+    ON CONFLICT (tenant_id, day, uri) DO UPDATE SET
+        row_count = EXCLUDED.row_count,
+        size_bytes = EXCLUDED.size_bytes,
+        archived_at = NOW()
+"""
+
+
+@dataclass
+class ArchiveReport:
+    """Summary of an archive run"""
+    horizon: Optional[str] = None
+    chunks_archived: int = 0
+    files_written: int = 0
+    rows_archived: int = 0
+    bytes_written: int = 0
+    bytes_reclaimed: int = 0
+    elapsed_seconds: float = 0.0
+
+
+async def _export_chunk(conn, chunk: str) -> dict:
+    """Stream one chunk into Parquet files; returns {(tenant, day): [uri, rows]}"""
+    part_name = chunk.replace('"', "").replace(".", "_")
+    writer = PartitionWriter(part_name)
+    try:
+        async with conn.transaction():
+            batch = []
+            async for record in conn.cursor(EXPORT_QUERY.format(chunk=chunk), prefetch=EXPORT_BATCH_SIZE):
+                batch.append(dict(record))
+                if len(batch) >= EXPORT_BATCH_SIZE:
+                    await asyncio.to_thread(writer.write_rows, batch)
+                    batch = []
+            if batch:
+                await asyncio.to_thread(writer.write_rows, batch)
+    finally:
+        files = await asyncio.to_thread(writer.close)
+    return files
+
+
+async def run_archive(now: Optional[datetime] = None) -> ArchiveReport:
+    """
+    Archive device_data chunks older than ARCHIVE_AFTER_DAYS
+
+    Files are written first for every chunk of a time slice; then, in one
+    transaction, the slice is downsampled into the long-term tiers,
+    recorded in the manifest and dropped. A crash between the two steps only leaves files that the next
+    run overwrites, since file names are derived from the chunk name.
+
+    Args:
+        now: Reference time (defaults to the current time)
+
+    Returns:
+        ArchiveReport with rows archived and bytes reclaimed
+    """
+    now = now or datetime.now(timezone.utc)
+    report = ArchiveReport()
+    started = time.perf_counter()
+    horizon = now - timedelta(days=settings.ARCHIVE_AFTER_DAYS)
+    report.horizon = horizon.isoformat()
+
+    async with get_db_connection(POOL_BACKGROUND) as conn:
+        chunks = await conn.fetch(EXPIRED_CHUNKS_QUERY, "device_data", horizon)
+        for chunk in chunks:
+            # Every partition chunk of the slice is exported before the slice is dropped
+            manifest = []
+            for name in chunk["chunks"]:
+                files = await _export_chunk(conn, name)
+                for (tenant_id, day), (uri, rows) in files.items():
+                    manifest.append((tenant_id, day, uri, rows, await asyncio.to_thread(file_size, uri)))
+
+            async with conn.transaction():
+                await conn.fetchval(DOWNSAMPLE_QUERY, chunk["range_start"], chunk["range_end"])
+                await conn.executemany(MANIFEST_QUERY, manifest)
+                await conn.fetchval(DROP_CHUNKS_QUERY, "device_data", chunk["range_end"])
+            # Readers cache how far each tenant is archived
+            for tenant_id in {entry[0] for entry in manifest}:
+                await invalidation.publish("archive", tenant_id)
+
+            report.chunks_archived += len(chunk["chunks"])
+            report.files_written += len(manifest)
+            report.rows_archived += sum(entry[3] for entry in manifest)
+            report.bytes_written += sum(entry[4] for entry in manifest)
+            report.bytes_reclaimed += chunk["total_bytes"] or 0
+
+    report.elapsed_seconds = round(time.perf_counter() - started, 3)
+    logger.info("Archive run finished: %s", asdict(report))
+    return report
@@ -0,0 +1,389 @@
+"""
+Predictive Maintenance Scoring Job
+Batch-scores every device from the hourly rollups and upserts into predictions
+"""
+
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.database import get_db_connection, POOL_BACKGROUND
+
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = "predictive_maintenance"
+PREDICTION_TYPE = "maintenance_required"
+MODEL_VERSION = "rollup-heuristic-v1"
+
+
+# =====================================================
+# SQL
+# =====================================================
+
+SHARDS_QUERY = "SELECT id::text FROM tenants WHERE active = true ORDER BY id"
+
+COMPLETED_SHARDS_QUERY = """
+    SELECT shard_key FROM job_checkpoints
+    WHERE job_name = $1 AND run_id = $2
+"""
+
+# One row per (device, metric) series with the whole window as arrays, so the
+# feature window for a tenant arrives in a single round trip.
+FEATURE_WINDOW_QUERY = """
+    SELECT
+        device_id::text,
+        metric_name,
+        array_agg(EXTRACT(EPOCH FROM bucket)::float8 ORDER BY bucket) AS ts,
+        array_agg(avg_value ORDER BY bucket) AS avg_values,
+        array_agg(max_value - min_value ORDER BY bucket) AS ranges
+    FROM device_data_hourly
+    WHERE tenant_id = $1 AND bucket >= $2 AND avg_value IS NOT NULL
+    GROUP BY device_id, metric_name
+"""
+
+DEVICES_QUERY = """
+    SELECT id::text, metadata->>'last_maintenance_at' AS last_maintenance_at, created_at
+    FROM devices
+    WHERE tenant_id = $1
+"""
+
+UPSERT_PREDICTIONS_QUERY = """
+    INSERT INTO predictions (
+        device_id, tenant_id, prediction_type, predicted_at, prediction_time,
+        probability, confidence, model_version, features_used, recommended_actions
+    )
+    SELECT r.device_id, $1, $2, $3, r.prediction_time, r.probability, r.confidence,
+           $4, r.features::jsonb, r.actions::jsonb
+    FROM unnest($5::uuid[], $6::timestamptz[], $7::float8[], $8::float8[], $9::text[], $10::text[])
+        AS r(device_id, prediction_time, probability, confidence, features, actions)
+    ON CONFLICT (device_id, prediction_type) DO UPDATE SET
+        predicted_at = EXCLUDED.predicted_at,
+        prediction_time = EXCLUDED.prediction_time,
+        probability = EXCLUDED.probability,
+        confidence = EXCLUDED.confidence,
+        model_version = EXCLUDED.model_version,
+        features_used = EXCLUDED.features_used,
+        recommended_actions = EXCLUDED.recommended_actions
+"""
+
+CHECKPOINT_QUERY = """
+    INSERT INTO job_checkpoints (job_name, run_id, shard_key, stats)
+    VALUES ($1, $2, $3, $4::jsonb)
+    ON CONFLICT (job_name, run_id, shard_key) DO UPDATE SET
+        completed_at = NOW(),
+        stats = EXCLUDED.stats
+"""
+
+
+# =====================================================
+# FEATURE COMPUTATION (runs in worker processes)
+# =====================================================
+
+@dataclass
+class ShardPayload:
+    """Feature window for one tenant, flattened into NumPy arrays"""
+    tenant_id: str
+    device_ids: List[str]           # index -> device UUID
+    series_device: np.ndarray       # per series: index into device_ids
+    series_lengths: np.ndarray      # per series: number of hourly buckets
+    ts: np.ndarray                  # concatenated bucket epochs (seconds)
+    values: np.ndarray              # concatenated hourly averages
+    ranges: np.ndarray              # concatenated hourly max - min
+    maintenance_age_days: np.ndarray  # per device
+    now: float
+    lookback_hours: int
+    recent_hours: int
+
+
+def _masked_moments(values: np.ndarray, mask: np.ndarray, starts: np.ndarray):
+    """Per-series count, mean and variance of values where mask is set"""
+    weights = mask.astype(np.float64)
+    n = np.add.reduceat(weights, starts)
+    s = np.add.reduceat(values * weights, starts)
+    ss = np.add.reduceat(values * values * weights, starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(n > 0, s / n, 0.0)
+        var = np.where(n > 1, np.maximum(ss / n - mean * mean, 0.0), np.nan)
+    return n, mean, var
+
+
+def score_shard(payload: ShardPayload) -> List[Tuple[str, float, float, float, str, str]]:
+    """
+    Compute features and a failure-risk score for every device in a shard
+
+    All per-series statistics are computed with segmented reductions over the
+    concatenated arrays, so cost is linear in the number of hourly buckets
+    with no per-device Python loop.
+
+    Returns:
+        Rows of (device_id, probability, confidence, prediction_epoch,
+        features_json, actions_json)
+    """
+    if len(payload.series_lengths) == 0:
+        return []
+
+    starts = np.concatenate(([0], np.cumsum(payload.series_lengths)[:-1])).astype(np.intp)
+    hours = (payload.ts - (payload.now - payload.lookback_hours * 3600.0)) / 3600.0
+    y = payload.values
+
+    # Trend: least-squares slope of the hourly mean, relative to its level, per day
+    n = payload.series_lengths.astype(np.float64)
+    sx = np.add.reduceat(hours, starts)
+    sy = np.add.reduceat(y, starts)
+    sxx = np.add.reduceat(hours * hours, starts)
+    sxy = np.add.reduceat(hours * y, starts)
+    denom = n * sxx - sx * sx
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = np.where(denom > 0, (n * sxy - sx * sy) / denom, 0.0)
+        level = np.maximum(np.abs(sy / n), 1e-9)
+    rel_trend = np.abs(slope * 24.0) / level
+
+    # Variance and range drift: recent window against the preceding baseline
+    recent = payload.ts >= payload.now - payload.recent_hours * 3600.0
+    _, _, var_recent = _masked_moments(y, recent, starts)
+    _, _, var_base = _masked_moments(y, ~recent, starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        variance_drift = np.sqrt(var_recent) / np.maximum(np.sqrt(var_base), 1e-9)
+    variance_drift = np.where(np.isfinite(variance_drift), variance_drift, 1.0)
+
+    n_recent, range_recent, _ = _masked_moments(payload.ranges, recent, starts)
+    n_base, range_base, _ = _masked_moments(payload.ranges, ~recent, starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        range_drift = np.where(
+            (n_recent > 0) & (n_base > 0), range_recent / np.maximum(range_base, 1e-9), 1.0
+        )
+
+    coverage = np.minimum(n / payload.lookback_hours, 1.0)
+
+    # Aggregate series features to devices (worst metric wins)
+    device_count = len(payload.device_ids)
+    device_trend = np.zeros(device_count)
+    device_vdrift = np.ones(device_count)
+    device_rdrift = np.ones(device_count)
+    device_coverage = np.zeros(device_count)
+    device_series = np.zeros(device_count)
+    np.maximum.at(device_trend, payload.series_device, rel_trend)
+    np.maximum.at(device_vdrift, payload.series_device, variance_drift)
+    np.maximum.at(device_rdrift, payload.series_device, range_drift)
+    np.add.at(device_coverage, payload.series_device, coverage)
+    np.add.at(device_series, payload.series_device, 1.0)
+
+    scored = device_series > 0
+    device_coverage = np.where(scored, device_coverage / np.maximum(device_series, 1.0), 0.0)
+    maintenance_age = payload.maintenance_age_days
+
+    z = (
+        -3.0
+        + 3.0 * np.clip(device_trend, 0.0, 1.0)
+        + 1.5 * np.clip(np.log2(device_vdrift), 0.0, 3.0)
+        + 1.0 * np.clip(np.log2(device_rdrift), 0.0, 3.0)
+        + 1.0 * np.clip(maintenance_age / 180.0, 0.0, 2.0)
+    )
+    probability = 1.0 / (1.0 + np.exp(-z))
+    confidence = np.clip(device_coverage, 0.1, 1.0)
+    horizon_days = np.maximum(1.0, np.round(30.0 * (1.0 - probability)))
+    prediction_epoch = payload.now + horizon_days * 86400.0
+
+    rows = []
+    for i in np.flatnonzero(scored):
+        p = float(probability[i])
+        actions = []
+        if p >= 0.7:
+            actions.append("schedule_inspection")
+        if device_vdrift[i] >= 2.0:
+            actions.append("check_sensor_calibration")
+        if maintenance_age[i] >= 180:
+            actions.append("perform_routine_maintenance")
+        features = {
+            "relative_trend_per_day": round(float(device_trend[i]), 6),
+            "variance_drift": round(float(device_vdrift[i]), 6),
+            "range_drift": round(float(device_rdrift[i]), 6),
+            "days_since_maintenance": round(float(maintenance_age[i]), 2),
+            "coverage": round(float(device_coverage[i]), 4),
+            "series": int(device_series[i]),
+        }
+        rows.append((
+            payload.device_ids[i],
+            p,
+            float(confidence[i]),
+            float(prediction_epoch[i]),
+            json.dumps(features),
+            json.dumps(actions),
+        ))
+    return rows
+
+
+# =====================================================
+# JOB ORCHESTRATION
+# =====================================================
+
+@dataclass
+class ScoringReport:
+    """Summary of a scoring run"""
+    run_id: str
+    shards_total: int = 0
+    shards_skipped: int = 0
+    shards_failed: int = 0
+    devices_scored: int = 0
+    elapsed_seconds: float = 0.0
+    devices_per_second: float = 0.0
+
+
+def _parse_maintenance_time(value: Optional[str], fallback: Optional[datetime]) -> Optional[datetime]:
+    if value:
+        try:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+        except ValueError:
+            pass
+    return fallback
+
+
+async def _load_shard(conn, tenant_id: str, now: datetime) -> ShardPayload:
+    """Fetch the feature window and device metadata for a tenant"""
+    window_start = now - timedelta(hours=settings.PREDICTION_LOOKBACK_HOURS)
+    series_rows = await conn.fetch(FEATURE_WINDOW_QUERY, tenant_id, window_start)
+    device_rows = await conn.fetch(DEVICES_QUERY, tenant_id)
+
+    device_index: Dict[str, int] = {}
+    maintenance_age = []
+    for row in device_rows:
+        device_index[row["id"]] = len(device_index)
+        last = _parse_maintenance_time(row["last_maintenance_at"], row["created_at"])
+        maintenance_age.append((now - last).total_seconds() / 86400.0 if last else 0.0)
+
+    series_device, lengths = [], []
+    ts_parts, value_parts, range_parts = [], [], []
+    for row in series_rows:
+        idx = device_index.get(row["device_id"])
+        if idx is None:
+            continue
+        series_device.append(idx)
+        lengths.append(len(row["ts"]))
+        ts_parts.append(row["ts"])
+        value_parts.append(row["avg_values"])
+        range_parts.append(row["ranges"])
+
+    def _flatten(parts):
+        if not parts:
+            return np.empty(0, dtype=np.float64)
+        return np.concatenate([np.asarray(p, dtype=np.float64) for p in parts])
+
+    return ShardPayload(
+        tenant_id=tenant_id,
+        device_ids=list(device_index),
+        series_device=np.asarray(series_device, dtype=np.intp),
+        series_lengths=np.asarray(lengths, dtype=np.intp),
+        ts=_flatten(ts_parts),
+        values=np.nan_to_num(_flatten(value_parts)),
+        ranges=np.nan_to_num(_flatten(range_parts)),
+        maintenance_age_days=np.asarray(maintenance_age, dtype=np.float64),
+        now=now.timestamp(),
+        lookback_hours=settings.PREDICTION_LOOKBACK_HOURS,
+        recent_hours=settings.PREDICTION_RECENT_HOURS,
+    )
+
+
+async def _process_shard(
+    tenant_id: str,
+    run_id: str,
+    now: datetime,
+    executor: ProcessPoolExecutor,
+) -> int:
+    """Load, score, upsert and checkpoint one tenant shard"""
+    started = time.perf_counter()
+
+    async with get_db_connection(POOL_BACKGROUND) as conn:
+        payload = await _load_shard(conn, tenant_id, now)
+
+    loop = asyncio.get_running_loop()
+    rows = await loop.run_in_executor(executor, score_shard, payload)
+
+    async with get_db_connection(POOL_BACKGROUND) as conn:
+        async with conn.transaction():
+            if rows:
+                device_ids, probabilities, confidences, epochs, features, actions = zip(*rows)
+                await conn.execute(
+                    UPSERT_PREDICTIONS_QUERY,
+                    tenant_id,
+                    PREDICTION_TYPE,
+                    now,
+                    MODEL_VERSION,
+                    list(device_ids),
+                    [datetime.fromtimestamp(e, tz=timezone.utc) for e in epochs],
+                    list(probabilities),
+                    list(confidences),
+                    list(features),
+                    list(actions),
+                )
+            stats = {"devices": len(rows), "seconds": round(time.perf_counter() - started, 3)}
+            await conn.execute(CHECKPOINT_QUERY, JOB_NAME, run_id, tenant_id, json.dumps(stats))
+
+    return len(rows)
+
+
+def default_run_id(now: Optional[datetime] = None) -> str:
+    """Run id for the current scheduling slot, so a restarted run resumes"""
+    now = now or datetime.now(timezone.utc)
+    interval = max(settings.PREDICTION_JOB_INTERVAL_MINUTES, 1) * 60
+    slot = int(now.timestamp()) // interval * interval
+    return datetime.fromtimestamp(slot, tz=timezone.utc).strftime("%Y%m%dT%H%M")
+
+
+async def run_predictive_maintenance(run_id: Optional[str] = None) -> ScoringReport:
+    """
+    Score every active tenant's devices and upsert the results
+
+    Shards (tenants) already checkpointed under the same run_id are skipped,
+    so re-running after a crash only processes the remaining tenants.
+
+    Args:
+        run_id: Checkpoint namespace; defaults to the current scheduling slot
+
+    Returns:
+        ScoringReport with throughput in devices/sec
+    """
+    now = datetime.now(timezone.utc)
+    run_id = run_id or default_run_id(now)
+    report = ScoringReport(run_id=run_id)
+    started = time.perf_counter()
+
+    async with get_db_connection(POOL_BACKGROUND) as conn:
+        shards = [row["id"] for row in await conn.fetch(SHARDS_QUERY)]
+        completed = {row["shard_key"] for row in await conn.fetch(COMPLETED_SHARDS_QUERY, JOB_NAME, run_id)}
+
+    pending = [tenant_id for tenant_id in shards if tenant_id not in completed]
+    report.shards_total = len(shards)
+    report.shards_skipped = len(shards) - len(pending)
+
+    workers = max(settings.PREDICTION_WORKERS, 1)
+    semaphore = asyncio.Semaphore(workers)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        async def _bounded(tenant_id: str) -> int:
+            async with semaphore:
+                try:
+                    return await _process_shard(tenant_id, run_id, now, executor)
+                except Exception:
+                    logger.exception("Scoring shard %s failed", tenant_id)
+                    report.shards_failed += 1
+                    return 0
+
+        results = await asyncio.gather(*(_bounded(t) for t in pending))
+
+    report.devices_scored = sum(results)
+    report.elapsed_seconds = round(time.perf_counter() - started, 3)
+    if report.elapsed_seconds > 0:
+        report.devices_per_second = round(report.devices_scored / report.elapsed_seconds, 1)
+
+    logger.info("Predictive maintenance run finished: %s", asdict(report))
+    return report
@@ -0,0 +1,387 @@
+"""
+Durable Job Queue
+Deferred work (webhook deliveries, notifications) kept in a local SQLite file and run with retries
+
+Jobs survive restarts and crashes: a job is only removed once its task
+returned, and a job whose worker died is picked up again when its lease
+expires. Delivery is therefore at-least-once; tasks must tolerate running
+twice. API workers on one host share the file (WAL mode), so whichever
+worker is free runs the next due job.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.config import settings
+from app.metrics import BACKGROUND_TASKS_PENDING, BACKGROUND_TASK_FAILURES, registry
+
+
+logger = logging.getLogger(__name__)
+
+# A claimed job is handed to another worker if not finished within its
+# timeout plus this margin (its worker crashed or hung)
+LEASE_MARGIN_SECONDS = 60.0
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        task TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',  -- queued, running or dead
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL,
+        enqueued_at REAL NOT NULL,
+        run_at REAL NOT NULL,
+        locked_until REAL,
+        last_error TEXT
+    );
+    CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, run_at);
+"""
+
+
+@dataclass(frozen=True)
+class Task:
+    """A coroutine function jobs can run, by name"""
+    name: str
+    func: Callable[..., Awaitable[Any]]
+    max_attempts: int
+
+
+def _backoff(attempts: int) -> float:
+    """Delay before the next attempt: exponential, capped, with jitter"""
+    delay = min(settings.JOB_QUEUE_BACKOFF_SECONDS * 2 ** (attempts - 1), settings.JOB_QUEUE_MAX_BACKOFF_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+
+class JobQueue:
+    """
+    SQLite-backed queue run by a fixed pool of asyncio workers
+
+    enqueue() commits the job before returning. JOB_QUEUE_WORKERS jobs run
+    at a time per API worker, each limited to JOB_QUEUE_TIMEOUT_SECONDS. A
+    failed attempt is retried with exponential backoff; after its task's
+    max_attempts it is kept as a dead letter (status "dead") until
+    requeue_dead(). Beyond JOB_QUEUE_MAX_DEPTH pending jobs new ones are
+    rejected and counted. stop() hands running jobs back to the queue.
+
+    SQLite calls run in a thread, one at a time per process.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._tasks: Dict[str, Task] = {}
+        self._workers: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        # Snapshot refreshed by the monitor loop: counts by status, oldest due job
+        self._counts: Dict[str, int] = {}
+        self._oldest_enqueued_at: Optional[float] = None
+        self._enqueued_since_refresh = 0
+        self.running = 0
+        self.enqueued = 0
+        self.completed = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.rejected = 0
+
+    def task(self, name: str, max_attempts: Optional[int] = None):
+        """
+        Register a coroutine function as a task (usable as a decorator)
+
+        Its keyword arguments must be JSON-serialisable; they are stored
+        with each job.
+
+        Args:
+            name: Task name used by enqueue()
+            max_attempts: Attempts before a job is dead-lettered
+                (default JOB_QUEUE_MAX_ATTEMPTS)
+        """
+        def decorator(func: Callable[..., Awaitable[Any]]):
+            self._tasks[name] = Task(name, func, max_attempts or settings.JOB_QUEUE_MAX_ATTEMPTS)
+            return func
+        return decorator
+
+    # ===== STORAGE (run in a thread) =====
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            # WAL + NORMAL: a commit survives a crash of the process (not of the host)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _locked(self, operation: Callable, *args):
+        with self._lock:
+            return operation(self._db(), *args)
+
+    async def _call(self, operation: Callable, *args):
+        return await asyncio.to_thread(self._locked, operation, *args)
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, task: str, payload: str, max_attempts: int, now: float) -> int:
+        cursor = conn.execute(
+            "INSERT INTO jobs (task, payload, max_attempts, enqueued_at, run_at) VALUES (?, ?, ?, ?, ?)",
+            (task, payload, max_attempts, now, now),
+        )
+        return cursor.lastrowid
+
+    @staticmethod
+    def _claim(conn: sqlite3.Connection, now: float, lease: float) -> Optional[sqlite3.Row]:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            job = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' AND run_at <= ? ORDER BY run_at LIMIT 1", (now,)
+            ).fetchone()
+            if job is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_until = ? WHERE id = ?",
+                    (now + lease, job["id"]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return job
+
+    @staticmethod
+    def _finish(conn: sqlite3.Connection, job_id: int):
+        conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    @staticmethod
+    def _fail(conn: sqlite3.Connection, job: sqlite3.Row, error: str, now: float) -> bool:
+        """Schedule a retry, or dead-letter the job; returns whether it is dead"""
+        attempts = job["attempts"] + 1
+        if attempts >= job["max_attempts"]:
+            conn.execute(
+                "UPDATE jobs SET status = 'dead', locked_until = NULL, last_error = ? WHERE id = ?",
+                (error, job["id"]),
+            )
+            return True
+        conn.execute(
+            "UPDATE jobs SET status = 'queued', run_at = ?, locked_until = NULL, last_error = ? WHERE id = ?",
+            (now + _backoff(attempts), error, job["id"]),
+        )
+        return False
+
+    @staticmethod
+    def _release(conn: sqlite3.Connection, job_id: int):
+        # Interrupted by shutdown: does not count as an attempt
+        conn.execute(
+            "UPDATE jobs SET status = 'queued', attempts = attempts - 1, locked_until = NULL WHERE id = ?",
+            (job_id,),
+        )
+
+    @staticmethod
+    def _refresh(conn: sqlite3.Connection, now: float):
+        """Requeue jobs whose lease expired; counts by status and oldest pending job"""
+        conn.execute(
+            "UPDATE jobs SET status = 'queued', locked_until = NULL WHERE status = 'running' AND locked_until < ?",
+            (now,),
+        )
+        counts = {
+            row["status"]: row["jobs"]
+            for row in conn.execute("SELECT status, COUNT(*) AS jobs FROM jobs GROUP BY status")
+        }
+        oldest = conn.execute("SELECT MIN(enqueued_at) FROM jobs WHERE status != 'dead'").fetchone()[0]
+        return counts, oldest
+
+    @staticmethod
+    def _requeue_dead(conn: sqlite3.Connection, task: Optional[str], now: float) -> int:
+        cursor = conn.execute(
+            "UPDATE jobs SET status = 'queued', attempts = 0, run_at = ? "
+            "WHERE status = 'dead' AND (? IS NULL OR task = ?)",
+            (now, task, task),
+        )
+        return cursor.rowcount
+
+    @staticmethod
+    def _dead_letters(conn: sqlite3.Connection, limit: int) -> List[Dict[str, Any]]:
+        rows = conn.execute(
+            "SELECT id, task, attempts, enqueued_at, last_error FROM jobs "
+            "WHERE status = 'dead' ORDER BY id DESC LIMIT ?",
+            (limit,),
+        )
+        return [dict(row) for row in rows]
+
+    # ===== API =====
+
+    def _pending(self) -> int:
+        return self._counts.get("queued", 0) + self._counts.get("running", 0) + self._enqueued_since_refresh
+
+    async def enqueue(self, task: str, **kwargs) -> Optional[int]:
+        """
+        Store a job for a registered task
+
+        Args:
+            task: Task name
+            **kwargs: Arguments the task is called with (JSON-serialisable)
+
+        Returns:
+            Job id, or None if the queue is full (the job is dropped)
+        """
+        registered = self._tasks[task]
+        if self._pending() >= settings.JOB_QUEUE_MAX_DEPTH:
+            if not self.rejected:
+                logger.warning("Job queue full (%d jobs); dropping new jobs", self._pending())
+            self.rejected += 1
+            return None
+        job_id = await self._call(self._insert, task, json.dumps(kwargs), registered.max_attempts, time.time())
+        self.enqueued += 1
+        self._enqueued_since_refresh += 1
+        self._wakeup.set()
+        return job_id
+
+    async def requeue_dead(self, task: Optional[str] = None) -> int:
+        """Give dead-lettered jobs (of one task, or all) a fresh set of attempts"""
+        requeued = await self._call(self._requeue_dead, task, time.time())
+        if requeued:
+            self._wakeup.set()
+        return requeued
+
+    async def dead_letters(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """Most recent dead-lettered jobs with their last error"""
+        return await self._call(self._dead_letters, limit)
+
+    def start(self):
+        if self._workers:
+            return
+        self._workers.append(asyncio.create_task(self._monitor(), name="job-queue:monitor"))
+        for number in range(settings.JOB_QUEUE_WORKERS):
+            self._workers.append(asyncio.create_task(self._work(), name=f"job-queue:worker-{number}"))
+
+    async def stop(self):
+        """Stop the workers; jobs they were running go back to the queue"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+                self._conn = None
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "running": bool(self._workers),
+            "workers": settings.JOB_QUEUE_WORKERS,
+            "in_flight": self.running,
+            "queued": self._counts.get("queued", 0),
+            "claimed": self._counts.get("running", 0),
+            "dead": self._counts.get("dead", 0),
+            "max_depth": settings.JOB_QUEUE_MAX_DEPTH,
+            "oldest_age_seconds": self.oldest_age(),
+            "enqueued": self.enqueued,
+            "completed": self.completed,
+            "retried": self.retried,
+            "dead_lettered": self.dead_lettered,
+            "rejected": self.rejected,
+        }
+
+    def oldest_age(self) -> Optional[float]:
+        """Seconds since the oldest pending job was enqueued (as of the last refresh)"""
+        if self._oldest_enqueued_at is None:
+            return None
+        return round(max(0.0, time.time() - self._oldest_enqueued_at), 3)
+
+    # ===== WORKERS =====
+
+    async def _monitor(self):
+        while True:
+            try:
+                self._counts, self._oldest_enqueued_at = await self._call(self._refresh, time.time())
+                self._enqueued_since_refresh = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Job queue refresh failed: %s", e)
+            await asyncio.sleep(settings.JOB_QUEUE_POLL_SECONDS)
+
+    async def _work(self):
+        lease = settings.JOB_QUEUE_TIMEOUT_SECONDS + LEASE_MARGIN_SECONDS
+        while True:
+            try:
+                job = await self._call(self._claim, time.time(), lease)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Job queue claim failed: %s", e)
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=settings.JOB_QUEUE_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _run(self, job: sqlite3.Row):
+        name = job["task"]
+        pending = BACKGROUND_TASKS_PENDING.labels(name)
+        pending.inc()
+        self.running += 1
+        try:
+            task = self._tasks.get(name)
+            if task is None:
+                raise LookupError(f"Unknown task '{name}'")
+            await asyncio.wait_for(task.func(**json.loads(job["payload"])), timeout=settings.JOB_QUEUE_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            self._locked(self._release, job["id"])
+            raise
+        except Exception as e:
+            BACKGROUND_TASK_FAILURES.labels(name).inc()
+            error = f"{type(e).__name__}: {e}"
+            if await self._call(self._fail, job, error, time.time()):
+                self.dead_lettered += 1
+                logger.error("Job %d (%s) dead-lettered after %d attempts: %s", job["id"], name, job["attempts"] + 1, error)
+            else:
+                self.retried += 1
+                logger.info("Job %d (%s) failed, will retry: %s", job["id"], name, error)
+        else:
+            await self._call(self._finish, job["id"])
+            self.completed += 1
+        finally:
+            pending.dec()
+            self.running -= 1
+
+
+# Process-wide queue (the file is shared by the API workers of a host)
+job_queue = JobQueue(settings.JOB_QUEUE_PATH)
+
+
+@registry.register_collector
+def _collect_job_queue_metrics():
+    yield (
+        "iotlinker_job_queue_depth", "gauge", "Jobs in the local queue by status",
+        [("", {"status": status}, job_queue._counts.get(status, 0)) for status in ("queued", "running", "dead")],
+    )
+    yield (
+        "iotlinker_job_queue_oldest_age_seconds", "gauge", "Age of the oldest pending job",
+        [("", {}, job_queue.oldest_age() or 0)],
+    )
+    yield (
+        "iotlinker_job_queue_jobs", "counter", "Jobs handled by this worker by outcome",
+        [
+            ("_total", {"outcome": "enqueued"}, job_queue.enqueued),
+            ("_total", {"outcome": "completed"}, job_queue.completed),
+            ("_total", {"outcome": "retried"}, job_queue.retried),
+            ("_total", {"outcome": "dead_lettered"}, job_queue.dead_lettered),
+            ("_total", {"outcome": "rejected"}, job_queue.rejected),
+        ],
+    )
@@ -0,0 +1,195 @@
+"""
+Retention Pipeline
+Downsamples expired device_data chunks into long-term tiers, then drops them
+"""
+
+import logging
+import time
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from app.config import settings
+from app.database import get_db_connection, POOL_BACKGROUND
+
+
+logger = logging.getLogger(__name__)
+
+
+# =====================================================
+# SQL
+# =====================================================
+
+# Chunks are shared by many tenants (hash partitions group tenants, they do
+# not isolate them), so raw chunks can only be dropped once every tenant's
+# raw retention has passed. Tenants with a shorter raw retention than that
+# have their older rows rolled up and deleted separately (_trim_tenant_raw).
+RAW_HORIZON_DAYS_QUERY = """
+    SELECT GREATEST($1::int, COALESCE(MAX(raw_days), 0)) FROM retention_policies
+"""
+
+# Tenants whose raw retention (their policy, else the default $1) is shorter
+# than the chunk-drop horizon of $2 days
+SHORT_RAW_RETENTION_QUERY = """
+    SELECT t.id AS tenant_id, COALESCE(p.raw_days, $1::int) AS raw_days
+    FROM tenants t
+    LEFT JOIN retention_policies p ON p.tenant_id = t.id
+    WHERE COALESCE(p.raw_days, $1::int) < $2
+"""
+
+OLDEST_TENANT_ROW_QUERY = "SELECT MIN(time) FROM device_data WHERE tenant_id = $1 AND time < $2"
+
+DOWNSAMPLE_TENANT_QUERY = "SELECT downsample_device_data($1, $2, $3)"
+
+DELETE_TENANT_ROWS_QUERY = "DELETE FROM device_data WHERE tenant_id = $1 AND time >= $2 AND time < $3"
+
+# Rows of a tenant rolled up and deleted per transaction
+TENANT_TRIM_SLICE = timedelta(days=1)
+
+# One row per expired time slice. With tenant space partitioning a slice is
+# split across several chunks, and drop_chunks removes all of them at once,
+# so every chunk of a slice must be processed before the slice is dropped.
+EXPIRED_CHUNKS_QUERY = """
+    SELECT
+        array_agg(format('%I.%I', chunk_schema, chunk_name) ORDER BY chunk_name) AS chunks,
+        range_start,
+        range_end,
+        SUM(pg_total_relation_size(format('%I.%I', chunk_schema, chunk_name)::regclass))::bigint AS total_bytes
+    FROM timescaledb_information.chunks
+    WHERE hypertable_name = $1 AND range_end <= $2
+    GROUP BY range_start, range_end
+    ORDER BY range_start
+"""
+
+DOWNSAMPLE_QUERY = "SELECT downsample_device_data($1, $2)"
+
+DROP_CHUNKS_QUERY = "SELECT count(*) FROM drop_chunks($1::regclass, older_than => $2::timestamptz)"
+
+# Per-tenant trim of a tier table: tenants without a policy use the default,
+# and a NULL number of days (in the policy or the default) keeps the tier forever.
+TRIM_TIER_QUERY = """
+    WITH policy AS (
+        SELECT
+            t.id AS tenant_id,
+            CASE WHEN p.tenant_id IS NULL THEN $1::int ELSE p.{column} END AS days
+        FROM tenants t
+        LEFT JOIN retention_policies p ON p.tenant_id = t.id
+    )
+    DELETE FROM {table} d
+    USING policy
+    WHERE d.tenant_id = policy.tenant_id
+        AND policy.days IS NOT NULL
+        AND d.bucket < NOW() - make_interval(days => policy.days)
+"""
+
+
+@dataclass
+class RetentionReport:
+    """Summary of a retention run"""
+    raw_horizon: Optional[str] = None
+    chunks_dropped: int = 0
+    rows_reclaimed: int = 0
+    bytes_reclaimed: int = 0
+    tenant_raw_rows_deleted: int = 0
+    minute_tier_rows_trimmed: int = 0
+    hourly_tier_rows_trimmed: int = 0
+    aggregates_refreshed: bool = False
+    elapsed_seconds: float = 0.0
+
+
+def _deleted_count(status: str) -> int:
+    """Row count from an asyncpg 'DELETE n' status string"""
+    try:
+        return int(status.split()[-1])
+    except (ValueError, IndexError):
+        return 0
+
+
+async def _trim_tier(conn, table: str, column: str, default_days: Optional[int]) -> int:
+    """Apply per-tenant retention to a tier table"""
+    query = TRIM_TIER_QUERY.format(table=table, column=column)
+    status = await conn.execute(query, default_days)
+    return _deleted_count(status)
+
+
+async def _trim_tenant_raw(conn, tenant_id, horizon: datetime) -> int:
+    """
+    Roll up and delete a tenant's raw rows older than its own horizon
+
+    Only rows between the chunk-drop horizon and the tenant's are left by
+    then. They go one TENANT_TRIM_SLICE at a time, each slice downsampled
+    for the tenant and deleted in one transaction; slices start on the
+    hour, so no tier bucket is left partly rolled up.
+    """
+    oldest = await conn.fetchval(OLDEST_TENANT_ROW_QUERY, tenant_id, horizon)
+    if oldest is None:
+        return 0
+    deleted = 0
+    start = oldest.replace(minute=0, second=0, microsecond=0)
+    while start < horizon:
+        end = min(start + TENANT_TRIM_SLICE, horizon)
+        async with conn.transaction():
+            await conn.fetchval(DOWNSAMPLE_TENANT_QUERY, start, end, tenant_id)
+            deleted += _deleted_count(await conn.execute(DELETE_TENANT_ROWS_QUERY, tenant_id, start, end))
+        start = end
+    return deleted
+
+
+async def run_retention_pipeline(now: Optional[datetime] = None) -> RetentionReport:
+    """
+    Enforce retention on raw data and the long-term tiers
+
+    Each expired raw chunk is downsampled into device_data_1m/device_data_1h
+    and dropped in the same transaction, so a crash never loses data that
+    was not yet rolled up, and re-running resumes from the oldest remaining
+    chunk. Tenants whose raw retention is shorter than the longest one
+    (which decides when shared chunks can go) have their older rows rolled
+    up and deleted row-wise.
+
+    Args:
+        now: Reference time (defaults to the current time)
+
+    Returns:
+        RetentionReport with rows and bytes reclaimed
+    """
+    now = now or datetime.now(timezone.utc)
+    report = RetentionReport()
+    started = time.perf_counter()
+
+    async with get_db_connection(POOL_BACKGROUND) as conn:
+        raw_days = await conn.fetchval(RAW_HORIZON_DAYS_QUERY, settings.RETENTION_RAW_DAYS)
+        horizon = now - timedelta(days=raw_days)
+        report.raw_horizon = horizon.isoformat()
+
+        chunks = await conn.fetch(EXPIRED_CHUNKS_QUERY, "device_data", horizon)
+        for chunk in chunks:
+            async with conn.transaction():
+                rows = await conn.fetchval(DOWNSAMPLE_QUERY, chunk["range_start"], chunk["range_end"])
+                dropped = await conn.fetchval(DROP_CHUNKS_QUERY, "device_data", chunk["range_end"])
+            report.chunks_dropped += dropped
+            report.rows_reclaimed += rows or 0
+            report.bytes_reclaimed += chunk["total_bytes"] or 0
+            logger.info(
+                "Dropped chunks %s (%s rows, %s bytes)", ", ".join(chunk["chunks"]), rows, chunk["total_bytes"]
+            )
+
+        policies = await conn.fetch(SHORT_RAW_RETENTION_QUERY, settings.RETENTION_RAW_DAYS, raw_days)
+        for policy in policies:
+            # On the hour, so the last slice ends on a bucket boundary
+            tenant_horizon = (now - timedelta(days=policy["raw_days"])).replace(minute=0, second=0, microsecond=0)
+            report.tenant_raw_rows_deleted += await _trim_tenant_raw(conn, policy["tenant_id"], tenant_horizon)
+
+        report.minute_tier_rows_trimmed = await _trim_tier(
+            conn, "device_data_1m", "minute_days", settings.RETENTION_MINUTE_DAYS
+        )
+        report.hourly_tier_rows_trimmed = await _trim_tier(
+            conn, "device_data_1h", "hourly_days", settings.RETENTION_HOURLY_DAYS
+        )
+
+        if (report.chunks_dropped or report.tenant_raw_rows_deleted) and settings.RETENTION_REFRESH_AGGREGATES:
+            await conn.execute("SELECT refresh_device_data_aggregates()")
+            report.aggregates_refreshed = True
+
+    report.elapsed_seconds = round(time.perf_counter() - started, 3)
+    logger.info("Retention run finished: %s", asdict(report))
+    return report
@@ -0,0 +1,35 @@
+"""
+Rollup Refresh
+Refreshes the hourly/daily rollup views (and their percentile sketches) from device_data
+"""
+
+import logging
+import time
+from typing import Any, Dict
+
+from app.config import settings
+from app.database import get_db_connection, POOL_BACKGROUND
+
+
+logger = logging.getLogger(__name__)
+
+REFRESH_QUERY = "SELECT refresh_device_data_aggregates()"
+
+
+async def run_rollup_refresh() -> Dict[str, Any]:
+    """
+    Refresh device_data_hourly and device_data_daily
+
+    Reads stay correct between refreshes (percentile and summary queries
+    take what the views have not seen yet from device_data); refreshing
+    keeps that raw tail short.
+
+    Returns:
+        Elapsed seconds
+    """
+    started = time.perf_counter()
+    async with get_db_connection(POOL_BACKGROUND) as conn:
+        await conn.execute(REFRESH_QUERY, timeout=settings.ROLLUP_REFRESH_TIMEOUT_SECONDS)
+    elapsed = round(time.perf_counter() - started, 3)
+    logger.info("Rollup views refreshed in %.3fs", elapsed)
+    return {"elapsed_seconds": elapsed}
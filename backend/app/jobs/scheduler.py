@@ -0,0 +1,159 @@
+"""
+Job Scheduler
+Runs periodic background jobs inside the API process
+"""
+
+import asyncio
+import importlib
+import logging
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Union
+
+from app.database import get_db_connection, POOL_BACKGROUND
+from app.metrics import registry
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ScheduledJob:
+    """A job registered with the scheduler"""
+    name: str
+    func: Union[Callable[[], Awaitable[object]], str]
+    interval_seconds: float
+    initial_delay_seconds: float = 0.0
+    last_started_at: Optional[float] = None
+    last_duration_seconds: Optional[float] = None
+    last_result: object = None
+    last_error: Optional[str] = None
+    runs: int = 0
+
+
+class Scheduler:
+    """
+    Minimal asyncio interval scheduler
+
+    Each job runs in its own loop, so a slow job never delays the others and
+    a job never overlaps with itself. When several API workers run the same
+    schedule, a Postgres advisory lock keyed on the job name ensures only one
+    of them executes a given run.
+    """
+
+    def __init__(self):
+        self._jobs: Dict[str, ScheduledJob] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def add_job(
+        self,
+        name: str,
+        func: Union[Callable[[], Awaitable[object]], str],
+        interval_seconds: float,
+        initial_delay_seconds: float = 0.0,
+    ) -> ScheduledJob:
+        """
+        Register a coroutine function to run every interval_seconds
+
+        Args:
+            name: Unique job name (also used as the advisory lock key)
+            func: Coroutine function taking no arguments, or its "module:function"
+                path, imported on first run so heavy job dependencies (numpy,
+                pyarrow) stay out of worker startup
+            interval_seconds: Delay between the end of one run and the next
+            initial_delay_seconds: Delay before the first run
+
+        Returns:
+            The registered job
+        """
+        job = ScheduledJob(name, func, interval_seconds, initial_delay_seconds)
+        self._jobs[name] = job
+        return job
+
+    def start(self):
+        """Start a loop task for every registered job"""
+        if self._tasks:
+            return
+        for job in self._jobs.values():
+            self._tasks.append(asyncio.create_task(self._run_loop(job), name=f"job:{job.name}"))
+
+    async def stop(self):
+        """Cancel all job loops and wait for them to exit"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def get_status(self) -> List[dict]:
+        """Snapshot of every job's last run"""
+        return [
+            {
+                "name": job.name,
+                "interval_seconds": job.interval_seconds,
+                "runs": job.runs,
+                "last_started_at": job.last_started_at,
+                "last_duration_seconds": job.last_duration_seconds,
+                "last_error": job.last_error,
+            }
+            for job in self._jobs.values()
+        ]
+
+    async def run_now(self, name: str) -> object:
+        """Run a registered job immediately (still honouring the advisory lock)"""
+        return await self._run_once(self._jobs[name])
+
+    async def _run_loop(self, job: ScheduledJob):
+        await asyncio.sleep(job.initial_delay_seconds)
+        while True:
+            try:
+                await self._run_once(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Scheduled job %s failed", job.name)
+            await asyncio.sleep(job.interval_seconds)
+
+    async def _run_once(self, job: ScheduledJob) -> object:
+        async with get_db_connection(POOL_BACKGROUND) as conn:
+            locked = await conn.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", job.name)
+            if not locked:
+                logger.info("Skipping job %s: another worker holds the lock", job.name)
+                return None
+
+            job.last_started_at = time.time()
+            started = time.perf_counter()
+            try:
+                if isinstance(job.func, str):
+                    module, attr = job.func.split(":")
+                    job.func = getattr(importlib.import_module(module), attr)
+                job.last_result = await job.func()
+                job.last_error = None
+                return job.last_result
+            except Exception as e:
+                job.last_error = str(e)
+                raise
+            finally:
+                job.runs += 1
+                job.last_duration_seconds = time.perf_counter() - started
+                await conn.execute("SELECT pg_advisory_unlock(hashtext($1))", job.name)
+
+
+# Process-wide scheduler instance
+scheduler = Scheduler()
+
+
+@registry.register_collector
+def _collect_job_metrics():
+    jobs = scheduler.get_status()
+    yield (
+        "iotlinker_job_runs", "counter", "Scheduled job runs on this worker",
+        [("_total", {"job": job["name"]}, job["runs"]) for job in jobs],
+    )
+    yield (
+        "iotlinker_job_last_duration_seconds", "gauge", "Duration of the last run of each job",
+        [("", {"job": job["name"]}, job["last_duration_seconds"] or 0) for job in jobs],
+    )
+    yield (
+        "iotlinker_job_last_run_failed", "gauge", "1 if the last run of the job raised",
+        [("", {"job": job["name"]}, 1 if job["last_error"] else 0) for job in jobs],
+    )
@@ -0,0 +1,427 @@
+"""
+Prometheus Metrics
+Lightweight counters, gauges and histograms rendered in the Prometheus text format
+"""
+
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+# Metrics are plain attribute increments with no locking: every observation
+# happens on the event loop thread (worker threads and processes do not
+# record), and a lost increment under a rare thread race is acceptable for
+# monitoring. Children are cached per label tuple so the hot path is one dict
+# lookup plus an add; observe() costs well under a microsecond.
+
+# Default latency buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# A collector yields (name, type, help, samples) where samples are
+# (suffix, labels, value) tuples; used for values that already live elsewhere
+Sample = Tuple[str, Dict[str, str], float]
+Family = Tuple[str, str, str, List[Sample]]
+Collector = Callable[[], Iterable[Family]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        # bisect_left gives the first bucket whose upper bound is >= value (le)
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    """Context manager observing elapsed seconds into a histogram child"""
+
+    __slots__ = ("child", "started")
+
+    def __init__(self, child: _HistogramChild):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.started)
+        return False
+
+
+class _Metric:
+    """Base for labelled metric families"""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """Child metric for one combination of label values (cached)"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _samples(self) -> List[Sample]:
+        raise NotImplementedError
+
+    def collect(self) -> Family:
+        return self.name, self.type_name, self.documentation, self._samples()
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter"""
+
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._children[()].value += amount
+
+    def _samples(self) -> List[Sample]:
+        return [
+            ("_total", dict(zip(self.labelnames, values)), child.value)
+            for values, child in list(self._children.items())
+        ]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1.0):
+        self._children[()].value += amount
+
+    def dec(self, amount: float = 1.0):
+        self._children[()].value -= amount
+
+    def set(self, value: float):
+        self._children[()].value = value
+
+    def _samples(self) -> List[Sample]:
+        return [
+            ("", dict(zip(self.labelnames, values)), child.value)
+            for values, child in list(self._children.items())
+        ]
+
+
+class Histogram(_Metric):
+    """Bucketed distribution with cumulative buckets, sum and count"""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def time(self):
+        return self._children[()].time()
+
+    def _samples(self) -> List[Sample]:
+        return [
+            sample
+            for values, child in list(self._children.items())
+            for sample in histogram_samples(
+                dict(zip(self.labelnames, values)), self.buckets, child.counts, child.sum
+            )
+        ]
+
+
+def histogram_samples(
+    labels: Dict[str, str],
+    buckets: Sequence[float],
+    counts: Sequence[int],
+    total: float,
+) -> List[Sample]:
+    """
+    Prometheus samples for a histogram stored as per-bucket (non-cumulative) counts
+
+    Args:
+        labels: Labels shared by every sample
+        buckets: Bucket upper bounds, ascending (+Inf implied)
+        counts: len(buckets) + 1 counts, the last one for values above every bound
+        total: Sum of observed values
+
+    Returns:
+        _bucket, _sum and _count samples
+    """
+    samples: List[Sample] = []
+    cumulative = 0
+    for bound, count in zip(tuple(buckets) + (float("inf"),), counts):
+        cumulative += count
+        samples.append(("_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+    samples.append(("_sum", labels, total))
+    samples.append(("_count", labels, cumulative))
+    return samples
+
+
+class Registry:
+    """Holds metric families and collectors and renders the exposition text"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Collector] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric '{metric.name}' is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def register_collector(self, collector: Collector) -> Collector:
+        """Add a callable evaluated at scrape time (usable as a decorator)"""
+        self._collectors.append(collector)
+        return collector
+
+    def collect(self) -> Iterable[Family]:
+        for metric in list(self._metrics.values()):
+            yield metric.collect()
+        for collector in self._collectors:
+            yield from collector()
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for name, type_name, documentation, samples in self.collect():
+            lines.append(f"# HELP {name} {_escape(documentation)}")
+            lines.append(f"# TYPE {name} {type_name}")
+            for suffix, labels, value in samples:
+                lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry
+registry = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return registry.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return registry.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    labelnames: Sequence[str] = (),
+    buckets: Sequence[float] = DEFAULT_BUCKETS,
+) -> Histogram:
+    return registry.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# =====================================================
+# APPLICATION METRICS
+# =====================================================
+
+HTTP_REQUEST_DURATION = histogram(
+    "iotlinker_http_request_duration_seconds",
+    "HTTP request duration by route template, method and status",
+    ("route", "method", "status"),
+)
+HTTP_REQUESTS_IN_PROGRESS = gauge(
+    "iotlinker_http_requests_in_progress",
+    "HTTP requests currently being served",
+)
+INGEST_POINTS = counter(
+    "iotlinker_ingest_points",
+    "Telemetry data points accepted by the ingest endpoint",
+)
+INGEST_REJECTED_POINTS = counter(
+    "iotlinker_ingest_rejected_points",
+    "Telemetry data points rejected by their device type's sensor_schema",
+)
+DB_QUERY_DURATION = histogram(
+    "iotlinker_db_query_duration_seconds",
+    "asyncpg query duration by statement name ('adhoc' for unregistered SQL)",
+    ("statement",),
+)
+SUPABASE_REQUEST_DURATION = histogram(
+    "iotlinker_supabase_request_duration_seconds",
+    "Supabase REST call latency by table, method and status",
+    ("table", "method", "status"),
+)
+BACKGROUND_TASKS_PENDING = gauge(
+    "iotlinker_background_tasks_pending",
+    "Background tasks started but not yet finished",
+    ("task",),
+)
+BACKGROUND_TASK_FAILURES = counter(
+    "iotlinker_background_task_failures",
+    "Background tasks that raised an error",
+    ("task",),
+)
+
+
+# =====================================================
+# ASGI MIDDLEWARE
+# =====================================================
+
+class MetricsMiddleware:
+    """
+    Records request duration per route template, method and status
+
+    Pure ASGI rather than BaseHTTPMiddleware, which would add a task and a
+    stream copy per request. The route template (e.g. /api/v1/devices/{device_id})
+    is read from the scope after routing, so label cardinality stays bounded;
+    unmatched paths share a single label.
+    """
+
+    def __init__(self, app, skip_paths: Sequence[str] = ("/metrics",)):
+        self.app = app
+        self.skip_paths = frozenset(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        in_progress = HTTP_REQUESTS_IN_PROGRESS._children[()]
+        in_progress.value += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_progress.value -= 1
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_DURATION.labels(template, scope["method"], str(status_code)).observe(
+                time.perf_counter() - started
+            )
+
+
+# =====================================================
+# SUPABASE (HTTPX) INSTRUMENTATION
+# =====================================================
+
+_START_KEY = "iotlinker_metrics_started"
+
+
+def _supabase_table(path: str) -> str:
+    # /rest/v1/<table>, /rest/v1/rpc/<function>
+    parts = [part for part in path.split("/") if part]
+    if len(parts) >= 3 and parts[0] == "rest":
+        return "/".join(parts[2:4]) if parts[2] == "rpc" else parts[2]
+    return parts[0] if parts else "/"
+
+
+def _on_request(request):
+    request.extensions[_START_KEY] = time.perf_counter()
+
+
+def _on_response(response):
+    started: Optional[float] = response.request.extensions.get(_START_KEY)
+    if started is None:
+        return
+    request = response.request
+    SUPABASE_REQUEST_DURATION.labels(
+        _supabase_table(request.url.path), request.method, str(response.status_code)
+    ).observe(time.perf_counter() - started)
+
+
+def instrument_httpx_client(client):
+    """
+    Attach latency hooks to an httpx.Client (e.g. the Supabase postgrest session)
+
+    Latency is measured from request send to response headers, which is what
+    the synchronous postgrest client blocks on.
+    """
+    hooks = client.event_hooks
+    if _on_request not in hooks["request"]:
+        hooks["request"].append(_on_request)
+        hooks["response"].append(_on_response)
+        client.event_hooks = hooks
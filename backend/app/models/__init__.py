@@ -4,26 +4,46 @@ Models package
 
 from app.models.device import (
     DeviceCreate,
+    BulkDeviceItem,
     DeviceUpdate,
+    DeviceSelector,
+    DevicePatch,
+    DeviceBulkUpdate,
+    BulkJobResponse,
+    DeviceSearchHit,
+    DeviceSearchResponse,
     DeviceResponse,
     DeviceCredentials,
     DeviceListResponse,
+    DeviceDataPoint,
     DeviceDataBatch,
+    BackfillSessionResponse,
     DeviceDataResponse,
     DeviceDataQuery,
+    PercentilesResponse,
     DeviceTypeResponse,
     DeviceStatus
 )
 
 __all__ = [
     "DeviceCreate",
+    "BulkDeviceItem",
     "DeviceUpdate",
+    "DeviceSelector",
+    "DevicePatch",
+    "DeviceBulkUpdate",
+    "BulkJobResponse",
+    "DeviceSearchHit",
+    "DeviceSearchResponse",
     "DeviceResponse",
     "DeviceCredentials",
     "DeviceListResponse",
+    "DeviceDataPoint",
     "DeviceDataBatch",
+    "BackfillSessionResponse",
     "DeviceDataResponse",
     "DeviceDataQuery",
+    "PercentilesResponse",
     "DeviceTypeResponse",
     "DeviceStatus"
 ]
@@ -71,3 +71,35 @@ class ChannelListResponse(BaseModel):
     page: int
     page_size: int
     total_pages: int
+
+
+class ChannelSummaryMetric(BaseModel):
+    """Latest reading and 24h sparkline of one device metric"""
+    metric_name: str
+    unit: Optional[str] = None
+    latest_value: Optional[float] = None
+    latest_time: Optional[datetime] = None
+    sparkline: list[Optional[float]] = Field(
+        default_factory=list,
+        description="Hourly averages from window_start, None for hours without data"
+    )
+
+
+class ChannelSummaryDevice(BaseModel):
+    """Device entry of a channel summary (no credentials)"""
+    id: str
+    name: str
+    status: Optional[str] = None
+    last_seen: Optional[datetime] = None
+    device_type_id: Optional[str] = None
+    metrics: list[ChannelSummaryMetric] = Field(default_factory=list)
+
+
+class ChannelSummary(BaseModel):
+    """Everything the channel dashboard shows, in one response"""
+    channel: Channel
+    status_counts: Dict[str, int] = Field(..., description="Devices per status")
+    window_start: datetime
+    bucket_seconds: int
+    devices: list[ChannelSummaryDevice]
+    generated_at: datetime
@@ -3,10 +3,11 @@ Device Models
 Pydantic models for device-related requests and responses
 """
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from typing import Optional, Dict, Any, List
 from datetime import datetime
 from enum import Enum
+from uuid import UUID
 
 
 class DeviceStatus(str, Enum):
@@ -43,6 +44,17 @@ class DeviceCreate(DeviceBase):
     channel_id: str = Field(..., description="Channel ID (required) - every device must belong to a channel")
 
 
+class BulkDeviceItem(BaseModel):
+    """One device in a bulk provisioning request (tenant and channel come from the request)"""
+    name: str = Field(..., min_length=1, max_length=255, description="Device name")
+    description: Optional[str] = Field(None, max_length=1000, description="Device description")
+    device_type_id: Optional[UUID] = Field(None, description="Device type ID")
+    location: Optional[LocationModel] = Field(None, description="Device location")
+    metadata: Optional[Dict[str, Any]] = Field(default_factory=dict, description="Additional metadata")
+    configuration: Optional[Dict[str, Any]] = Field(default_factory=dict, description="Device configuration")
+    firmware_version: Optional[str] = Field(None, max_length=50, description="Firmware version")
+
+
 class DeviceUpdate(BaseModel):
     """Model for updating a device"""
     name: Optional[str] = Field(None, min_length=1, max_length=255)
@@ -55,6 +67,73 @@ class DeviceUpdate(BaseModel):
     firmware_version: Optional[str] = Field(None, max_length=50)
 
 
+class DeviceSelector(BaseModel):
+    """Which devices of a tenant a bulk update applies to (all given filters must match)"""
+    tenant_id: UUID
+    device_ids: Optional[List[UUID]] = Field(None, max_length=100000, description="Explicit device IDs")
+    channel_id: Optional[UUID] = None
+    device_type_id: Optional[UUID] = None
+    metadata_contains: Optional[Dict[str, Any]] = Field(None, description="JSONB containment (metadata @> value)")
+    status: Optional[DeviceStatus] = None
+    all_devices: bool = Field(False, description="Must be true to select every device of the tenant")
+
+    @model_validator(mode="after")
+    def require_filter(self):
+        filters = (self.device_ids, self.channel_id, self.device_type_id, self.metadata_contains, self.status)
+        if all(f is None for f in filters) and not self.all_devices:
+            raise ValueError("Provide at least one filter, or set all_devices to true")
+        return self
+
+
+class DevicePatch(BaseModel):
+    """Changes applied to every selected device; metadata/configuration are merged, not replaced"""
+    status: Optional[DeviceStatus] = None
+    firmware_version: Optional[str] = Field(None, max_length=50)
+    metadata: Optional[Dict[str, Any]] = Field(None, description="Keys merged into metadata (jsonb ||)")
+    metadata_remove: Optional[List[str]] = Field(None, description="Top-level metadata keys to delete")
+    configuration: Optional[Dict[str, Any]] = Field(None, description="Keys merged into configuration (jsonb ||)")
+
+    @model_validator(mode="after")
+    def require_change(self):
+        if not self.model_dump(exclude_none=True):
+            raise ValueError("Patch must change at least one field")
+        return self
+
+
+class DeviceBulkUpdate(BaseModel):
+    """Bulk update request"""
+    selector: DeviceSelector
+    patch: DevicePatch
+
+
+class BulkJobResponse(BaseModel):
+    """Progress of a bulk device operation"""
+    job_id: Optional[str] = None  # None when the update finished within the request
+    status: str
+    processed: int
+    total: Optional[int] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
+class DeviceSearchHit(BaseModel):
+    """One device search result"""
+    id: str
+    name: str
+    description: Optional[str] = None
+    status: Optional[DeviceStatus] = None
+    channel_id: Optional[str] = None
+    score: Optional[float] = None  # word similarity (0-1); None for index suggestions
+
+
+class DeviceSearchResponse(BaseModel):
+    """Ranked device search results"""
+    query: str
+    results: List[DeviceSearchHit]
+    source: str  # "database" or "index" (in-memory prefix index)
+
+
 class DeviceResponse(DeviceBase):
     """Model for device response"""
     id: str  # UUID as string to allow non-v4 UUIDs from database
@@ -99,6 +178,7 @@ class DeviceDataPoint(BaseModel):
     unit: Optional[str] = Field(None, max_length=50)
     metadata: Optional[Dict[str, Any]] = Field(default_factory=dict)
     quality_score: Optional[int] = Field(100, ge=0, le=100)
+    timestamp: Optional[datetime] = None  # If not provided, use the batch timestamp
 
 
 class DeviceDataBatch(BaseModel):
@@ -107,6 +187,25 @@ class DeviceDataBatch(BaseModel):
     device_key: str  # For authentication
     data: List[DeviceDataPoint]
     timestamp: Optional[datetime] = None  # If not provided, use server time
+    # Client idempotency key: a retried batch with the same batch_id (or
+    # sequence number) is acknowledged again without being re-ingested
+    batch_id: Optional[str] = Field(None, min_length=1, max_length=100)
+    sequence: Optional[int] = Field(None, ge=0)
+
+
+class BackfillSessionResponse(BaseModel):
+    """State of a store-and-forward backfill session"""
+    session_id: str
+    device_id: str
+    status: str
+    offset: int  # records acknowledged; resume uploads from here
+    stored_points: int
+    rejected_records: int
+    created_at: datetime
+    updated_at: datetime
+    # Set on upload responses only
+    duplicates_in_upload: Optional[int] = None
+    errors: Optional[List[str]] = None  # sample of rejected records
 
 
 class DeviceDataResponse(BaseModel):
@@ -129,6 +228,20 @@ class DeviceDataQuery(BaseModel):
     limit: Optional[int] = Field(100, ge=1, le=10000)
 
 
+class PercentilesResponse(BaseModel):
+    """Percentiles of a metric over a time range, merged from rollup sketches"""
+    metric_name: str
+    start_time: datetime
+    end_time: datetime
+    device_count: int
+    sample_count: int
+    unsketched_count: int = 0  # samples in old tier buckets without a sketch, left out of the percentiles
+    min_value: Optional[float] = None  # exact
+    max_value: Optional[float] = None  # exact
+    percentiles: Dict[str, Optional[float]]  # e.g. "p99" -> value (None without data)
+    relative_accuracy: float  # each percentile is within this fraction of the exact value
+
+
 # =====================================================
 # DEVICE TYPES
 # =====================================================
@@ -0,0 +1,36 @@
+"""
+API Token Models
+Programmatic access tokens (only their hash is stored)
+"""
+
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from datetime import datetime
+from uuid import UUID
+
+
+class ApiTokenCreate(BaseModel):
+    """Model for creating an API token"""
+    tenant_id: UUID = Field(..., description="Tenant the token acts for")
+    user_id: Optional[UUID] = Field(None, description="User the token acts as")
+    name: str = Field(..., min_length=1, max_length=255)
+    scopes: List[str] = Field(default_factory=list)
+    expires_at: Optional[datetime] = None
+
+
+class ApiToken(BaseModel):
+    """API token without its secret"""
+    id: UUID
+    tenant_id: UUID
+    user_id: Optional[UUID] = None
+    name: str
+    scopes: List[str] = Field(default_factory=list)
+    last_used_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+    is_active: bool
+    created_at: datetime
+
+
+class ApiTokenCreated(ApiToken):
+    """Newly created token, including the secret (returned only once)"""
+    token: str
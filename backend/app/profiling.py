@@ -0,0 +1,243 @@
+"""
+Request Profiler
+Per-request DB/Supabase call recording, Server-Timing headers and slow-request traces
+"""
+
+import cProfile
+import logging
+import os
+import random
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from app.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+# Profile of the request being served on the current task, if profiling is on.
+# Everything below is a no-op (one ContextVar lookup) when it is unset.
+_current: ContextVar[Optional["RequestProfile"]] = ContextVar("request_profile", default=None)
+
+# cProfile hooks the whole thread, so only one sampled request is traced at a time
+_tracing = False
+
+
+class RequestProfile:
+    """Calls made while serving one request"""
+
+    __slots__ = ("method", "path", "started", "calls")
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        # (kind, fingerprint, seconds)
+        self.calls: List[Tuple[str, str, float]] = []
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def totals(self, kind: str) -> Tuple[int, float]:
+        durations = [seconds for call_kind, _, seconds in self.calls if call_kind == kind]
+        return len(durations), sum(durations)
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int]]:
+        """Fingerprints issued at least threshold times (likely N+1 loops)"""
+        counts = Counter(fingerprint for _, fingerprint, _ in self.calls)
+        return [(fingerprint, n) for fingerprint, n in counts.most_common() if n >= threshold]
+
+
+def record_call(kind: str, fingerprint: str, seconds: float):
+    """Attach a DB ("db") or Supabase ("supabase") call to the current request"""
+    profile = _current.get()
+    if profile is not None:
+        profile.calls.append((kind, fingerprint, seconds))
+
+
+def is_active() -> bool:
+    return _current.get() is not None
+
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|(?<![$\w])\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def fingerprint_sql(sql: str) -> str:
+    """Normalised SQL: whitespace collapsed, literals replaced with ?"""
+    return _LITERALS.sub("?", _WHITESPACE.sub(" ", sql).strip())[:200]
+
+
+def fingerprint_http(method: str, path: str, query_keys) -> str:
+    """Supabase call shape: method, path and filter columns (values dropped)"""
+    keys = ",".join(sorted(set(query_keys)))
+    return f"{method} {path}?{keys}" if keys else f"{method} {path}"
+
+
+# =====================================================
+# CONNECTION PROXY
+# =====================================================
+
+class ProfiledConnection:
+    """
+    Wraps a pooled asyncpg connection and records each query it runs
+
+    Only handed out by get_db_connection while a request is being profiled;
+    everything other than the query methods is delegated unchanged.
+    """
+
+    __slots__ = ("_conn",)
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    async def _timed(self, method: str, query: str, args, kwargs):
+        started = time.perf_counter()
+        try:
+            return await getattr(self._conn, method)(query, *args, **kwargs)
+        finally:
+            record_call("db", fingerprint_sql(query), time.perf_counter() - started)
+
+    async def fetch(self, query, *args, **kwargs):
+        return await self._timed("fetch", query, args, kwargs)
+
+    async def fetchrow(self, query, *args, **kwargs):
+        return await self._timed("fetchrow", query, args, kwargs)
+
+    async def fetchval(self, query, *args, **kwargs):
+        return await self._timed("fetchval", query, args, kwargs)
+
+    async def execute(self, query, *args, **kwargs):
+        return await self._timed("execute", query, args, kwargs)
+
+    async def executemany(self, query, *args, **kwargs):
+        return await self._timed("executemany", query, args, kwargs)
+
+
+# =====================================================
+# SUPABASE (HTTPX) HOOKS
+# =====================================================
+
+_START_KEY = "iotlinker_profile_started"
+
+
+def _on_request(request):
+    if _current.get() is not None:
+        request.extensions[_START_KEY] = time.perf_counter()
+
+
+def _on_response(response):
+    started = response.request.extensions.get(_START_KEY)
+    if started is None:
+        return
+    request = response.request
+    record_call(
+        "supabase",
+        fingerprint_http(request.method, request.url.path, request.url.params.keys()),
+        time.perf_counter() - started,
+    )
+
+
+def instrument_httpx_client(client):
+    """Record calls made through an httpx.Client (e.g. the Supabase postgrest session)"""
+    hooks = client.event_hooks
+    if _on_request not in hooks["request"]:
+        hooks["request"].append(_on_request)
+        hooks["response"].append(_on_response)
+        client.event_hooks = hooks
+
+
+# =====================================================
+# ASGI MIDDLEWARE
+# =====================================================
+
+def _server_timing(profile: RequestProfile) -> bytes:
+    parts = []
+    for kind in ("db", "supabase"):
+        count, seconds = profile.totals(kind)
+        if count:
+            parts.append(f'{kind};dur={seconds * 1000:.1f};desc="{count} calls"')
+    parts.append(f"app;dur={profile.elapsed() * 1000:.1f}")
+    return ", ".join(parts).encode("latin-1")
+
+
+class ProfilingMiddleware:
+    """
+    Opt-in request profiler (PROFILING_ENABLED)
+
+    Records every DB and Supabase call made by a request, adds a
+    Server-Timing header (db, supabase and app time), and logs a warning
+    with the repeated query shapes when a request exceeds the query-count
+    or duration budget. A PROFILING_SAMPLE_RATE fraction of requests also
+    runs under cProfile; the trace is written to PROFILING_DUMP_DIR only if
+    that request turns out to be over budget. The trace covers the whole
+    event loop thread, so concurrent requests show up in it too.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _tracing
+
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"])
+        token = _current.set(profile)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", _server_timing(profile)))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        profiler = None
+        if not _tracing and random.random() < settings.PROFILING_SAMPLE_RATE:
+            _tracing = True
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                _tracing = False
+            _current.reset(token)
+            self._check_budget(profile, profiler)
+
+    def _check_budget(self, profile: RequestProfile, profiler: Optional[cProfile.Profile]):
+        elapsed_ms = profile.elapsed() * 1000
+        if (
+            len(profile.calls) <= settings.PROFILING_MAX_CALLS
+            and elapsed_ms <= settings.PROFILING_MAX_DURATION_MS
+        ):
+            return
+
+        db_count, db_seconds = profile.totals("db")
+        rest_count, rest_seconds = profile.totals("supabase")
+        logger.warning(
+            "Request over budget: %s %s took %.1f ms with %d DB calls (%.1f ms) and "
+            "%d Supabase calls (%.1f ms); repeated: %s",
+            profile.method, profile.path, elapsed_ms,
+            db_count, db_seconds * 1000, rest_count, rest_seconds * 1000,
+            profile.repeated(settings.PROFILING_REPEAT_THRESHOLD) or "none",
+        )
+
+        if profiler is not None:
+            os.makedirs(settings.PROFILING_DUMP_DIR, exist_ok=True)
+            name = re.sub(r"[^A-Za-z0-9]+", "_", f"{profile.method}{profile.path}").strip("_")
+            path = os.path.join(settings.PROFILING_DUMP_DIR, f"{int(time.time() * 1000)}_{name}.prof")
+            profiler.dump_stats(path)
+            logger.warning("Wrote cProfile trace to %s", path)
@@ -0,0 +1,225 @@
+"""
+Admission Control
+Token-bucket rate limits for ingest and adaptive load shedding of low-priority reads
+"""
+
+import math
+import random
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException
+
+from app.config import settings
+from app.database import get_recent_acquire_wait, POOL_INGEST, POOL_INTERACTIVE
+from app.metrics import counter
+
+
+# Limiter state is only touched from the event loop thread, and a check is
+# a handful of float operations with no await in between, so buckets need
+# no locks: concurrent requests never contend on anything.
+
+RATE_LIMITED = counter(
+    "iotlinker_rate_limited_requests",
+    "Ingest requests rejected with 429 by limiter scope",
+    ("scope",),
+)
+SHED_REQUESTS = counter(
+    "iotlinker_shed_requests",
+    "Low-priority requests rejected with 503 by adaptive load shedding",
+)
+
+
+class RateLimitedError(HTTPException):
+    """Raised when a token bucket is empty (HTTP 429)"""
+
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(
+            status_code=429,
+            detail=f"Rate limit exceeded ({scope}), retry later",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+        self.scope = scope
+
+
+class TokenBucket:
+    """
+    Refills at rate tokens/second up to burst; one token per data point
+
+    A batch larger than burst is admitted once the bucket is full and is
+    charged in full: the balance goes negative, and later batches wait
+    until the debt is paid off, so the long-run rate holds whatever the
+    batch size.
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def wait_time(self, cost: float, now: float) -> float:
+        """Refill, then return seconds until cost tokens are available (0 = now)"""
+        # Conditionals rather than min(): this runs several times per ingest request
+        tokens = self.tokens + (now - self.updated) * self.rate
+        self.tokens = tokens if tokens < self.burst else self.burst
+        self.updated = now
+        # More than burst can never be available: a full bucket admits it
+        missing = (cost if cost < self.burst else self.burst) - self.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, cost: float):
+        self.tokens -= cost
+
+
+class BucketMap:
+    """
+    Buckets per key, bounded by LRU eviction
+
+    An evicted key simply starts again with a full bucket, so the bound
+    only trades a little precision for idle keys against memory.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def get(self, key: str, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class IngestLimiter:
+    """
+    Per-device, per-tenant and global token buckets for telemetry ingest
+
+    Before authentication only the global bucket is checked (nothing is
+    taken), which sheds floods before any database work without letting
+    unauthenticated requests spend a device's budget. Once the device key
+    matches, the request is admitted only if every bucket has enough
+    tokens, and tokens are taken from all of them together, so a request
+    rejected by one scope does not drain the others.
+    """
+
+    def __init__(self):
+        max_keys = settings.RATE_LIMIT_MAX_KEYS
+        self.devices = BucketMap(settings.RATE_LIMIT_DEVICE_RATE, settings.RATE_LIMIT_DEVICE_BURST, max_keys)
+        self.tenants = BucketMap(settings.RATE_LIMIT_TENANT_RATE, settings.RATE_LIMIT_TENANT_BURST, max_keys)
+        self.global_bucket = TokenBucket(
+            settings.RATE_LIMIT_GLOBAL_RATE, settings.RATE_LIMIT_GLOBAL_BURST, time.monotonic()
+        )
+
+    def check_global(self, points: int):
+        """
+        Raise RateLimitedError (HTTP 429) if the global bucket cannot take points
+
+        Called before the device is authenticated; takes no tokens.
+        """
+        if not settings.RATE_LIMIT_ENABLED:
+            return
+        wait = self.global_bucket.wait_time(points, time.monotonic())
+        if wait > 0:
+            RATE_LIMITED.labels("global").inc()
+            raise RateLimitedError("global", wait)
+
+    def admit(self, device_id: str, tenant_id: str, points: int):
+        """
+        Take points tokens for an authenticated device or raise RateLimitedError (HTTP 429)
+
+        Args:
+            device_id: Device sending the batch
+            tenant_id: Tenant owning the device
+            points: Number of data points in the batch
+        """
+        if not settings.RATE_LIMIT_ENABLED:
+            return
+
+        now = time.monotonic()
+        checks = [
+            ("device", self.devices.get(device_id, now)),
+            ("tenant", self.tenants.get(tenant_id, now)),
+            ("global", self.global_bucket),
+        ]
+        for scope, bucket in checks:
+            wait = bucket.wait_time(points, now)
+            if wait > 0:
+                RATE_LIMITED.labels(scope).inc()
+                raise RateLimitedError(scope, wait)
+        for _, bucket in checks:
+            bucket.take(points)
+
+
+# Process-wide ingest limiter (limits are per API worker)
+ingest_limiter = IngestLimiter()
+
+
+# =====================================================
+# ADAPTIVE LOAD SHEDDING
+# =====================================================
+
+# Read paths never shed: health/readiness checks, metrics and API docs
+_EXEMPT_PREFIXES = ("/health", "/ready", "/metrics", "/docs", "/openapi.json")
+
+# Keep admitting a fraction of low-priority requests even at full shedding,
+# so pool wait keeps being sampled and the shedder can recover
+MAX_SHED_PROBABILITY = 0.9
+
+
+def shed_probability(wait_seconds: float, threshold_seconds: float) -> float:
+    """0 below the threshold, rising linearly to MAX_SHED_PROBABILITY at twice it"""
+    if wait_seconds <= threshold_seconds:
+        return 0.0
+    return min(MAX_SHED_PROBABILITY, (wait_seconds - threshold_seconds) / threshold_seconds)
+
+
+class LoadSheddingMiddleware:
+    """
+    Rejects low-priority traffic with 503 while the database is saturated
+
+    Low priority means reads (GET): dashboards and listings that can be
+    retried. Writes and telemetry ingest are never shed here; ingest is
+    protected by its own token buckets. Saturation is the smoothed recent
+    acquire wait of the ingest and interactive pools; above
+    SHEDDING_WAIT_THRESHOLD_MS a growing fraction of reads is dropped
+    before they reach any handler.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] == "http"
+            and settings.SHEDDING_ENABLED
+            and scope["method"] == "GET"
+            and not scope["path"].startswith(_EXEMPT_PREFIXES)
+        ):
+            wait = max(get_recent_acquire_wait(POOL_INGEST), get_recent_acquire_wait(POOL_INTERACTIVE))
+            probability = shed_probability(wait, settings.SHEDDING_WAIT_THRESHOLD_MS / 1000)
+            if probability and random.random() < probability:
+                SHED_REQUESTS.inc()
+                await send({
+                    "type": "http.response.start",
+                    "status": 503,
+                    "headers": [(b"content-type", b"application/json"), (b"retry-after", b"1")],
+                })
+                await send({
+                    "type": "http.response.body",
+                    "body": b'{"detail":"Server is busy, retry shortly"}',
+                })
+                return
+
+        await self.app(scope, receive, send)
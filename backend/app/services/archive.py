@@ -0,0 +1,301 @@
+"""
+Cold-Tier Archive Storage
+Parquet files partitioned by tenant/day, on local disk or any pyarrow filesystem
+"""
+
+import asyncio
+import json
+import os
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.cache import TTLCache, MISSING
+from app.config import settings
+from app.database import execute_one, execute_query
+from app import invalidation
+
+
+# pyarrow is imported inside the functions that need it: archiving is
+# optional and the import is too heavy to pay on every API worker start.
+
+# Column layout of archived device_data files. tenant_id and day are encoded
+# in the path (hive style) rather than stored in every row.
+ARCHIVE_COLUMNS = ["device_id", "metric_name", "time", "value", "unit", "metadata", "quality_score"]
+
+READ_BATCH_SIZE = 50_000
+
+
+def _utc(value: datetime) -> datetime:
+    """Treat naive datetimes as UTC, matching how device_data stores time"""
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("device_id", pa.string()),
+        ("metric_name", pa.dictionary(pa.int32(), pa.string())),
+        ("time", pa.timestamp("us", tz="UTC")),
+        ("value", pa.float64()),
+        ("unit", pa.dictionary(pa.int32(), pa.string())),
+        ("metadata", pa.string()),
+        ("quality_score", pa.int16()),
+    ])
+
+
+def get_filesystem() -> Tuple[Any, str]:
+    """
+    Resolve ARCHIVE_URI into a pyarrow filesystem and base path
+
+    Plain paths map to the local filesystem; URIs such as s3://bucket/prefix
+    use the matching pyarrow filesystem, so an object store (or a local
+    stand-in such as MinIO) works without code changes.
+    """
+    import pyarrow.fs as pafs
+
+    uri = settings.ARCHIVE_URI
+    if "://" not in uri:
+        return pafs.LocalFileSystem(), os.path.abspath(uri).replace(os.sep, "/")
+    return pafs.FileSystem.from_uri(uri)
+
+
+def partition_path(base: str, tenant_id: str, day: date, part_name: str) -> str:
+    """Path of one archive file: <base>/device_data/tenant_id=<t>/day=<d>/<part>.parquet"""
+    return f"{base}/device_data/tenant_id={tenant_id}/day={day.isoformat()}/{part_name}.parquet"
+
+
+class PartitionWriter:
+    """
+    Streams rows into one Parquet file per (tenant, day)
+
+    Rows must arrive ordered by tenant; writers for a tenant are closed as
+    soon as the next tenant starts, so at most a handful of files are open.
+    """
+
+    def __init__(self, part_name: str):
+        self.fs, self.base = get_filesystem()
+        self.part_name = part_name
+        self.schema = _schema()
+        self._tenant: Optional[str] = None
+        self._writers: Dict[date, Any] = {}
+        self._pending: Dict[date, List[Dict[str, Any]]] = {}
+        # (tenant_id, day) -> [uri, row_count]
+        self.files: Dict[Tuple[str, date], List[Any]] = {}
+
+    def write_rows(self, rows: List[Dict[str, Any]]):
+        """Append rows (dicts with tenant_id plus ARCHIVE_COLUMNS)"""
+        for row in rows:
+            if row["tenant_id"] != self._tenant:
+                self._close_tenant()
+                self._tenant = row["tenant_id"]
+            day = row["time"].astimezone(timezone.utc).date()
+            self._pending.setdefault(day, []).append(row)
+        self._flush_pending()
+
+    def close(self) -> Dict[Tuple[str, date], List[Any]]:
+        """Close all files and return the written partitions"""
+        self._close_tenant()
+        return self.files
+
+    def _flush_pending(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        for day, rows in self._pending.items():
+            writer = self._writers.get(day)
+            if writer is None:
+                path = partition_path(self.base, self._tenant, day, self.part_name)
+                self.fs.create_dir(path.rsplit("/", 1)[0], recursive=True)
+                writer = pq.ParquetWriter(path, self.schema, filesystem=self.fs, compression="zstd")
+                self._writers[day] = writer
+                self.files[(self._tenant, day)] = [path, 0]
+            columns = {name: [row[name] for row in rows] for name in ARCHIVE_COLUMNS}
+            writer.write_batch(pa.record_batch(columns, schema=self.schema))
+            self.files[(self._tenant, day)][1] += len(rows)
+        self._pending = {}
+
+    def _close_tenant(self):
+        self._flush_pending()
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+
+def file_size(path: str) -> int:
+    """Size of an archived file in bytes"""
+    fs, _ = get_filesystem()
+    return fs.get_file_info(path).size or 0
+
+
+def _filter(device_id: str, metric_name: Optional[str], start_time: Optional[datetime], end_time: Optional[datetime]):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    ts_type = pa.timestamp("us", tz="UTC")
+    expr = ds.field("device_id") == device_id
+    if metric_name:
+        expr = expr & (ds.field("metric_name") == metric_name)
+    if start_time:
+        expr = expr & (ds.field("time") >= pa.scalar(_utc(start_time), type=ts_type))
+    if end_time:
+        expr = expr & (ds.field("time") <= pa.scalar(_utc(end_time), type=ts_type))
+    return expr
+
+
+def read_device_data(
+    paths: List[str],
+    device_id: str,
+    metric_name: Optional[str] = None,
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    limit: int = 100,
+) -> List[Dict[str, Any]]:
+    """
+    Read archived points for a device, newest first
+
+    Only the given files are opened (partition pruning happens upstream via
+    the manifest) and the device/metric/time predicates are pushed down to
+    Parquet row-group statistics. Files must be ordered newest day first;
+    reading stops as soon as limit points are collected. Blocking; call via
+    asyncio.to_thread.
+    """
+    import pyarrow.dataset as ds
+
+    fs, _ = get_filesystem()
+    expr = _filter(device_id, metric_name, start_time, end_time)
+    columns = ["device_id", "metric_name", "time", "value", "unit", "quality_score"]
+    rows: List[Dict[str, Any]] = []
+    for path in paths:
+        table = ds.dataset(path, filesystem=fs, format="parquet", schema=_schema()).to_table(
+            columns=columns, filter=expr
+        )
+        table = table.sort_by([("time", "descending")]).slice(0, limit - len(rows))
+        rows.extend(table.to_pylist())
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+def iter_device_data(
+    paths: List[str],
+    device_id: str,
+    metric_name: Optional[str] = None,
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Yield archived points for a device in ascending time, in bounded batches
+
+    Files are read one at a time (paths must be in ascending day order) so
+    memory stays flat for long exports.
+    """
+    import pyarrow.dataset as ds
+
+    fs, _ = get_filesystem()
+    expr = _filter(device_id, metric_name, start_time, end_time)
+    for path in paths:
+        table = ds.dataset(path, filesystem=fs, format="parquet", schema=_schema()).to_table(filter=expr)
+        table = table.sort_by([("time", "ascending")])
+        for batch in table.to_batches(max_chunksize=READ_BATCH_SIZE):
+            rows = batch.to_pylist()
+            for row in rows:
+                if row.get("metadata"):
+                    row["metadata"] = json.loads(row["metadata"])
+            yield rows
+
+
+# =====================================================
+# QUERY FALLBACK
+# =====================================================
+
+# Archived files of a tenant overlapping a day range. Manifest rows are only
+# written in the same transaction that drops the source chunk, so archived
+# ranges never overlap rows still in the hypertable.
+ARCHIVE_FILES_QUERY = """
+    SELECT a.uri
+    FROM device_data_archive a
+    WHERE a.tenant_id = $1
+        AND ($2::date IS NULL OR a.day >= $2)
+        AND ($3::date IS NULL OR a.day <= $3)
+    ORDER BY a.day {direction}
+"""
+
+ARCHIVED_UNTIL_QUERY = """
+    SELECT MAX(day) FROM device_data_archive WHERE tenant_id = $1
+"""
+
+# Newest archived day + 1 per tenant. Chunks are archived oldest first, so
+# nothing at or after it is archived and a range starting there never needs
+# the archive. The archive job publishes "archive" for each tenant it adds
+# files for.
+_archived_until = TTLCache("archived_until", settings.CACHE_MAX_ENTRIES, settings.CACHE_TTL_SECONDS)
+invalidation.subscribe("archive", _archived_until)
+
+
+async def archived_until(tenant_id: str) -> Optional[datetime]:
+    """Start of the day after a tenant's newest archived day, None if nothing is archived (cached)"""
+    key = str(tenant_id)
+    until = _archived_until.get(key)
+    if until is MISSING:
+        generation = _archived_until.generation
+        day = await execute_one(ARCHIVED_UNTIL_QUERY, key)
+        until = datetime.combine(day + timedelta(days=1), time(), tzinfo=timezone.utc) if day else None
+        _archived_until.set(key, until, generation)
+    return until
+
+
+async def _archive_paths(
+    tenant_id: str,
+    start_time: Optional[datetime],
+    end_time: Optional[datetime],
+    newest_first: bool,
+) -> List[str]:
+    """Files that can hold points of the range; none when it starts after everything archived"""
+    until = await archived_until(tenant_id)
+    if until is None or (start_time is not None and _utc(start_time) >= until):
+        return []
+    query = ARCHIVE_FILES_QUERY.format(direction="DESC" if newest_first else "ASC")
+    records = await execute_query(
+        query,
+        str(tenant_id),
+        _utc(start_time).astimezone(timezone.utc).date() if start_time else None,
+        _utc(end_time).astimezone(timezone.utc).date() if end_time else None,
+    )
+    return [record["uri"] for record in records]
+
+
+async def fetch_archived_device_data(
+    device_id: str,
+    tenant_id: str,
+    metric_name: Optional[str],
+    start_time: Optional[datetime],
+    end_time: Optional[datetime],
+    limit: int,
+) -> List[Dict[str, Any]]:
+    """Newest-first archived points for a device (empty when the range is not archived)"""
+    paths = await _archive_paths(tenant_id, start_time, end_time, newest_first=True)
+    if not paths:
+        return []
+    return await asyncio.to_thread(
+        read_device_data, paths, device_id, metric_name, start_time, end_time, limit
+    )
+
+
+async def stream_archived_device_data(
+    device_id: str,
+    tenant_id: str,
+    metric_name: Optional[str],
+    start_time: Optional[datetime],
+    end_time: Optional[datetime],
+):
+    """Async generator of archived point batches in ascending time"""
+    paths = await _archive_paths(tenant_id, start_time, end_time, newest_first=False)
+    if not paths:
+        return
+    batches = iter_device_data(paths, device_id, metric_name, start_time, end_time)
+    while True:
+        batch = await asyncio.to_thread(next, batches, None)
+        if batch is None:
+            break
+        yield batch
@@ -0,0 +1,337 @@
+"""
+Store-and-Forward Backfill
+Streams compressed NDJSON or binary uploads into device_data in bounded, resumable chunks
+
+Body formats (optionally gzip or zstd compressed, see Content-Encoding):
+
+    application/x-ndjson      one point per line:
+                              {"metric_name": "temp", "value": 21.5,
+                               "timestamp": "2024-12-01T10:00:00Z", ...}
+                              (fields as DeviceDataPoint, timestamp required)
+    application/octet-stream  packed little-endian records:
+                              int64 time (microseconds since the Unix epoch, UTC)
+                              float64 value
+                              uint8 quality_score
+                              uint16 metric name length n, then n bytes UTF-8
+
+Every record (non-empty NDJSON line or binary record) advances the session
+offset, including rejected ones (malformed, or breaking the device type's
+sensor_schema), so offsets always refer to positions in
+the uploaded stream.
+"""
+
+import struct
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
+from uuid import UUID
+
+from pydantic import ValidationError
+
+from app.config import settings
+from app.database import get_db_connection, POOL_BACKGROUND, POOL_INGEST
+from app.metrics import INGEST_REJECTED_POINTS
+from app.models import DeviceDataPoint
+from app.services.hot_window import hot_window
+from app.services.ingest import PointRow, dedupe_rows, point_row, write_rows
+from app.services.sensor_schema import CompiledSchema
+from app.statements import statements
+
+
+# Upper bound on decompressed bytes produced per step (and fed per zstd step),
+# which keeps memory flat however well the body compresses
+MAX_PIECE_BYTES = 256 * 1024
+ZSTD_INPUT_BYTES = 16 * 1024
+
+MAX_LINE_BYTES = 64 * 1024
+MAX_ERROR_SAMPLES = 20
+
+_BINARY_RECORD = struct.Struct("<qdBH")
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# Binary timestamps a datetime can hold (years 1-9999)
+_MIN_MICROS = (datetime.min.replace(tzinfo=timezone.utc) - _EPOCH) // timedelta(microseconds=1)
+_MAX_MICROS = (datetime.max.replace(tzinfo=timezone.utc) - _EPOCH) // timedelta(microseconds=1)
+
+CREATE_SESSION = statements.register("backfill_sessions.insert", """
+    INSERT INTO backfill_sessions (device_id, tenant_id)
+    VALUES ($1, $2)
+    RETURNING *
+""")
+
+GET_SESSION = statements.register("backfill_sessions.get", """
+    SELECT * FROM backfill_sessions WHERE id = $1 AND device_id = $2
+""")
+
+# Advances only from the offset the upload started at, so two concurrent
+# uploads to one session cannot both commit the same records
+ADVANCE_SESSION = statements.register("backfill_sessions.advance", """
+    UPDATE backfill_sessions SET
+        committed_records = committed_records + $3,
+        stored_points = stored_points + $4,
+        rejected_records = rejected_records + $5,
+        updated_at = NOW()
+    WHERE id = $1 AND committed_records = $2 AND status = 'open'
+    RETURNING committed_records
+""")
+
+COMPLETE_SESSION = statements.register("backfill_sessions.complete", """
+    UPDATE backfill_sessions SET status = 'completed', updated_at = NOW()
+    WHERE id = $1
+    RETURNING *
+""")
+
+
+class UnsupportedEncodingError(ValueError):
+    """Content-Encoding or Content-Type the backfill endpoint cannot read"""
+
+
+class OffsetConflictError(Exception):
+    """The upload does not continue from the session's acknowledged offset"""
+
+    def __init__(self, message: str, committed: int):
+        super().__init__(message)
+        self.committed = committed
+
+
+# =====================================================
+# DECOMPRESSION AND PARSING
+# =====================================================
+
+def _new_decompressor(encoding: str):
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+    if encoding == "zstd":
+        try:
+            import zstandard
+        except ImportError as e:
+            raise UnsupportedEncodingError("zstd bodies require the zstandard package") from e
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise UnsupportedEncodingError(f"Unsupported Content-Encoding: {encoding}")
+
+
+async def decompress(chunks: AsyncIterator[bytes], encoding: str) -> AsyncIterator[bytes]:
+    """
+    Decompress a gzip or zstd byte stream incrementally
+
+    Output is produced in pieces of at most MAX_PIECE_BYTES (zstd: per
+    ZSTD_INPUT_BYTES of input), and concatenated members/frames are read
+    one after another.
+    """
+    encoding = (encoding or "identity").strip().lower()
+    if encoding == "identity":
+        async for chunk in chunks:
+            yield chunk
+        return
+
+    decompressor = _new_decompressor(encoding)
+    is_zlib = encoding != "zstd"
+    pending = False
+    async for chunk in chunks:
+        data = chunk
+        while data:
+            try:
+                if is_zlib:
+                    piece = decompressor.decompress(data, MAX_PIECE_BYTES)
+                    data = decompressor.unconsumed_tail
+                else:
+                    piece = decompressor.decompress(data[:ZSTD_INPUT_BYTES])
+                    data = data[ZSTD_INPUT_BYTES:]
+            except Exception as e:  # zlib.error / zstandard.ZstdError
+                raise ValueError(f"Invalid {encoding} data: {e}") from e
+            pending = True
+            if piece:
+                yield piece
+            if decompressor.eof:
+                # Next member/frame (or trailing data) starts in unused_data
+                data = decompressor.unused_data + data
+                decompressor = _new_decompressor(encoding)
+                pending = False
+    if pending and is_zlib:
+        while True:
+            piece = decompressor.decompress(b"", MAX_PIECE_BYTES)
+            if not piece:
+                break
+            yield piece
+        if not decompressor.eof:
+            raise ValueError("Compressed body ended before the end of the stream")
+    elif pending and not decompressor.eof:
+        raise ValueError("Compressed body ended before the end of the stream")
+
+
+def _ndjson_record(line: bytes) -> Union[PointRow, str]:
+    try:
+        point = DeviceDataPoint.model_validate_json(line)
+    except ValidationError as e:
+        item = e.errors()[0]
+        return f"{'.'.join(str(part) for part in item['loc']) or 'record'}: {item['msg']}"
+    if point.timestamp is None:
+        return "timestamp: Field required"
+    return point_row(point, None)
+
+
+async def ndjson_records(pieces: AsyncIterator[bytes]) -> AsyncIterator[List[Union[PointRow, str]]]:
+    """Batches of rows (or error messages) from an NDJSON byte stream"""
+    pending = b""
+    async for piece in pieces:
+        pending += piece
+        *lines, pending = pending.split(b"\n")
+        if len(pending) > MAX_LINE_BYTES:
+            raise ValueError(f"NDJSON line longer than {MAX_LINE_BYTES} bytes")
+        yield [_ndjson_record(line) for line in lines if line.strip()]
+    if pending.strip():
+        yield [_ndjson_record(pending)]
+
+
+async def binary_records(pieces: AsyncIterator[bytes]) -> AsyncIterator[List[Union[PointRow, str]]]:
+    """Batches of rows (or error messages) from a packed binary stream"""
+    header = _BINARY_RECORD.size
+    pending = b""
+    async for piece in pieces:
+        buffer = pending + piece if pending else piece
+        size = len(buffer)
+        position = 0
+        batch: List[Union[PointRow, str]] = []
+        while size - position >= header:
+            micros, value, quality, name_length = _BINARY_RECORD.unpack_from(buffer, position)
+            end = position + header + name_length
+            if end > size:
+                break
+            raw_name = buffer[position + header:end]
+            position = end
+            try:
+                name = raw_name.decode("utf-8")
+            except UnicodeDecodeError:
+                batch.append("metric_name: invalid UTF-8")
+                continue
+            if not 0 < name_length <= 100:
+                batch.append("metric_name: length must be 1-100 bytes")
+            elif quality > 100:
+                batch.append("quality_score: must be at most 100")
+            elif not _MIN_MICROS <= micros <= _MAX_MICROS:
+                batch.append("timestamp: out of range")
+            else:
+                batch.append((_EPOCH + timedelta(microseconds=micros), name, value, None, "{}", quality))
+        pending = buffer[position:]
+        yield batch
+    if pending:
+        raise ValueError("Binary body ended in the middle of a record")
+
+
+def record_parser(content_type: str):
+    """NDJSON or binary record parser for a request Content-Type"""
+    content_type = (content_type or "").lower()
+    if "ndjson" in content_type or "jsonl" in content_type:
+        return ndjson_records
+    if "octet-stream" in content_type:
+        return binary_records
+    raise UnsupportedEncodingError(f"Unsupported Content-Type: {content_type or 'none'}")
+
+
+# =====================================================
+# SESSIONS
+# =====================================================
+
+async def create_session(device_id: UUID, tenant_id: UUID) -> Dict[str, Any]:
+    # Session bookkeeping is device traffic: ingest budget, not interactive
+    async with get_db_connection(POOL_INGEST) as conn:
+        return dict(await statements.fetchrow(conn, CREATE_SESSION, device_id, tenant_id))
+
+
+async def get_session(session_id: UUID, device_id: UUID) -> Optional[Dict[str, Any]]:
+    async with get_db_connection(POOL_INGEST) as conn:
+        row = await statements.fetchrow(conn, GET_SESSION, session_id, device_id)
+    return dict(row) if row else None
+
+
+@dataclass
+class BackfillUpload:
+    """
+    One upload into a session, starting at `offset`
+
+    Records below the session's committed offset are skipped (a client may
+    resend from an older position); an offset past it is rejected. Every
+    BACKFILL_CHUNK_POINTS records are deduplicated, written and acknowledged
+    in one transaction on the background pool, which is only held for the
+    duration of each write, not for the whole (possibly slow) upload.
+    Points breaking `schema` (the device type's compiled sensor_schema)
+    are rejected like malformed records.
+    """
+    session: Dict[str, Any]
+    offset: int
+    policy: str
+    schema: Optional[CompiledSchema] = None
+    committed: int = field(default=0, init=False)
+    stored: int = field(default=0, init=False)
+    rejected: int = field(default=0, init=False)
+    duplicates: int = field(default=0, init=False)
+    errors: List[str] = field(default_factory=list, init=False)
+    _rows: List[PointRow] = field(default_factory=list, init=False)
+    _records: int = field(default=0, init=False)
+    _rejected: int = field(default=0, init=False)
+
+    def __post_init__(self):
+        self.committed = self.session["committed_records"]
+        if self.offset > self.committed:
+            raise OffsetConflictError(
+                f"Offset {self.offset} is past the acknowledged offset {self.committed}", self.committed
+            )
+
+    async def run(self, records: AsyncIterator[List[Union[PointRow, str]]]):
+        chunk_points = settings.BACKFILL_CHUNK_POINTS
+        skip = self.committed - self.offset
+        position = self.committed
+        check_row = self.schema.check_row if self.schema is not None else None
+        async for batch in records:
+            if skip:
+                dropped = batch[:skip]
+                batch = batch[skip:]
+                skip -= len(dropped)
+            for record in batch:
+                self._records += 1
+                if check_row is not None and not isinstance(record, str):
+                    reason = check_row(record)
+                    if reason is not None:
+                        INGEST_REJECTED_POINTS.inc()
+                        record = reason
+                if isinstance(record, str):
+                    self._rejected += 1
+                    if len(self.errors) < MAX_ERROR_SAMPLES:
+                        self.errors.append(f"record {position}: {record}")
+                else:
+                    self._rows.append(record)
+                position += 1
+                if self._records >= chunk_points:
+                    await self.flush()
+        await self.flush()
+
+    async def flush(self):
+        if not self._records:
+            return
+        rows, duplicates = dedupe_rows(self._rows, self.policy)
+        session = self.session
+        # Chunks of up to BACKFILL_CHUNK_POINTS hold their connection far longer
+        # than a live batch, so they use the background budget and cannot
+        # exhaust the ingest pool live telemetry depends on
+        async with get_db_connection(POOL_BACKGROUND) as conn:
+            async with conn.transaction():
+                stored = await write_rows(conn, session["device_id"], session["tenant_id"], rows, self.policy)
+                committed = await statements.fetchval(
+                    conn, ADVANCE_SESSION, session["id"], self.committed, self._records, stored, self._rejected
+                )
+                if committed is None:
+                    # Rolls back the chunk; another upload moved the session on
+                    raise OffsetConflictError("Session was advanced by another upload", self.committed)
+        if settings.HOT_WINDOW_ENABLED:
+            hot_window.record(str(session["device_id"]), rows, self.policy, start_tracking=False)
+        self.committed = committed
+        self.stored += stored
+        self.rejected += self._rejected
+        self.duplicates += duplicates
+        self._rows = []
+        self._records = 0
+        self._rejected = 0
+
+    async def complete(self) -> Dict[str, Any]:
+        async with get_db_connection(POOL_INGEST) as conn:
+            return dict(await statements.fetchrow(conn, COMPLETE_SESSION, self.session["id"]))
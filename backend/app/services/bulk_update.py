@@ -0,0 +1,372 @@
+"""
+Bulk Device Updates
+Set-based fleet-wide device patches, run in keyset-ordered chunks with job tracking
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Optional, Set, Tuple
+from uuid import UUID
+
+from fastapi import Request
+
+from app.audit import audit_log
+from app.config import settings
+from app.database import get_db_connection, mark_written, POOL_BACKGROUND
+from app.models import DeviceBulkUpdate
+from app.statements import statements
+from app import invalidation
+
+
+logger = logging.getLogger(__name__)
+
+JOB_KIND = "device_update"
+
+# Shared selector predicate ($1..$6). metadata_contains uses jsonb @>, which
+# idx_device_metadata_gin serves; plans are forced custom (see run_chunk) so
+# the "$5 IS NULL OR ..." form does not hide the index behind a generic plan.
+_SELECTOR = """
+    d.tenant_id = $1
+    AND ($2::uuid[] IS NULL OR d.id = ANY($2))
+    AND ($3::uuid IS NULL OR d.channel_id = $3)
+    AND ($4::uuid IS NULL OR d.device_type_id = $4)
+    AND ($5::jsonb IS NULL OR d.metadata @> $5)
+    AND ($6::text IS NULL OR d.status = $6)
+"""
+
+COUNT_SELECTED = statements.register("devices.bulk_count", f"""
+    SELECT COUNT(*) FROM devices d WHERE {_SELECTOR}
+""")
+
+# One chunk: lock the next $8 matching devices after cursor $7 in id order,
+# patch them, and return how many were updated plus the new cursor. Walking
+# by id (not re-evaluating "still matches") means a patch that changes the
+# selected attribute can never make the job loop over the same rows.
+UPDATE_CHUNK = statements.register("devices.bulk_update_chunk", f"""
+    WITH batch AS (
+        SELECT d.id FROM devices d
+        WHERE {_SELECTOR}
+            AND ($7::uuid IS NULL OR d.id > $7)
+        ORDER BY d.id
+        LIMIT $8
+        FOR UPDATE
+    ),
+    updated AS (
+        UPDATE devices d SET
+            status = COALESCE($9, d.status),
+            firmware_version = COALESCE($10, d.firmware_version),
+            metadata = (COALESCE(d.metadata, '{{}}'::jsonb) || COALESCE($11::jsonb, '{{}}'::jsonb))
+                - COALESCE($12::text[], '{{}}'::text[]),
+            configuration = COALESCE(d.configuration, '{{}}'::jsonb) || COALESCE($13::jsonb, '{{}}'::jsonb)
+        FROM batch
+        WHERE d.id = batch.id
+        RETURNING d.id
+    )
+    SELECT
+        (SELECT COUNT(*) FROM updated) AS updated,
+        (SELECT id FROM batch ORDER BY id DESC LIMIT 1) AS last_id
+""")
+
+INSERT_JOB = statements.register("bulk_jobs.insert", """
+    INSERT INTO bulk_jobs (tenant_id, kind, request, total, processed, cursor_id, lease_expires_at)
+    VALUES ($1, $2, $3, $4, $5, $6, NOW() + $7::float8 * INTERVAL '1 second')
+    RETURNING id
+""")
+
+# A NULL lease ($6) on a running job releases it for any worker to resume
+UPDATE_JOB = statements.register("bulk_jobs.progress", """
+    UPDATE bulk_jobs SET
+        status = $2,
+        processed = $3,
+        cursor_id = $4,
+        error = $5,
+        lease_expires_at = CASE WHEN $2 = 'running' THEN NOW() + $6::float8 * INTERVAL '1 second' END,
+        updated_at = NOW(),
+        finished_at = CASE WHEN $2 = 'running' THEN NULL ELSE NOW() END
+    WHERE id = $1
+""")
+
+# Take over running jobs nobody holds (released on shutdown, or lease expired)
+CLAIM_JOBS = statements.register("bulk_jobs.claim", """
+    UPDATE bulk_jobs j SET
+        lease_expires_at = NOW() + $2::float8 * INTERVAL '1 second',
+        updated_at = NOW()
+    FROM (
+        SELECT id FROM bulk_jobs
+        WHERE status = 'running'
+            AND kind = $1
+            AND (lease_expires_at IS NULL OR lease_expires_at < NOW())
+        ORDER BY created_at
+        FOR UPDATE SKIP LOCKED
+    ) claimable
+    WHERE j.id = claimable.id
+    RETURNING j.id, j.request, j.processed, j.cursor_id
+""")
+
+GET_JOB = statements.register("bulk_jobs.get", """
+    SELECT id, status, processed, total, error, created_at, finished_at
+    FROM bulk_jobs
+    WHERE id = $1 AND tenant_id = $2
+""")
+
+
+def _selector_args(request: DeviceBulkUpdate) -> Tuple[Any, ...]:
+    selector = request.selector
+    return (
+        selector.tenant_id,
+        selector.device_ids,
+        selector.channel_id,
+        selector.device_type_id,
+        json.dumps(selector.metadata_contains) if selector.metadata_contains is not None else None,
+        selector.status.value if selector.status else None,
+    )
+
+
+def _patch_args(request: DeviceBulkUpdate) -> Tuple[Any, ...]:
+    patch = request.patch
+    return (
+        patch.status.value if patch.status else None,
+        patch.firmware_version,
+        json.dumps(patch.metadata) if patch.metadata is not None else None,
+        patch.metadata_remove,
+        json.dumps(patch.configuration) if patch.configuration is not None else None,
+    )
+
+
+def _audit_chunk(
+    request: DeviceBulkUpdate,
+    job_id: Optional[UUID],
+    after_id: Optional[UUID],
+    through_id: Optional[UUID],
+    updated: int,
+    origin: Optional[Request] = None,
+    user_id: Optional[Any] = None,
+):
+    """One audit event per committed chunk: the selector, the patch and the id range it covered"""
+    if not updated:
+        return
+    audit_log.record(
+        "update",
+        "device",
+        None,
+        request.selector.tenant_id,
+        after={
+            "bulk_job_id": str(job_id) if job_id else None,
+            "selector": request.selector.model_dump(mode="json", exclude_none=True),
+            "patch": request.patch.model_dump(mode="json", exclude_none=True),
+            "devices": updated,
+            "after_device_id": str(after_id) if after_id else None,
+            "through_device_id": str(through_id) if through_id else None,
+        },
+        request=origin,
+        user_id=user_id,
+    )
+
+
+async def run_chunk(conn, request: DeviceBulkUpdate, cursor: Optional[UUID], chunk_size: int) -> Tuple[int, Optional[UUID]]:
+    """
+    Patch the next chunk of selected devices in its own transaction
+
+    Returns:
+        (devices updated, last device id processed or None when done)
+    """
+    async with conn.transaction():
+        # Plan with the actual parameters so the GIN/PK indexes are used
+        await conn.execute("SET LOCAL plan_cache_mode = force_custom_plan")
+        row = await statements.fetchrow(
+            conn, UPDATE_CHUNK, *_selector_args(request), cursor, chunk_size, *_patch_args(request)
+        )
+    return row["updated"], row["last_id"]
+
+
+async def start_bulk_update(request: DeviceBulkUpdate, origin: Optional[Request] = None) -> Dict[str, Any]:
+    """
+    Apply a bulk update, inline when it fits in one chunk
+
+    The first chunk runs within the request. If it was full, the selection
+    is counted, a bulk_jobs row is created and the remaining chunks run in
+    a background task, one transaction each, so locks stay short on large
+    fleets and progress is visible from any worker. The job is leased to
+    this worker; if it stops, another one resumes the job (see BulkJobRunner).
+
+    Args:
+        request: Selector and patch
+        origin: HTTP request, for the audit trail
+
+    Returns:
+        BulkJobResponse fields (job_id is None when already completed)
+    """
+    chunk_size = settings.BULK_UPDATE_CHUNK_SIZE
+    tenant_id = request.selector.tenant_id
+    async with get_db_connection(POOL_BACKGROUND) as conn:
+        updated, cursor = await run_chunk(conn, request, None, chunk_size)
+        mark_written(tenant_id)
+        if updated < chunk_size:
+            _audit_chunk(request, None, None, cursor, updated, origin=origin)
+            await invalidation.publish("device", None)
+            return {"job_id": None, "status": "completed", "processed": updated, "total": updated}
+
+        async with conn.transaction():
+            await conn.execute("SET LOCAL plan_cache_mode = force_custom_plan")
+            remaining = await statements.fetchval(conn, COUNT_SELECTED, *_selector_args(request))
+        # Rows already patched may no longer match the selector (e.g. status changes)
+        total = max(remaining, updated)
+        job_id = await statements.fetchval(
+            conn,
+            INSERT_JOB,
+            tenant_id,
+            JOB_KIND,
+            request.model_dump_json(),
+            total,
+            updated,
+            cursor,
+            settings.BULK_JOB_LEASE_SECONDS,
+        )
+    _audit_chunk(request, job_id, None, cursor, updated, origin=origin)
+
+    principal = getattr(origin.state, "principal", None) if origin is not None else None
+    runner.spawn(job_id, request, cursor, updated, user_id=principal.user_id if principal is not None else None)
+    return {"job_id": str(job_id), "status": "running", "processed": updated, "total": total}
+
+
+async def _continue_job(
+    job_id: UUID,
+    request: DeviceBulkUpdate,
+    cursor: Optional[UUID],
+    processed: int,
+    user_id: Optional[Any] = None,
+):
+    """
+    Run the chunks after cursor until the selection is exhausted
+
+    cursor and processed only advance once a chunk has committed, so on
+    cancellation (shutdown) they are written back with the lease released
+    and the job carries on from there in another worker.
+    """
+    chunk_size = settings.BULK_UPDATE_CHUNK_SIZE
+    lease = settings.BULK_JOB_LEASE_SECONDS
+    try:
+        async with get_db_connection(POOL_BACKGROUND) as conn:
+            done = False
+            while not done:
+                updated, last_id = await run_chunk(conn, request, cursor, chunk_size)
+                mark_written(request.selector.tenant_id)
+                _audit_chunk(request, job_id, cursor, last_id, updated, user_id=user_id)
+                processed += updated
+                cursor = last_id or cursor
+                done = updated < chunk_size
+                await statements.fetchrow(
+                    conn, UPDATE_JOB, job_id, "completed" if done else "running", processed, cursor, None, lease
+                )
+    except asyncio.CancelledError:
+        logger.info("Bulk update job %s interrupted at %s devices; releasing it", job_id, processed)
+        try:
+            async with get_db_connection(POOL_BACKGROUND) as conn:
+                await statements.fetchrow(conn, UPDATE_JOB, job_id, "running", processed, cursor, None, None)
+        except Exception as e:
+            # The lease expires and the job is resumed from its last recorded cursor
+            logger.warning("Could not release bulk update job %s: %s", job_id, e)
+        raise
+    except Exception as e:
+        logger.exception("Bulk update job %s failed", job_id)
+        async with get_db_connection(POOL_BACKGROUND) as conn:
+            await statements.fetchrow(conn, UPDATE_JOB, job_id, "failed", processed, cursor, str(e), None)
+    finally:
+        await invalidation.publish("device", None)
+
+
+class BulkJobRunner:
+    """
+    Runs this worker's bulk jobs and resumes abandoned ones
+
+    Every BULK_JOB_LEASE_SECONDS (first at startup) running jobs whose lease
+    was released or has expired are claimed and continued from their
+    stored request and cursor_id. stop() cancels the jobs in flight, which
+    record their cursor and release their lease on the way out.
+    """
+
+    def __init__(self):
+        # Held so the tasks are not garbage collected mid-run
+        self._jobs: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.resumed = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="bulk-job-runner")
+
+    async def stop(self):
+        tasks = [t for t in (self._task, *self._jobs) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._jobs.clear()
+
+    def spawn(
+        self,
+        job_id: UUID,
+        request: DeviceBulkUpdate,
+        cursor: Optional[UUID],
+        processed: int,
+        user_id: Optional[Any] = None,
+    ):
+        task = asyncio.create_task(
+            _continue_job(job_id, request, cursor, processed, user_id), name=f"bulk-update:{job_id}"
+        )
+        self._jobs.add(task)
+        task.add_done_callback(self._jobs.discard)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.resume_abandoned()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Could not resume bulk jobs: %s", e)
+            await asyncio.sleep(settings.BULK_JOB_LEASE_SECONDS)
+
+    async def resume_abandoned(self) -> int:
+        """Claim and continue abandoned running jobs; returns how many"""
+        async with get_db_connection(POOL_BACKGROUND) as conn:
+            rows = await statements.fetch(conn, CLAIM_JOBS, JOB_KIND, settings.BULK_JOB_LEASE_SECONDS)
+        for row in rows:
+            try:
+                request = DeviceBulkUpdate.model_validate_json(row["request"])
+            except ValueError as e:
+                logger.error("Bulk update job %s has an unreadable request: %s", row["id"], e)
+                async with get_db_connection(POOL_BACKGROUND) as conn:
+                    await statements.fetchrow(
+                        conn, UPDATE_JOB, row["id"], "failed", row["processed"], row["cursor_id"], str(e), None
+                    )
+                continue
+            logger.info("Resuming bulk update job %s after %s devices", row["id"], row["processed"])
+            self.spawn(row["id"], request, row["cursor_id"], row["processed"])
+            self.resumed += 1
+        return len(rows)
+
+    def get_status(self) -> Dict[str, Any]:
+        return {"running": len(self._jobs), "resumed": self.resumed}
+
+
+# Process-wide runner
+runner = BulkJobRunner()
+
+
+async def get_job(job_id: UUID, tenant_id: UUID) -> Optional[Dict[str, Any]]:
+    """Progress of a bulk job, or None if it does not exist for the tenant"""
+    async with get_db_connection() as conn:
+        row = await statements.fetchrow(conn, GET_JOB, job_id, tenant_id)
+    if row is None:
+        return None
+    return {
+        "job_id": str(row["id"]),
+        "status": row["status"],
+        "processed": row["processed"],
+        "total": row["total"],
+        "error": row["error"],
+        "created_at": row["created_at"],
+        "finished_at": row["finished_at"],
+    }
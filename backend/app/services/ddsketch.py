@@ -0,0 +1,119 @@
+"""
+DDSketch
+Mergeable quantile sketch with a relative error bound, matching the rollup sketches in Postgres
+"""
+
+import math
+import struct
+from typing import Dict, Iterable, Optional
+
+# Must agree with ddsketch_key()/ddsketch_entry() in migration
+# 20241213000017_rollup_percentile_sketches.sql
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+MIN_INDEXABLE = 1e-9
+KEY_BIAS = 2048
+FORMAT_VERSION = 1
+
+_ENTRY = struct.Struct(">ii")
+
+
+def sketch_key(value: float) -> Optional[int]:
+    """Bin key of a value, as ddsketch_key() computes it (None for NaN and infinities)"""
+    if not math.isfinite(value):
+        return None
+    magnitude = abs(value)
+    if magnitude < MIN_INDEXABLE:
+        return 0
+    key = math.ceil(math.log(magnitude) / LOG_GAMMA) + KEY_BIAS
+    return key if value > 0 else -key
+
+
+def key_value(key: int) -> float:
+    """
+    Representative value of a bin
+
+    Bin i holds (gamma^(i-1), gamma^i]; its midpoint in relative terms,
+    2 * gamma^i / (gamma + 1), is within RELATIVE_ACCURACY of every value
+    in it.
+    """
+    if key == 0:
+        return 0.0
+    value = 2 * GAMMA ** (abs(key) - KEY_BIAS) / (GAMMA + 1)
+    return value if key > 0 else -value
+
+
+class DDSketch:
+    """
+    Counts per logarithmic bin
+
+    Keys order like the values they stand for (negative keys hold negative
+    values, the most negative first), so a quantile is a walk over the
+    sorted keys. Merging adds counts, which makes the result exactly the
+    sketch of the combined data, whatever the order of merges.
+    """
+
+    __slots__ = ("bins", "count")
+
+    def __init__(self):
+        self.bins: Dict[int, int] = {}
+        self.count = 0
+
+    def add(self, value: float, count: int = 1):
+        key = sketch_key(value)
+        if key is None:
+            return
+        self.bins[key] = self.bins.get(key, 0) + count
+        self.count += count
+
+    def merge(self, other: "DDSketch"):
+        bins = self.bins
+        for key, count in other.bins.items():
+            bins[key] = bins.get(key, 0) + count
+        self.count += other.count
+
+    def merge_bytes(self, data: Optional[bytes]):
+        """
+        Add an encoded sketch (a rollup's value_sketch); None is skipped
+
+        Raises:
+            ValueError: Unknown format version or truncated data
+        """
+        if not data:
+            return
+        if data[0] != FORMAT_VERSION or (len(data) - 1) % _ENTRY.size:
+            raise ValueError(f"Not a version {FORMAT_VERSION} sketch ({len(data)} bytes)")
+        bins = self.bins
+        total = 0
+        for key, count in _ENTRY.iter_unpack(memoryview(data)[1:]):
+            bins[key] = bins.get(key, 0) + count
+            total += count
+        self.count += total
+
+    def to_bytes(self) -> bytes:
+        return bytes([FORMAT_VERSION]) + b"".join(_ENTRY.pack(key, self.bins[key]) for key in sorted(self.bins))
+
+    def quantiles(self, fractions: Iterable[float]) -> Dict[float, Optional[float]]:
+        """
+        Estimates of several quantiles in one pass over the bins
+
+        Each estimate is within RELATIVE_ACCURACY of the exact quantile
+        (the value at rank fraction * (count - 1)), or None if the sketch
+        is empty.
+        """
+        wanted = sorted(set(fractions))
+        results: Dict[float, Optional[float]] = {fraction: None for fraction in wanted}
+        if not self.count or not wanted:
+            return results
+        pending = iter(wanted)
+        fraction = next(pending)
+        seen = 0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            while seen > fraction * (self.count - 1):
+                results[fraction] = key_value(key)
+                fraction = next(pending, None)
+                if fraction is None:
+                    return results
+        return results
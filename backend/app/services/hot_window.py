@@ -0,0 +1,369 @@
+"""
+Hot Window
+Per-series ring buffers of recently ingested points serving short-range reads from memory
+"""
+
+import heapq
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.config import settings
+from app.metrics import registry
+from app.services.ingest import ON_CONFLICT_UPDATE, PointRow, as_utc
+
+
+# Postgres stores microseconds; a bound just above a dropped point's time
+# covers every later point
+_RESOLUTION = 1e-6
+
+# Interpreter overhead of a Series and its LRU entry beyond the arrays
+_SERIES_OVERHEAD = 400
+
+_FROM_EPOCH = datetime.fromtimestamp
+
+
+class Series:
+    """
+    Fixed-capacity ring of one (device, metric) series, oldest first
+
+    Times (epoch seconds), values and quality scores live in parallel
+    arrays that grow to `capacity` and then wrap, overwriting the oldest
+    point. `floor` is the time from which the ring holds every point of
+    the series this worker ingested; it rises as points are overwritten.
+    """
+
+    __slots__ = ("times", "values", "quality", "unit", "start", "floor", "capacity")
+
+    def __init__(self, capacity: int, unit: Optional[str]):
+        self.times = array("d")
+        self.values = array("d")
+        self.quality = array("B")
+        self.unit = unit
+        self.start = 0
+        self.floor = 0.0
+        self.capacity = capacity
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            sys.getsizeof(self.times) + sys.getsizeof(self.values) + sys.getsizeof(self.quality)
+            + _SERIES_OVERHEAD
+        )
+
+    @property
+    def newest(self) -> float:
+        times = self.times
+        return times[self.start - 1] if times else 0.0
+
+    def _drop_all(self):
+        """Forget every point (the floor moves past them)"""
+        if self.times:
+            self.floor = max(self.floor, self.newest + _RESOLUTION)
+        self.times = array("d")
+        self.values = array("d")
+        self.quality = array("B")
+        self.start = 0
+
+    def add(self, t: float, value: float, unit: Optional[str], quality: int, update: bool):
+        """
+        Insert one point, keeping time order
+
+        An equal time keeps the buffered point unless update is set, as
+        the database does under each conflict policy.
+        """
+        if unit != self.unit:
+            # Units are kept per series; a change starts the series over
+            self._drop_all()
+            self.unit = unit
+        if t < self.floor:
+            return
+        times = self.times
+        size = len(times)
+        if not size or t > times[self.start - 1]:
+            if size < self.capacity:
+                times.append(t)
+                self.values.append(value)
+                self.quality.append(quality)
+                return
+            start = self.start
+            self.floor = max(self.floor, times[start] + _RESOLUTION)
+            times[start] = t
+            self.values[start] = value
+            self.quality[start] = quality
+            self.start = (start + 1) % size
+            return
+        self._insert(t, value, quality, update)
+
+    def _insert(self, t: float, value: float, quality: int, update: bool):
+        # Late point: rare, so linearise the ring and insert in place
+        start = self.start
+        if start:
+            self.times = self.times[start:] + self.times[:start]
+            self.values = self.values[start:] + self.values[:start]
+            self.quality = self.quality[start:] + self.quality[:start]
+            self.start = 0
+        times = self.times
+        i = bisect_left(times, t)
+        if i < len(times) and times[i] == t:
+            if update:
+                self.values[i] = value
+                self.quality[i] = quality
+            return
+        times.insert(i, t)
+        self.values.insert(i, value)
+        self.quality.insert(i, quality)
+        if len(times) > self.capacity:
+            self.floor = max(self.floor, times[0] + _RESOLUTION)
+            del times[0], self.values[0], self.quality[0]
+
+    def _position(self, t: float) -> int:
+        """Logical index of the first point at or after t"""
+        times = self.times
+        size = len(times)
+        start = self.start
+        if not start:
+            return bisect_left(times, t)
+        if t > times[size - 1]:
+            return size - start + bisect_left(times, t, 0, start)
+        return bisect_left(times, t, start, size) - start
+
+    def count(self, start: float, end: Optional[float]) -> int:
+        """Points within [start, end]"""
+        high = self._position(end + _RESOLUTION) if end is not None else len(self.times)
+        return max(0, high - self._position(start))
+
+    def newest_first(self, start: float, end: Optional[float]) -> Iterator[Tuple[float, float, int]]:
+        """(time, value, quality) from newest to oldest within [start, end]"""
+        times, values, quality = self.times, self.values, self.quality
+        size = len(times)
+        low = self._position(start)
+        high = self._position(end + _RESOLUTION) if end is not None else size
+        offset = self.start
+        for i in range(high - 1, low - 1, -1):
+            p = (i + offset) % size
+            yield times[p], values[p], quality[p]
+
+
+def _labelled(
+    name: str, series: Series, start: float, end: Optional[float]
+) -> Iterator[Tuple[float, float, int, str, Optional[str]]]:
+    unit = series.unit
+    for t, value, quality in series.newest_first(start, end):
+        yield t, value, quality, name, unit
+
+
+class HotWindow:
+    """
+    Recent points per (device, metric), bounded by HOT_WINDOW_MAX_BYTES
+
+    Filled from ingest after each write commits. A device is tracked from
+    its first point seen by this process (`since`), so a query is answered
+    only when the rings provably hold every matching point: its start is
+    at or after the floor of each series involved (or, without a start,
+    enough covered points exist to fill the limit). Everything else falls
+    through to the database. The least recently used series are evicted
+    to stay under the memory cap; eviction raises the device's `since`.
+
+    Each worker only sees the points it ingested itself, which is why
+    HOT_WINDOW_ENABLED is off by default (see config).
+    """
+
+    def __init__(self, max_bytes: int, series_points: int):
+        self.max_bytes = max_bytes
+        self.series_points = series_points
+        # (device id, metric) -> Series, least recently used first
+        self._series: "OrderedDict[Tuple[str, str], Series]" = OrderedDict()
+        # device id -> {"since": epoch seconds, "metrics": {metric: Series}}
+        self._devices: Dict[str, Dict[str, Any]] = {}
+        self._bytes: Dict[Tuple[str, str], int] = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._series)
+
+    def record(self, device_id: str, rows: List[PointRow], policy: str, start_tracking: bool = True):
+        """
+        Add rows just written for a device (see ingest.write_rows)
+
+        Args:
+            device_id: Device the rows were written for
+            rows: Rows as written
+            policy: Conflict policy the write used
+            start_tracking: Begin tracking an untracked device from these
+                rows; False for backfilled history, which says nothing
+                about what else is stored around it
+        """
+        if not rows:
+            return
+        device = self._devices.get(device_id)
+        if device is None:
+            if not start_tracking:
+                return
+            # Points stored before this process saw the device are unknown;
+            # devices send batches in time order, so nothing stored earlier
+            # is newer than the oldest point of the first batch seen
+            since = min([time.time()] + [row[0].timestamp() for row in rows])
+            device = self._devices[device_id] = {"since": since, "metrics": {}}
+        metrics = device["metrics"]
+        since = device["since"]
+        update = policy == ON_CONFLICT_UPDATE
+        touched = set()
+        for t, metric_name, value, unit, _, quality in rows:
+            series = metrics.get(metric_name)
+            if series is None:
+                series = metrics[metric_name] = Series(self.series_points, unit)
+                series.floor = since
+            series.add(t.timestamp(), value, unit, quality, update)
+            touched.add(metric_name)
+        for metric_name in touched:
+            key = (device_id, metric_name)
+            series = metrics[metric_name]
+            nbytes = series.nbytes
+            self.total_bytes += nbytes - self._bytes.get(key, 0)
+            self._bytes[key] = nbytes
+            self._series[key] = series
+            self._series.move_to_end(key)
+        while self.total_bytes > self.max_bytes and self._series:
+            self._evict()
+
+    def _evict(self):
+        (device_id, metric_name), series = self._series.popitem(last=False)
+        self.total_bytes -= self._bytes.pop((device_id, metric_name))
+        self.evictions += 1
+        device = self._devices[device_id]
+        del device["metrics"][metric_name]
+        if not device["metrics"]:
+            del self._devices[device_id]
+        elif len(series):
+            # Device-wide reads can no longer see this metric's points
+            device["since"] = max(device["since"], series.newest + _RESOLUTION)
+
+    def discard(self, device_id: str):
+        """Drop a device's series (the device was deleted)"""
+        device = self._devices.pop(device_id, None)
+        if device is None:
+            return
+        for metric_name in device["metrics"]:
+            self._series.pop((device_id, metric_name), None)
+            self.total_bytes -= self._bytes.pop((device_id, metric_name), 0)
+
+    def query(
+        self,
+        device_id: str,
+        metric_name: Optional[str],
+        start_time: Optional[datetime],
+        end_time: Optional[datetime],
+        limit: int,
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Newest-first points like GET /devices/{id}/data, or None if the
+        window cannot answer completely
+        """
+        device = self._devices.get(device_id)
+        if device is None:
+            self.misses += 1
+            return None
+        if metric_name is not None:
+            series = device["metrics"].get(metric_name)
+            selected = [(metric_name, series)] if series is not None else []
+        else:
+            selected = list(device["metrics"].items())
+        floor = max([device["since"]] + [series.floor for _, series in selected])
+
+        end = as_utc(end_time).timestamp() if end_time is not None else None
+        if start_time is not None:
+            start = as_utc(start_time).timestamp()
+            if start < floor:
+                self.misses += 1
+                return None
+        else:
+            # Unbounded start: complete only if the covered points fill the limit
+            start = floor
+            if sum(series.count(floor, end) for _, series in selected) < limit:
+                self.misses += 1
+                return None
+
+        for name, _ in selected:
+            self._series.move_to_end((device_id, name))
+        self.hits += 1
+        streams = [_labelled(name, series, start, end) for name, series in selected]
+        merged = heapq.merge(*streams, key=lambda point: point[0], reverse=True)
+        return [
+            {
+                "device_id": device_id,
+                "metric_name": name,
+                "value": value,
+                "unit": unit,
+                "time": _FROM_EPOCH(t, timezone.utc),
+                "quality_score": quality,
+            }
+            for (t, value, quality, name, unit), _ in zip(merged, range(limit))
+        ]
+
+    def get_stats(self, top: int = 0) -> Dict[str, Any]:
+        """
+        Totals, plus the `top` largest series with their memory use
+
+        Returns:
+            Dict of series/device counts, bytes, hits, misses, evictions
+            and a "largest" list of {device_id, metric_name, points, bytes}
+        """
+        lookups = self.hits + self.misses
+        stats = {
+            "enabled": settings.HOT_WINDOW_ENABLED,
+            "series": len(self._series),
+            "devices": len(self._devices),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "series_points": self.series_points,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+        }
+        if top:
+            largest = heapq.nlargest(top, self._bytes.items(), key=lambda item: item[1])
+            stats["largest"] = [
+                {
+                    "device_id": device_id,
+                    "metric_name": metric_name,
+                    "points": len(self._series[(device_id, metric_name)]),
+                    "bytes": nbytes,
+                }
+                for (device_id, metric_name), nbytes in largest
+            ]
+        return stats
+
+
+# Process-wide hot window (per API worker)
+hot_window = HotWindow(settings.HOT_WINDOW_MAX_BYTES, settings.HOT_WINDOW_SERIES_POINTS)
+
+
+@registry.register_collector
+def _collect_hot_window_metrics():
+    yield (
+        "iotlinker_hot_window_bytes", "gauge", "Estimated memory held by hot-window ring buffers",
+        [("", {}, hot_window.total_bytes)],
+    )
+    yield (
+        "iotlinker_hot_window_series", "gauge", "Series held in the hot window",
+        [("", {}, len(hot_window))],
+    )
+    yield (
+        "iotlinker_hot_window_queries", "counter", "Device data reads by hot-window result",
+        [
+            ("_total", {"result": "hit"}, hot_window.hits),
+            ("_total", {"result": "miss"}, hot_window.misses),
+        ],
+    )
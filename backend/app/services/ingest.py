@@ -0,0 +1,182 @@
+"""
+Idempotent Ingestion
+In-batch deduplication and a single ON CONFLICT bulk write for device data points
+"""
+
+import json
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
+import asyncpg
+
+from app.config import settings
+from app.models import DeviceDataPoint
+from app.statements import statements
+
+
+# Conflict policies on (device_id, time, metric_name): keep the stored point
+# or overwrite it with the new one (last write wins)
+ON_CONFLICT_IGNORE = "ignore"
+ON_CONFLICT_UPDATE = "update"
+ON_CONFLICT_POLICIES = (ON_CONFLICT_IGNORE, ON_CONFLICT_UPDATE)
+
+# One statement per batch: the points arrive as parallel arrays, so the
+# insert is a single round trip whatever the batch size. "ignore" needs no
+# conflict target, so it works on the original layout and on the
+# tenant-partitioned one (migration 20241213000012), whose primary key also
+# holds tenant_id.
+_POINTS = """
+        SELECT p.time, $1::uuid AS device_id, $2::uuid AS tenant_id, p.metric_name, p.value, p.unit,
+            p.metadata::jsonb AS metadata, p.quality_score
+        FROM unnest($3::timestamptz[], $4::text[], $5::float8[], $6::text[], $7::text[], $8::int[])
+            AS p(time, metric_name, value, unit, metadata, quality_score)
+"""
+
+_COLUMNS = "time, device_id, tenant_id, metric_name, value, unit, metadata, quality_score"
+
+# "update" has no conflict target that fits both layouts either, so it
+# overwrites the stored points first and inserts the rest. dedupe_rows()
+# leaves at most one row per (metric_name, time), so no point is updated
+# twice. $9/$10 are the batch's first and last time, which limit the update
+# to the chunks the batch falls in.
+INSERT_POINTS = {
+    ON_CONFLICT_IGNORE: statements.register("device_data.insert_ignore", f"""
+    WITH stored AS (
+        INSERT INTO device_data ({_COLUMNS})
+        {_POINTS}
+        ON CONFLICT DO NOTHING
+        RETURNING 1
+    )
+    SELECT COUNT(*) FROM stored
+"""),
+    ON_CONFLICT_UPDATE: statements.register("device_data.insert_update", f"""
+    WITH points AS ({_POINTS}),
+    updated AS (
+        UPDATE device_data d SET
+            value = p.value,
+            unit = p.unit,
+            metadata = p.metadata,
+            quality_score = p.quality_score
+        FROM points p
+        WHERE d.tenant_id = $2
+            AND d.device_id = $1
+            AND d.time >= $9
+            AND d.time <= $10
+            AND d.time = p.time
+            AND d.metric_name = p.metric_name
+        RETURNING d.time, d.metric_name
+    ),
+    inserted AS (
+        INSERT INTO device_data ({_COLUMNS})
+        SELECT {_COLUMNS} FROM points p
+        WHERE NOT EXISTS (
+            SELECT 1 FROM updated u WHERE u.time = p.time AND u.metric_name = p.metric_name
+        )
+        ON CONFLICT DO NOTHING
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM updated) + (SELECT COUNT(*) FROM inserted)
+"""),
+}
+
+TOUCH_LAST_SEEN = statements.register("devices.touch_last_seen", """
+    UPDATE devices SET last_seen = GREATEST(last_seen, $2) WHERE id = $1
+""")
+
+
+# One data point as written: (time, metric_name, value, unit, metadata JSON, quality_score)
+PointRow = Tuple[datetime, str, float, Optional[str], str, int]
+
+
+def conflict_policy(channel_metadata: Optional[Dict[str, Any]]) -> str:
+    """A channel's ingest_on_conflict setting, or INGEST_ON_CONFLICT if unset or unknown"""
+    policy = (channel_metadata or {}).get("ingest_on_conflict")
+    return policy if policy in ON_CONFLICT_POLICIES else settings.INGEST_ON_CONFLICT
+
+
+def as_utc(value: datetime) -> datetime:
+    """Naive timestamps are UTC; made aware so equal instants compare equal"""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def point_row(point: DeviceDataPoint, default_time: datetime) -> PointRow:
+    return (
+        as_utc(point.timestamp) if point.timestamp else default_time,
+        point.metric_name,
+        point.value,
+        point.unit,
+        json.dumps(point.metadata or {}),
+        point.quality_score if point.quality_score is not None else 100,
+    )
+
+
+def row_payload(row: PointRow) -> Dict[str, Any]:
+    """A stored row as JSON, in the shape of the DeviceDataPoint it came from"""
+    time, metric_name, value, unit, metadata, quality_score = row
+    return {
+        "metric_name": metric_name,
+        "value": value,
+        "unit": unit,
+        "metadata": json.loads(metadata),
+        "quality_score": quality_score,
+        "timestamp": time.isoformat(),
+    }
+
+
+def dedupe_rows(rows: List[PointRow], policy: str) -> Tuple[List[PointRow], int]:
+    """
+    Collapse rows that share (metric_name, time)
+
+    The first row wins under "ignore" and the last under "update",
+    matching what the database would keep across batches. Postgres also
+    rejects an ON CONFLICT DO UPDATE that touches one row twice, so the
+    update statement depends on this.
+
+    Returns:
+        (unique rows in arrival order, duplicates dropped)
+    """
+    unique: Dict[Tuple[str, datetime], PointRow] = {}
+    if policy == ON_CONFLICT_UPDATE:
+        for row in rows:
+            unique[(row[1], row[0])] = row
+    else:
+        for row in rows:
+            unique.setdefault((row[1], row[0]), row)
+    return list(unique.values()), len(rows) - len(unique)
+
+
+def dedupe_points(
+    points: List[DeviceDataPoint],
+    default_time: datetime,
+    policy: str,
+) -> Tuple[List[PointRow], int]:
+    """Rows for a batch of points (default_time where a point has none), deduplicated"""
+    default_time = as_utc(default_time)
+    return dedupe_rows([point_row(point, default_time) for point in points], policy)
+
+
+async def write_rows(
+    conn: asyncpg.Connection,
+    device_id: UUID,
+    tenant_id: UUID,
+    rows: List[PointRow],
+    policy: str,
+) -> int:
+    """
+    Store deduplicated rows and bump the device's last_seen in one transaction
+
+    Returns:
+        Rows inserted (or overwritten, under "update"); the rest already existed
+    """
+    if not rows:
+        return 0
+    times, metric_names, values, units, metadata, quality_scores = zip(*rows)
+    args = [device_id, tenant_id, times, metric_names, values, units, metadata, quality_scores]
+    last = max(times)
+    if policy == ON_CONFLICT_UPDATE:
+        args += [min(times), last]
+    async with conn.transaction():
+        stored = await statements.fetchval(conn, INSERT_POINTS[policy], *args)
+        await statements.fetchval(conn, TOUCH_LAST_SEEN, device_id, last)
+    return stored
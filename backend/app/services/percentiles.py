@@ -0,0 +1,241 @@
+"""
+Rollup Percentiles
+Percentiles over any time range, merged from the rollups' DDSketches instead of scanning raw data
+"""
+
+import math
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import asyncpg
+
+from app.services.ddsketch import DDSketch, RELATIVE_ACCURACY
+from app.services.ingest import as_utc
+from app.statements import statements
+
+
+DEFAULT_PERCENTILES = "50,95,99"
+MAX_PERCENTILES = 20
+DEFAULT_RANGE = timedelta(hours=24)
+
+# Sketches covering [$4, $5) for the devices $2 and metric $3 of tenant $1,
+# each source exactly once:
+#   - device_data_daily for whole days in [$8, day_end)
+#   - device_data_hourly for the other whole hours in [$6, rollup_end)
+#   - device_data_1h (the durable tier) for hours older than the views
+#   - device_data for the partial hours at either end and everything from
+#     the views' last (possibly partial) bucket on, which they have not
+#     seen since their last refresh; binned into one sketch by Postgres
+# $6/$7 are $4 rounded up and $5 rounded down to the hour, $8 is $6 rounded
+# up to the day. Every row carries the exact min and max and the sample
+# count of what it covers. Tier buckets downsampled before sketches existed
+# (and whose raw rows are gone) have a NULL sketch.
+_SKETCHES = """
+    WITH {bounds},
+    days AS (
+        SELECT
+            CASE WHEN view_start = 'infinity' THEN 'infinity'::timestamptz
+                ELSE GREATEST($8::timestamptz, time_bucket('1 day', view_start - INTERVAL '1 microsecond') + INTERVAL '1 day')
+            END AS day_start,
+            time_bucket('1 day', rollup_end) AS day_end
+        FROM bounds
+    )
+    {rollups}
+    SELECT t.value_sketch AS sketch, t.min_value, t.max_value, t.sample_count
+    FROM device_data_1h t, bounds
+    WHERE t.tenant_id = $1
+        AND t.device_id = ANY($2::uuid[])
+        AND t.metric_name = $3
+        AND t.bucket >= $6
+        AND t.bucket < LEAST($7::timestamptz, bounds.view_start)
+    UNION ALL
+    SELECT
+        '\\x01'::bytea || string_agg(ddsketch_entry(sketch_key, sample_count), ''::bytea ORDER BY sketch_key),
+        MIN(min_value),
+        MAX(max_value),
+        SUM(sample_count)
+    FROM (
+        SELECT ddsketch_key(d.value) AS sketch_key, COUNT(*) AS sample_count, MIN(d.value) AS min_value, MAX(d.value) AS max_value
+        FROM device_data d, bounds
+        WHERE d.tenant_id = $1
+            AND d.device_id = ANY($2::uuid[])
+            AND d.metric_name = $3
+            AND d.time >= $4
+            AND d.time < $5
+            AND (d.time < $6 OR d.time >= bounds.rollup_end)
+            AND ddsketch_key(d.value) IS NOT NULL
+        GROUP BY 1
+    ) raw
+"""
+
+RANGE_SKETCHES = statements.register("percentiles.sketches", _SKETCHES.format(
+    bounds="""bounds AS (
+        SELECT
+            COALESCE(MIN(bucket), 'infinity') AS view_start,
+            LEAST($7::timestamptz, GREATEST($6::timestamptz, COALESCE(MAX(bucket), $6::timestamptz))) AS rollup_end
+        FROM device_data_hourly
+    )""",
+    rollups="""SELECT value_sketch AS sketch, min_value, max_value, sample_count
+    FROM device_data_daily, days
+    WHERE tenant_id = $1
+        AND device_id = ANY($2::uuid[])
+        AND metric_name = $3
+        AND bucket >= days.day_start
+        AND bucket < days.day_end
+    UNION ALL
+    SELECT h.value_sketch, h.min_value, h.max_value, h.sample_count
+    FROM device_data_hourly h, bounds, days
+    WHERE h.tenant_id = $1
+        AND h.device_id = ANY($2::uuid[])
+        AND h.metric_name = $3
+        AND h.bucket >= $6
+        AND h.bucket < bounds.rollup_end
+        AND (h.bucket < days.day_start OR h.bucket >= days.day_end)
+    UNION ALL""",
+))
+
+# Same without the views, for while they have not been populated yet (they
+# are recreated WITH NO DATA by migrations): raw data plus the tier
+RANGE_SKETCHES_RAW = statements.register("percentiles.sketches_raw", _SKETCHES.format(
+    bounds="""bounds AS (
+        SELECT 'infinity'::timestamptz AS view_start, $6::timestamptz AS rollup_end
+    )""",
+    rollups="",
+))
+
+
+def parse_percentiles(text: str) -> List[float]:
+    """
+    Percentiles from a comma separated list such as "50,95,99.9"
+
+    Raises:
+        ValueError: Not a number, outside 0-100, or too many
+    """
+    values = []
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            value = float(part)
+        except ValueError:
+            raise ValueError(f"Percentile {part} is not a number")
+        if not 0 <= value <= 100:
+            raise ValueError(f"Percentile {part} is outside 0-100")
+        values.append(value)
+    if not values:
+        raise ValueError("No percentiles requested")
+    if len(values) > MAX_PERCENTILES:
+        raise ValueError(f"At most {MAX_PERCENTILES} percentiles per request")
+    return values
+
+
+def resolve_query(
+    start: Optional[datetime],
+    end: Optional[datetime],
+    percentiles: str,
+) -> Tuple[datetime, datetime, List[float]]:
+    """
+    Range and percentiles of a percentile request (end defaults to now,
+    start to DEFAULT_RANGE before end)
+
+    Raises:
+        ValueError: Empty or inverted range, or bad percentiles
+    """
+    end = as_utc(end) if end else datetime.now(timezone.utc)
+    start = as_utc(start) if start else end - DEFAULT_RANGE
+    if start >= end:
+        raise ValueError("start_time must be before end_time")
+    return start, end, parse_percentiles(percentiles)
+
+
+def _ceil(value: datetime, step: timedelta) -> datetime:
+    floored = _floor(value, step)
+    return floored if floored == value else floored + step
+
+
+def _floor(value: datetime, step: timedelta) -> datetime:
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    return epoch + (value - epoch) // step * step
+
+
+def range_bounds(start: datetime, end: datetime) -> Tuple[datetime, datetime, datetime]:
+    """Whole hours inside [start, end) and the first day boundary among them ($6, $7, $8)"""
+    hour_start = _ceil(start, timedelta(hours=1))
+    hour_end = _floor(end, timedelta(hours=1))
+    if hour_end < hour_start:
+        # Within a single hour: all of it comes from device_data
+        hour_start = hour_end = start
+    return hour_start, hour_end, _ceil(hour_start, timedelta(days=1))
+
+
+async def range_percentiles(
+    conn: asyncpg.Connection,
+    tenant_id: Any,
+    device_ids: Sequence[Any],
+    metric_name: str,
+    start: datetime,
+    end: datetime,
+    percentiles: Sequence[float],
+) -> Dict[str, Any]:
+    """
+    Merge the sketches covering a range and read percentiles from them
+
+    Each percentile is within RELATIVE_ACCURACY (relative) of the exact
+    value and clamped to the exact min and max of the range (which are
+    what p0 and p100 return). Samples in tier buckets without a sketch
+    count towards min and max but not the percentiles; unsketched_count
+    reports them.
+
+    Args:
+        conn: Connection (a replica is fine)
+        tenant_id: Tenant of the devices
+        device_ids: Devices whose values are pooled
+        metric_name: Metric
+        start: Range start (inclusive)
+        end: Range end (exclusive)
+        percentiles: Percentiles to estimate, 0-100
+
+    Returns:
+        sample_count (of the percentiles), unsketched_count, min_value,
+        max_value and percentiles ("p95" -> value, None when the range has
+        no sketched data)
+    """
+    start, end = as_utc(start), as_utc(end)
+    args = (str(tenant_id), [str(device_id) for device_id in device_ids], metric_name, start, end, *range_bounds(start, end))
+    try:
+        rows = await statements.fetch(conn, RANGE_SKETCHES, *args)
+    except asyncpg.ObjectNotInPrerequisiteStateError:
+        # Rollup views not populated yet
+        rows = await statements.fetch(conn, RANGE_SKETCHES_RAW, *args)
+
+    sketch = DDSketch()
+    unsketched = 0
+    low: Optional[float] = None
+    high: Optional[float] = None
+    for row in rows:
+        if row["sketch"] is not None:
+            sketch.merge_bytes(row["sketch"])
+        elif row["sample_count"]:
+            unsketched += row["sample_count"]
+        # NaN and infinities are left out of sketches, so also of the bounds
+        if row["min_value"] is not None and math.isfinite(row["min_value"]):
+            low = row["min_value"] if low is None else min(low, row["min_value"])
+        if row["max_value"] is not None and math.isfinite(row["max_value"]):
+            high = row["max_value"] if high is None else max(high, row["max_value"])
+
+    estimates = sketch.quantiles(p / 100 for p in percentiles)
+    results: Dict[str, Optional[float]] = {}
+    for p in percentiles:
+        estimate = estimates[p / 100]
+        if estimate is not None and low is not None and high is not None:
+            estimate = low if p == 0 else high if p == 100 else min(max(estimate, low), high)
+        results[f"p{p:g}"] = estimate
+    return {
+        "sample_count": sketch.count,
+        "unsketched_count": unsketched,
+        "min_value": low,
+        "max_value": high,
+        "percentiles": results,
+        "relative_accuracy": RELATIVE_ACCURACY,
+    }
@@ -0,0 +1,259 @@
+"""
+Bulk Device Provisioning
+Parses, validates and inserts device batches in one COPY, issuing credentials in Python
+"""
+
+import codecs
+import csv
+import json
+import logging
+import secrets
+import uuid
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import asyncpg
+from pydantic import ValidationError
+
+from app.models import BulkDeviceItem
+
+
+logger = logging.getLogger(__name__)
+
+# Columns written by COPY. device_key/device_secret use the same format as the
+# generate_device_key() trigger, which leaves pre-filled values untouched.
+COPY_COLUMNS = [
+    "id", "tenant_id", "channel_id", "device_type_id", "name", "description",
+    "device_key", "device_secret", "location", "metadata", "configuration",
+    "firmware_version", "status",
+]
+
+# Names in the batch that already exist for the tenant (unique_tenant_device_name)
+EXISTING_NAMES_QUERY = """
+    SELECT name FROM devices WHERE tenant_id = $1 AND name = ANY($2::text[])
+"""
+
+KNOWN_DEVICE_TYPES_QUERY = """
+    SELECT id FROM device_types WHERE id = ANY($1::uuid[])
+"""
+
+# CSV columns; metadata and configuration hold JSON objects, location is flattened
+CSV_COLUMNS = [
+    "name", "description", "device_type_id", "firmware_version",
+    "metadata", "configuration", "latitude", "longitude", "address",
+]
+
+# Retries when a concurrent insert takes a name between the check and the COPY
+MAX_COPY_ATTEMPTS = 3
+
+
+class BatchTooLargeError(ValueError):
+    """The input has more rows than BULK_PROVISION_MAX_DEVICES"""
+
+
+@dataclass
+class ProvisionResult:
+    """Outcome for one input row (1-based row number)"""
+    row: int
+    name: Optional[str] = None
+    device_id: Optional[str] = None
+    device_key: Optional[str] = None
+    device_secret: Optional[str] = None
+    error: Optional[str] = None
+
+
+# =====================================================
+# INPUT PARSING
+# =====================================================
+
+async def _iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decode a byte stream into lines (newline kept) without buffering the body"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def _csv_row(record: Dict[str, str]) -> Dict[str, Any]:
+    row: Dict[str, Any] = {
+        key: (record.get(key) or None)
+        for key in ("name", "description", "device_type_id", "firmware_version")
+    }
+    for key in ("metadata", "configuration"):
+        if record.get(key):
+            row[key] = json.loads(record[key])
+    if any(record.get(key) for key in ("latitude", "longitude", "address")):
+        row["location"] = {
+            "latitude": record.get("latitude") or None,
+            "longitude": record.get("longitude") or None,
+            "address": record.get("address") or None,
+        }
+    return row
+
+
+async def parse_rows(
+    chunks: AsyncIterator[bytes],
+    content_type: str,
+    max_rows: int,
+) -> List[Tuple[int, Any]]:
+    """
+    Parse a JSON array, NDJSON or CSV body into (row number, raw value) pairs
+
+    NDJSON and CSV are read line by line from the request stream. A row that
+    cannot be decoded is kept as its exception so it is reported per row
+    rather than failing the whole batch.
+
+    Raises:
+        BatchTooLargeError: More than max_rows rows
+        ValueError: A JSON body that is not a list (or {"devices": [...]})
+    """
+    rows: List[Tuple[int, Any]] = []
+
+    def add(value: Any):
+        if len(rows) >= max_rows:
+            raise BatchTooLargeError(f"At most {max_rows} devices per request")
+        rows.append((len(rows) + 1, value))
+
+    if "csv" in content_type:
+        lines = [line async for line in _iter_lines(chunks)]
+        for record in csv.DictReader(lines):
+            try:
+                add(_csv_row(record))
+            except ValueError as e:
+                add(e)
+    elif "ndjson" in content_type or "jsonl" in content_type:
+        async for line in _iter_lines(chunks):
+            if line.strip():
+                try:
+                    add(json.loads(line))
+                except ValueError as e:
+                    add(e)
+    else:
+        body = json.loads(b"".join([chunk async for chunk in chunks]) or b"[]")
+        if isinstance(body, dict):
+            body = body.get("devices")
+        if not isinstance(body, list):
+            raise ValueError('Expected a JSON array of devices or {"devices": [...]}')
+        for value in body:
+            add(value)
+    return rows
+
+
+def _validation_message(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        return "; ".join(
+            f"{'.'.join(str(part) for part in item['loc']) or 'row'}: {item['msg']}"
+            for item in error.errors()
+        )
+    return f"invalid row: {error}"
+
+
+# =====================================================
+# VALIDATION AND INSERT
+# =====================================================
+
+def validate_rows(rows: List[Tuple[int, Any]]) -> Tuple[List[Tuple[int, BulkDeviceItem]], List[ProvisionResult]]:
+    """Model validation plus duplicate names within the batch"""
+    valid: List[Tuple[int, BulkDeviceItem]] = []
+    errors: List[ProvisionResult] = []
+    first_row_by_name: Dict[str, int] = {}
+
+    for row, raw in rows:
+        if isinstance(raw, Exception):
+            errors.append(ProvisionResult(row, error=_validation_message(raw)))
+            continue
+        try:
+            item = BulkDeviceItem.model_validate(raw)
+        except ValidationError as e:
+            name = raw.get("name") if isinstance(raw, dict) else None
+            errors.append(ProvisionResult(row, name=name, error=_validation_message(e)))
+            continue
+        first = first_row_by_name.setdefault(item.name, row)
+        if first != row:
+            errors.append(ProvisionResult(row, name=item.name, error=f"duplicate name in batch (row {first})"))
+            continue
+        valid.append((row, item))
+    return valid, errors
+
+
+def _record(item: BulkDeviceItem, tenant_id: uuid.UUID, channel_id: uuid.UUID) -> Tuple[tuple, ProvisionResult]:
+    device_id = uuid.uuid4()
+    device_key = "dev_" + secrets.token_hex(16)
+    device_secret = secrets.token_hex(32)
+    record = (
+        device_id,
+        tenant_id,
+        channel_id,
+        item.device_type_id,
+        item.name,
+        item.description,
+        device_key,
+        device_secret,
+        json.dumps(item.location.model_dump()) if item.location else None,
+        json.dumps(item.metadata or {}),
+        json.dumps(item.configuration or {}),
+        item.firmware_version,
+        "offline",
+    )
+    return record, ProvisionResult(0, item.name, str(device_id), device_key, device_secret)
+
+
+async def insert_devices(
+    conn: asyncpg.Connection,
+    tenant_id: uuid.UUID,
+    channel_id: uuid.UUID,
+    items: List[Tuple[int, BulkDeviceItem]],
+) -> List[ProvisionResult]:
+    """
+    Insert validated devices with a single COPY inside a transaction
+
+    Names already taken for the tenant and unknown device types are checked
+    in memory first and reported per row; only the remaining rows are
+    copied. If a concurrent request claims a name in between, the COPY
+    fails as a whole, and the check and COPY are retried.
+
+    Args:
+        conn: Connection to run on
+        tenant_id: Tenant owning the devices
+        channel_id: Channel every device is assigned to
+        items: (row number, validated item) pairs with unique names
+
+    Returns:
+        One result per item: credentials, or the reason it was rejected
+    """
+    type_ids = list({item.device_type_id for _, item in items if item.device_type_id})
+    known_types = {r["id"] for r in await conn.fetch(KNOWN_DEVICE_TYPES_QUERY, type_ids)} if type_ids else set()
+
+    for attempt in range(1, MAX_COPY_ATTEMPTS + 1):
+        results: List[ProvisionResult] = []
+        records = []
+        try:
+            async with conn.transaction():
+                taken = {
+                    r["name"]
+                    for r in await conn.fetch(EXISTING_NAMES_QUERY, tenant_id, [item.name for _, item in items])
+                }
+                for row, item in items:
+                    if item.name in taken:
+                        results.append(ProvisionResult(row, item.name, error="name already exists in tenant"))
+                    elif item.device_type_id and item.device_type_id not in known_types:
+                        results.append(ProvisionResult(row, item.name, error="unknown device_type_id"))
+                    else:
+                        record, result = _record(item, tenant_id, channel_id)
+                        result.row = row
+                        records.append(record)
+                        results.append(result)
+                if records:
+                    await conn.copy_records_to_table("devices", records=records, columns=COPY_COLUMNS)
+            return results
+        except asyncpg.UniqueViolationError:
+            if attempt == MAX_COPY_ATTEMPTS:
+                raise
+            logger.info("Bulk provisioning raced a concurrent insert, retrying (attempt %d)", attempt)
+    return []
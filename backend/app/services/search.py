@@ -0,0 +1,230 @@
+"""
+Device Search
+Ranked trigram search plus an in-memory per-tenant prefix index for type-ahead
+"""
+
+import asyncio
+import re
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from app.cache import TTLCache, MISSING
+from app.config import settings
+from app.database import get_db_connection
+from app.statements import statements
+from app import invalidation
+
+
+# pg_trgm extracts no trigrams from an unanchored pattern shorter than this,
+# so '%ab%' would scan the whole index; shorter terms are matched as prefixes
+MIN_TRIGRAM_LENGTH = 3
+
+_WORD_START = re.compile(r"(?<!\w)\w", re.UNICODE)
+
+# Fuzzy, ranked search over name, description and metadata tags. Rows match
+# on a substring (LIKE $3) or on word similarity ($2 <% text, which tolerates
+# typos); both forms are served by idx_devices_search_trgm. Names starting
+# with the term rank first.
+SEARCH_DEVICES = statements.register("devices.search", """
+    SELECT
+        d.id::text AS id,
+        d.name,
+        d.description,
+        d.status,
+        d.channel_id::text AS channel_id,
+        word_similarity($2, device_search_text(d.name, d.description, d.metadata)) AS score
+    FROM devices d
+    WHERE d.tenant_id = $1
+        AND (
+            device_search_text(d.name, d.description, d.metadata) LIKE $3
+            OR $2 <% device_search_text(d.name, d.description, d.metadata)
+        )
+    ORDER BY starts_with(lower(d.name), $2) DESC, score DESC, d.name
+    LIMIT $4
+""")
+
+# Name prefix as an explicit range ($2 <= name < $3), which the
+# text_pattern_ops b-tree serves even in a generic plan (LIKE $2 only
+# becomes a range when the pattern is a planning-time constant)
+SEARCH_PREFIX = statements.register("devices.search_prefix", """
+    SELECT
+        d.id::text AS id,
+        d.name,
+        d.description,
+        d.status,
+        d.channel_id::text AS channel_id
+    FROM devices d
+    WHERE d.tenant_id = $1
+        AND lower(d.name) ~>=~ $2
+        AND lower(d.name) ~<~ $3
+    ORDER BY lower(d.name)
+    LIMIT $4
+""")
+
+TENANT_DEVICE_NAMES = statements.register("devices.tenant_names", """
+    SELECT id::text AS id, name FROM devices WHERE tenant_id = $1 LIMIT $2
+""")
+
+
+def like_escape(term: str) -> str:
+    """Escape LIKE wildcards so user input matches literally"""
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_pattern(term: Optional[str]) -> Optional[str]:
+    """
+    ILIKE pattern for a free-text filter that a trigram index can serve
+
+    Terms of MIN_TRIGRAM_LENGTH or more match anywhere; shorter terms match
+    as a prefix, which pg_trgm can still extract trigrams from.
+    """
+    if not term:
+        return None
+    escaped = like_escape(term)
+    return f"%{escaped}%" if len(term) >= MIN_TRIGRAM_LENGTH else f"{escaped}%"
+
+
+def _prefix_upper_bound(prefix: str) -> str:
+    """Smallest string greater than every string starting with prefix"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+# =====================================================
+# IN-MEMORY PREFIX INDEX
+# =====================================================
+
+class PrefixIndex:
+    """
+    Sorted device names of one tenant, searched with bisect
+
+    Names are indexed whole and from every later word start, so "Boiler
+    Room 2" is found by "boi", "room" and "2". Whole-name matches rank
+    before word matches; both are alphabetical.
+    """
+
+    __slots__ = ("_names", "_name_refs", "_words", "_word_refs", "_devices")
+
+    def __init__(self, devices: List[Tuple[str, str]]):
+        self._devices = devices
+        lowered = [name.lower() for _, name in devices]
+        order = sorted(range(len(lowered)), key=lowered.__getitem__)
+        self._names = [lowered[i] for i in order]
+        self._name_refs = order
+
+        suffixes: List[str] = []
+        owners: List[int] = []
+        for i, name in enumerate(lowered):
+            for match in _WORD_START.finditer(name, 1):
+                suffixes.append(name[match.start():])
+                owners.append(i)
+        order = sorted(range(len(suffixes)), key=suffixes.__getitem__)
+        self._words = [suffixes[i] for i in order]
+        self._word_refs = [owners[i] for i in order]
+
+    def __len__(self) -> int:
+        return len(self._devices)
+
+    def search(self, prefix: str, limit: int) -> List[Tuple[str, str]]:
+        """(device id, name) pairs whose name or a word in it starts with prefix"""
+        prefix = prefix.lower()
+        found: List[int] = []
+        seen = set()
+        for keys, refs in ((self._names, self._name_refs), (self._words, self._word_refs)):
+            i = bisect_left(keys, prefix)
+            end = len(keys)
+            while i < end and len(found) < limit and keys[i].startswith(prefix):
+                ref = refs[i]
+                if ref not in seen:
+                    seen.add(ref)
+                    found.append(ref)
+                i += 1
+        return [self._devices[ref] for ref in found]
+
+
+# tenant id -> PrefixIndex, or None for tenants above SEARCH_INDEX_MAX_DEVICES
+_indexes = TTLCache("device_prefix_index", settings.SEARCH_INDEX_MAX_TENANTS, settings.CACHE_TTL_SECONDS)
+invalidation.subscribe("tenant_devices", _indexes)
+
+# Builds in progress, so a burst of keystrokes loads a tenant only once
+_loading: Dict[str, asyncio.Future] = {}
+
+
+async def _load_index(tenant_id: str) -> Optional[PrefixIndex]:
+    generation = _indexes.generation
+    max_devices = settings.SEARCH_INDEX_MAX_DEVICES
+    async with get_db_connection() as conn:
+        rows = await statements.fetch(conn, TENANT_DEVICE_NAMES, UUID(tenant_id), max_devices + 1)
+    index = None
+    if len(rows) <= max_devices:
+        # Sorting a large tenant takes long enough to stall other requests
+        index = await asyncio.to_thread(PrefixIndex, [(row["id"], row["name"]) for row in rows])
+    _indexes.set(tenant_id, index, generation)
+    return index
+
+
+async def get_prefix_index(tenant_id: UUID) -> Optional[PrefixIndex]:
+    """A tenant's prefix index, built on first use; None if too large or disabled"""
+    if not settings.SEARCH_INDEX_ENABLED:
+        return None
+    key = str(tenant_id)
+    index = _indexes.get(key)
+    if index is not MISSING:
+        return index
+    pending = _loading.get(key)
+    if pending is None:
+        pending = asyncio.ensure_future(_load_index(key))
+        _loading[key] = pending
+        pending.add_done_callback(lambda _: _loading.pop(key, None))
+    return await asyncio.shield(pending)
+
+
+# =====================================================
+# QUERIES
+# =====================================================
+
+async def search_devices(tenant_id: UUID, term: str, limit: int) -> List[Dict[str, Any]]:
+    """
+    Ranked device search for a tenant
+
+    Args:
+        tenant_id: Tenant to search in
+        term: Free text; short terms are matched as name prefixes
+        limit: Maximum results
+
+    Returns:
+        Device rows with a similarity score, best first
+    """
+    term = term.strip().lower()
+    if len(term) < MIN_TRIGRAM_LENGTH:
+        return await _search_prefix(tenant_id, term, limit)
+    async with get_db_connection() as conn:
+        rows = await statements.fetch(conn, SEARCH_DEVICES, tenant_id, term, f"%{like_escape(term)}%", limit)
+    return [dict(row) for row in rows]
+
+
+async def _search_prefix(tenant_id: UUID, prefix: str, limit: int) -> List[Dict[str, Any]]:
+    if not prefix:
+        return []
+    async with get_db_connection() as conn:
+        rows = await statements.fetch(
+            conn, SEARCH_PREFIX, tenant_id, prefix, _prefix_upper_bound(prefix), limit
+        )
+    return [dict(row) for row in rows]
+
+
+async def suggest_devices(tenant_id: UUID, prefix: str, limit: int) -> Tuple[List[Dict[str, Any]], str]:
+    """
+    Type-ahead suggestions for a name prefix
+
+    Served from the tenant's in-memory prefix index when it fits within
+    SEARCH_INDEX_MAX_DEVICES, otherwise from the database prefix query.
+
+    Returns:
+        (results, source) where source is "index" or "database"
+    """
+    prefix = prefix.strip().lower()
+    index = await get_prefix_index(tenant_id)
+    if index is not None:
+        return [{"id": device_id, "name": name} for device_id, name in index.search(prefix, limit)], "index"
+    return await _search_prefix(tenant_id, prefix, limit), "database"
@@ -0,0 +1,195 @@
+"""
+Sensor Schema Validation
+Per-device-type checks of ingested points against device_types.sensor_schema, compiled once and cached
+"""
+
+import math
+import sys
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app import invalidation
+from app.cache import TTLCache, MISSING
+from app.config import settings
+from app.services.ingest import PointRow
+
+
+# Rejection messages returned per batch (the count is always complete)
+MAX_REJECTION_SAMPLES = 20
+
+# Check of one point's value and unit: None if valid, else the reason
+PointCheck = Callable[[float, Optional[str]], Optional[str]]
+
+
+# =====================================================
+# COMPILATION
+# =====================================================
+
+def _bound(spec: Dict[str, Any], *keys: str) -> Optional[float]:
+    for key in keys:
+        value = spec.get(key)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+    return None
+
+
+def _compile_metric(name: str, spec: Any) -> PointCheck:
+    """
+    One metric's property schema as a single closure
+
+    Understands "type" (number, integer or boolean), the bounds
+    "minimum"/"maximum" (or this repo's "min"/"max"),
+    "exclusiveMinimum"/"exclusiveMaximum" and "unit". All bounds fold into
+    one inclusive [low, high] range (infinities and NaN fall outside it),
+    so a valid point costs one chained comparison and a unit check; only
+    rejected points go through the slower explanation.
+    """
+    spec = spec if isinstance(spec, dict) else {}
+    kind = spec.get("type", "number")
+    if kind not in ("number", "integer", "boolean"):
+        reason = f"{name}: schema type '{kind}' is not numeric"
+        return lambda value, unit: reason
+
+    low, high = -sys.float_info.max, sys.float_info.max
+    minimum, maximum = _bound(spec, "minimum", "min"), _bound(spec, "maximum", "max")
+    above, below = _bound(spec, "exclusiveMinimum"), _bound(spec, "exclusiveMaximum")
+    if kind == "boolean":
+        minimum, maximum = 0.0, 1.0
+    if minimum is not None:
+        low = max(low, minimum)
+    if maximum is not None:
+        high = min(high, maximum)
+    if above is not None:
+        low = max(low, math.nextafter(above, math.inf))
+    if below is not None:
+        high = min(high, math.nextafter(below, -math.inf))
+    integral = kind in ("integer", "boolean")
+    expected_unit = spec.get("unit")
+
+    def explain(value: float, unit: Optional[str]) -> str:
+        if not math.isfinite(value):
+            return f"{name}={value}: not a finite number"
+        if integral and not value.is_integer():
+            return f"{name}={value:g}: must be {'0 or 1' if kind == 'boolean' else 'an integer'}"
+        if minimum is not None and value < minimum:
+            return f"{name}={value:g}: below minimum {minimum:g}"
+        if maximum is not None and value > maximum:
+            return f"{name}={value:g}: above maximum {maximum:g}"
+        if value < low:
+            return f"{name}={value:g}: must be above {above:g}"
+        if value > high:
+            return f"{name}={value:g}: must be below {below:g}"
+        # Points without a unit take the schema's; a different one is a mix-up
+        return f"{name}: unit '{unit}' (expected '{expected_unit}')"
+
+    if integral:
+        def check(value: float, unit: Optional[str]) -> Optional[str]:
+            if low <= value <= high and value.is_integer() and (
+                unit is None or expected_unit is None or unit == expected_unit
+            ):
+                return None
+            return explain(value, unit)
+    else:
+        def check(value: float, unit: Optional[str]) -> Optional[str]:
+            if low <= value <= high and (unit is None or expected_unit is None or unit == expected_unit):
+                return None
+            return explain(value, unit)
+
+    return check
+
+
+class CompiledSchema:
+    """
+    A device type's sensor_schema, compiled into a check per metric
+
+    sensor_schema is an object schema whose properties are the metric
+    names the type can send. Unlike plain JSON Schema, a metric that is not
+    listed is rejected (typos would otherwise land in the hypertable)
+    unless the schema sets "additionalProperties": true.
+    """
+
+    __slots__ = ("metrics", "allow_unknown")
+
+    def __init__(self, schema: Dict[str, Any]):
+        properties = schema.get("properties") or {}
+        self.metrics: Dict[str, PointCheck] = {
+            name: _compile_metric(name, spec) for name, spec in properties.items()
+        }
+        self.allow_unknown = schema.get("additionalProperties") is True
+
+    def check_row(self, row: PointRow) -> Optional[str]:
+        """None if the row is valid, else why it was rejected"""
+        check = self.metrics.get(row[1])
+        if check is None:
+            return None if self.allow_unknown else f"{row[1]}: metric not in the device type's sensor_schema"
+        return check(row[2], row[3])
+
+    def filter_rows(self, rows: List[PointRow]) -> Tuple[List[PointRow], int, List[str]]:
+        """
+        Split rows into valid ones and rejections
+
+        Returns:
+            (valid rows in order, rejected count, sample of rejection reasons)
+        """
+        accepted: List[PointRow] = []
+        rejected = 0
+        reasons: List[str] = []
+        # check_row() inlined: this loop runs for every ingested point
+        metrics, allow_unknown = self.metrics, self.allow_unknown
+        for row in rows:
+            check = metrics.get(row[1])
+            if check is None:
+                if allow_unknown:
+                    accepted.append(row)
+                    continue
+                reason = f"{row[1]}: metric not in the device type's sensor_schema"
+            else:
+                reason = check(row[2], row[3])
+                if reason is None:
+                    accepted.append(row)
+                    continue
+            rejected += 1
+            if len(reasons) < MAX_REJECTION_SAMPLES:
+                reasons.append(reason)
+        return accepted, rejected, reasons
+
+
+def compile_schema(schema: Any) -> Optional[CompiledSchema]:
+    """
+    Compile a sensor_schema, or None if it declares no metrics
+
+    Types without properties (the column defaults to '{}') accept anything,
+    as before validation existed.
+    """
+    if not isinstance(schema, dict) or not isinstance(schema.get("properties"), dict) or not schema["properties"]:
+        return None
+    return CompiledSchema(schema)
+
+
+# =====================================================
+# CACHE
+# =====================================================
+
+# Compiled schemas by device type id (None: nothing to validate); the
+# device_types trigger publishes "device_type" invalidations on change
+_schemas = TTLCache("sensor_schemas", settings.CACHE_MAX_ENTRIES, settings.CACHE_TTL_SECONDS)
+invalidation.subscribe("device_type", _schemas)
+
+
+def get_compiled_schema(supabase, device_type_id: Optional[str]) -> Optional[CompiledSchema]:
+    """
+    A device type's compiled sensor_schema (cached)
+
+    Returns:
+        The compiled schema, or None if the device has no type, the type
+        declares no metrics or SENSOR_SCHEMA_VALIDATION is off
+    """
+    if not device_type_id or not settings.SENSOR_SCHEMA_VALIDATION:
+        return None
+    compiled = _schemas.get(device_type_id)
+    if compiled is not MISSING:
+        return compiled
+    generation = _schemas.generation
+    response = supabase.table("device_types").select("sensor_schema").eq("id", device_type_id).execute()
+    compiled = compile_schema(response.data[0].get("sensor_schema")) if response.data else None
+    _schemas.set(device_type_id, compiled, generation)
+    return compiled
@@ -0,0 +1,139 @@
+"""
+Prepared Statement Registry
+Named, canonical SQL statements prepared once per pooled connection
+"""
+
+import time
+import weakref
+from typing import Any, Dict
+
+import asyncpg
+from asyncpg.prepared_stmt import PreparedStatement
+
+from app.metrics import DB_QUERY_DURATION, registry
+from app.profiling import record_call
+
+
+class StatementRegistry:
+    """
+    Registry of canonical SQL statements
+
+    Each query shape is registered once under a name with fixed text and
+    fixed $n numbering (optional filters and partial updates are expressed
+    as `$n IS NULL OR ...` / `COALESCE($n, col)` instead of string building),
+    so the number of distinct statements stays bounded.
+
+    Statements are prepared on every new pool connection and the resulting
+    PreparedStatement objects are reused for the life of that connection,
+    so each request skips parse/plan entirely. They are keyed by the
+    underlying asyncpg connection, unwrapped from pool proxies and the
+    profiling wrapper: a backend PID is only unique per server, and the
+    replica pool's connections would collide with the primary's.
+    """
+
+    def __init__(self):
+        self._sql: Dict[str, str] = {}
+        self._prepared: "weakref.WeakKeyDictionary[asyncpg.Connection, Dict[str, PreparedStatement]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def register(self, name: str, sql: str) -> str:
+        """
+        Register a canonical statement
+
+        Args:
+            name: Unique statement name (e.g. "channels.get")
+            sql: SQL text with positional parameters
+
+        Returns:
+            The statement name, for use as a module constant
+        """
+        existing = self._sql.get(name)
+        if existing is not None and existing != sql:
+            raise ValueError(f"Statement '{name}' is already registered with different SQL")
+        self._sql[name] = sql
+        return name
+
+    def sql(self, name: str) -> str:
+        """SQL text of a registered statement"""
+        return self._sql[name]
+
+    async def prepare_all(self, conn: asyncpg.Connection):
+        """Prepare every registered statement on a new connection (pool init hook)"""
+        raw = _unwrap(conn)
+        self._prepared[raw] = {name: await conn.prepare(sql) for name, sql in self._sql.items()}
+        # The statements reference their connection, so drop them explicitly
+        raw.add_termination_listener(lambda _conn: self._prepared.pop(raw, None))
+
+    async def get(self, conn, name: str) -> PreparedStatement:
+        """Prepared statement for name on conn, preparing it on first use"""
+        per_conn = self._prepared.setdefault(_unwrap(conn), {})
+        stmt = per_conn.get(name)
+        if stmt is not None:
+            self.hits += 1
+            return stmt
+        self.misses += 1
+        stmt = await conn.prepare(self._sql[name])
+        per_conn[name] = stmt
+        return stmt
+
+    def _observe(self, name: str, seconds: float):
+        DB_QUERY_DURATION.labels(name).observe(seconds)
+        record_call("db", name, seconds)
+
+    async def fetch(self, conn, name: str, *args):
+        started = time.perf_counter()
+        try:
+            return await (await self.get(conn, name)).fetch(*args)
+        finally:
+            self._observe(name, time.perf_counter() - started)
+
+    async def fetchrow(self, conn, name: str, *args):
+        started = time.perf_counter()
+        try:
+            return await (await self.get(conn, name)).fetchrow(*args)
+        finally:
+            self._observe(name, time.perf_counter() - started)
+
+    async def fetchval(self, conn, name: str, *args):
+        started = time.perf_counter()
+        try:
+            return await (await self.get(conn, name)).fetchval(*args)
+        finally:
+            self._observe(name, time.perf_counter() - started)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Registered statement count, connections prepared and cache hit rate"""
+        lookups = self.hits + self.misses
+        return {
+            "registered": len(self._sql),
+            "connections": len(self._prepared),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+def _unwrap(conn) -> asyncpg.Connection:
+    """The asyncpg connection behind a pool proxy or ProfiledConnection"""
+    # Both delegate attribute access, so _con reaches the pool proxy's target
+    return getattr(conn, "_con", conn)
+
+
+# Process-wide registry
+statements = StatementRegistry()
+
+
+@registry.register_collector
+def _collect_statement_metrics():
+    yield (
+        "iotlinker_prepared_statement_lookups",
+        "counter",
+        "Prepared statement cache lookups by result",
+        [
+            ("_total", {"result": "hit"}, statements.hits),
+            ("_total", {"result": "miss"}, statements.misses),
+        ],
+    )
@@ -0,0 +1,164 @@
+"""
+Payload Validation Benchmark
+Cost per point of sensor_schema validation, relative to the rest of the ingest CPU path
+
+Usage (from backend/, with the usual .env or environment variables):
+    python benchmarks/payload_validation.py
+    python benchmarks/payload_validation.py --batch 5000 --metrics 20 --invalid 0.1 --json validation.json
+
+No database is needed. A seeded batch of --batch points over --metrics
+metrics (a --invalid fraction of them out of range, with the wrong unit or
+an unknown metric name) goes through the ingest endpoint's CPU work:
+
+    parse       DeviceDataBatch.model_validate_json() of the request body
+    rows        dedupe_points(), the rows handed to the insert
+    validate    CompiledSchema.filter_rows() on those rows
+    compile     compile_schema() of the schema (once per device type and
+                cache lifetime, reported per schema rather than per point)
+
+Each stage reports the median of --runs in nanoseconds per point. The run
+fails (exit status 1) if validation costs more than --max-fraction of
+parse + rows, which is a lower bound on ingest time (the insert round trip
+comes on top).
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+UNITS = ["celsius", "percent", "hPa", "V", "ppm", "mm/s"]
+
+
+def sensor_schema(metrics: int) -> Dict[str, Any]:
+    """A sensor_schema shaped like the seeded device types, with `metrics` properties"""
+    properties = {}
+    for i in range(metrics):
+        spec: Dict[str, Any] = {"type": "integer" if i % 5 == 4 else "number", "unit": UNITS[i % len(UNITS)]}
+        if i % 3 != 2:
+            spec.update({"min": -40, "max": 125})
+        properties[f"metric_{i}"] = spec
+    return {"type": "object", "properties": properties}
+
+
+def batch_body(schema: Dict[str, Any], size: int, invalid: float, rng: random.Random) -> bytes:
+    """JSON body of a DeviceDataBatch; about `invalid` of its points break the schema"""
+    names = list(schema["properties"])
+    start = datetime(2024, 12, 1, tzinfo=timezone.utc)
+    points = []
+    for i in range(size):
+        name = names[i % len(names)]
+        spec = schema["properties"][name]
+        point = {
+            "metric_name": name,
+            "value": float(rng.randint(-40, 125)),
+            "unit": spec["unit"],
+            "timestamp": (start + timedelta(seconds=i // len(names))).isoformat(),
+        }
+        if rng.random() < invalid:
+            broken = rng.randrange(3)
+            if broken == 0:
+                point["value"] = 1000.5
+            elif broken == 1:
+                point["unit"] = "fahrenheit"
+            else:
+                point["metric_name"] = name + "_typo"
+        points.append(point)
+    return json.dumps({"device_id": "bench", "device_key": "bench", "data": points}).encode()
+
+
+def _time(function: Callable[[], Any], runs: int) -> List[float]:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter_ns()
+        function()
+        samples.append(time.perf_counter_ns() - started)
+    return samples
+
+
+def run(args) -> Dict[str, Any]:
+    # Imported here: the app modules need the usual settings (.env)
+    from app.models import DeviceDataBatch
+    from app.services.ingest import ON_CONFLICT_IGNORE, dedupe_points
+    from app.services.sensor_schema import compile_schema
+
+    rng = random.Random(args.seed)
+    schema = sensor_schema(args.metrics)
+    body = batch_body(schema, args.batch, args.invalid, rng)
+    compiled = compile_schema(schema)
+    batch = DeviceDataBatch.model_validate_json(body)
+    now = datetime.now(timezone.utc)
+    rows, _ = dedupe_points(batch.data, now, ON_CONFLICT_IGNORE)
+    accepted, rejected, _ = compiled.filter_rows(rows)
+
+    stages = {
+        "parse": lambda: DeviceDataBatch.model_validate_json(body),
+        "rows": lambda: dedupe_points(batch.data, now, ON_CONFLICT_IGNORE),
+        "validate": lambda: compiled.filter_rows(rows),
+    }
+    results: Dict[str, Any] = {}
+    for name, function in stages.items():
+        _time(function, args.warmup)
+        median = statistics.median(_time(function, args.runs))
+        results[name] = {"ns_per_point": round(median / len(rows), 1), "batch_ms": round(median / 1e6, 3)}
+    compile_ns = statistics.median(_time(lambda: compile_schema(schema), args.runs))
+    results["compile"] = {"us_per_schema": round(compile_ns / 1e3, 1)}
+
+    baseline = results["parse"]["ns_per_point"] + results["rows"]["ns_per_point"]
+    return {
+        "meta": {
+            "batch": args.batch,
+            "points": len(rows),
+            "metrics": args.metrics,
+            "rejected": rejected,
+            "accepted": len(accepted),
+            "python": sys.version.split()[0],
+        },
+        "stages": results,
+        "validation_fraction": round(results["validate"]["ns_per_point"] / baseline, 4),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", type=int, default=1000, help="points per batch")
+    parser.add_argument("--metrics", type=int, default=6, help="metrics in the schema")
+    parser.add_argument("--invalid", type=float, default=0.05, help="fraction of points breaking the schema")
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--max-fraction", type=float, default=0.1,
+                        help="fail if validation costs more than this share of parse + rows")
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    meta = results["meta"]
+    print(f"{meta['points']} points over {meta['metrics']} metrics, {meta['rejected']} rejected")
+    for name, stage in results["stages"].items():
+        if name == "compile":
+            print(f"{name:<10} {stage['us_per_schema']:>10.1f} us per schema")
+        else:
+            print(f"{name:<10} {stage['ns_per_point']:>10.1f} ns per point  ({stage['batch_ms']:.3f} ms per batch)")
+    print(f"validation is {results['validation_fraction']:.1%} of parse + rows")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if results["validation_fraction"] > args.max_fraction:
+        print(f"validation exceeds {args.max_fraction:.0%} of parse + rows")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
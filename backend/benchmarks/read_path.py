@@ -0,0 +1,396 @@
+"""
+Read Path Benchmark
+Latency of the read endpoints' queries and the SQL helpers on the seeded dataset, with baseline comparison
+
+Usage (from backend/, with the usual .env or environment variables, after
+benchmarks/seed_dataset.py loaded the same database):
+    python benchmarks/read_path.py --dsn postgresql://postgres@localhost/iotlinker_bench --json main.json
+    python benchmarks/read_path.py --baseline main.json --json branch.json
+    python benchmarks/read_path.py --base-url http://localhost:8000 --token iotl_...
+
+SQL cases run the statements the endpoints execute (taken from the
+statement registry, so they follow the code) and the SQL helper functions
+against random devices, channels and tenants of the "bench-seed"
+organization, drawn with --seed so runs are comparable:
+
+    list_devices.first / .deep    devices page 1 and the last page (the
+                                  PostgREST query list_devices issues,
+                                  including its exact count)
+    list_channels                 count + page with device counts
+    channel_devices               GET /channels/{id}/devices
+    channel_summary               GET /channels/{id}/summary (uncached)
+    device_data.week              GET /devices/{id}/data over 7 days, limit 10000
+    get_latest_device_metrics     latest value per metric of a device
+    get_device_metrics_range      hourly buckets of one metric over 7 days
+    detect_anomalies              z-scores of one metric over 24 hours
+    device_percentiles.month      GET /devices/{id}/percentiles over 30 days
+                                  (rollup sketches merged in Python)
+    channel_percentiles.month     GET /channels/{id}/percentiles over 30 days
+    percentiles.raw_scan          the same device range with exact
+                                  percentile_cont() over device_data, for
+                                  comparison
+    refresh_rollups               refresh_device_data_aggregates() (--refresh, once)
+
+With --base-url the same reads are also timed over HTTP against a running
+API (cases prefixed "http."). --baseline compares p50 latencies with an
+earlier --json result and exits with status 1 if any case is slower by
+more than --tolerance.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import asyncpg
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+ORGANIZATION_SLUG = "bench-seed"
+PAGE_SIZE = 20
+
+# What list_devices asks PostgREST for (select=*, count=exact, order, range)
+LIST_DEVICES_COUNT = "SELECT COUNT(*) FROM devices WHERE tenant_id = $1"
+LIST_DEVICES_PAGE = """
+    SELECT * FROM devices
+    WHERE tenant_id = $1
+    ORDER BY created_at DESC
+    LIMIT $2 OFFSET $3
+"""
+
+TARGETS_QUERY = """
+    SELECT d.id, d.tenant_id, d.channel_id
+    FROM devices d
+    JOIN tenants t ON t.id = d.tenant_id
+    JOIN organizations o ON o.id = t.organization_id
+    WHERE o.slug = $1
+    ORDER BY d.id
+"""
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, max(0, int(round(len(ordered) * fraction)) - 1))]
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    return {
+        "runs": len(ordered),
+        "p50_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(_percentile(ordered, 0.95), 3),
+        "mean_ms": round(statistics.fmean(ordered), 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+
+class Targets:
+    """Seeded ids drawn from, plus the end of the telemetry"""
+
+    def __init__(self, rows, data_end: datetime, seed: int):
+        self.devices = [(row["id"], row["tenant_id"], row["channel_id"]) for row in rows]
+        self.tenants = sorted({row["tenant_id"] for row in rows})
+        self.channels = sorted({(row["channel_id"], row["tenant_id"]) for row in rows})
+        self.devices_per_tenant = {
+            tenant: sum(1 for _, t, _ in self.devices if t == tenant) for tenant in self.tenants
+        }
+        self.data_end = data_end
+        self.rng = random.Random(seed)
+
+    def device(self):
+        return self.rng.choice(self.devices)
+
+    def tenant(self):
+        return self.rng.choice(self.tenants)
+
+    def channel(self):
+        return self.rng.choice(self.channels)
+
+
+def sql_cases(targets: Targets, metric: str) -> Dict[str, Callable[[asyncpg.Connection], Awaitable[Any]]]:
+    """Case name -> coroutine function running one request's queries on a connection"""
+    # Imported here: the app modules need the usual settings (.env)
+    from app.api.v1 import channels, devices
+    from app.services.percentiles import range_percentiles
+    from app.statements import statements
+
+    sql = statements.sql
+    week = timedelta(days=7)
+    month = timedelta(days=30)
+    percentiles = [50.0, 95.0, 99.0]
+
+    async def list_devices_first(conn):
+        tenant = targets.tenant()
+        await conn.fetchval(LIST_DEVICES_COUNT, tenant)
+        return await conn.fetch(LIST_DEVICES_PAGE, tenant, PAGE_SIZE, 0)
+
+    async def list_devices_deep(conn):
+        tenant = targets.tenant()
+        await conn.fetchval(LIST_DEVICES_COUNT, tenant)
+        last_page = max(0, (targets.devices_per_tenant[tenant] - 1) // PAGE_SIZE)
+        return await conn.fetch(LIST_DEVICES_PAGE, tenant, PAGE_SIZE, last_page * PAGE_SIZE)
+
+    async def list_channels(conn):
+        tenant = str(targets.tenant())
+        await conn.fetchval(sql(channels.COUNT_CHANNELS), tenant, None)
+        return await conn.fetch(sql(channels.LIST_CHANNELS), tenant, None, PAGE_SIZE, 0)
+
+    async def channel_devices(conn):
+        channel, tenant = targets.channel()
+        await conn.fetchval(sql(channels.CHANNEL_EXISTS), str(channel), str(tenant))
+        return await conn.fetch(sql(channels.LIST_CHANNEL_DEVICES), str(channel), None)
+
+    async def channel_summary(conn):
+        channel, tenant = targets.channel()
+        window_start = targets.data_end.replace(minute=0, second=0, microsecond=0) - timedelta(
+            hours=channels.SPARKLINE_HOURS - 1
+        )
+        await conn.fetchrow(sql(channels.GET_CHANNEL), str(channel), str(tenant))
+        rows = await conn.fetch(sql(channels.SUMMARY_DEVICES), str(channel), str(tenant))
+        device_ids = [row["id"] for row in rows]
+        try:
+            return await conn.fetch(sql(channels.SUMMARY_SERIES), str(tenant), device_ids, window_start)
+        except asyncpg.ObjectNotInPrerequisiteStateError:
+            return await conn.fetch(sql(channels.SUMMARY_SERIES_RAW), str(tenant), device_ids, window_start)
+
+    async def device_data_week(conn):
+        device, tenant, _ = targets.device()
+        return await conn.fetch(
+            sql(devices.DEVICE_DATA_RANGE), tenant, device, None, targets.data_end - week, targets.data_end, 10000
+        )
+
+    async def latest_metrics(conn):
+        device, _, _ = targets.device()
+        return await conn.fetch("SELECT * FROM get_latest_device_metrics($1)", device)
+
+    async def metrics_range(conn):
+        device, _, _ = targets.device()
+        return await conn.fetch(
+            "SELECT * FROM get_device_metrics_range($1, $2, $3, $4, '1 hour')",
+            device, metric, targets.data_end - week, targets.data_end,
+        )
+
+    async def anomalies(conn):
+        device, _, _ = targets.device()
+        return await conn.fetch("SELECT * FROM detect_anomalies($1, $2, 24, 3.0)", device, metric)
+
+    async def device_percentiles(conn):
+        device, tenant, _ = targets.device()
+        start = targets.data_end - month
+        return await range_percentiles(conn, tenant, [device], metric, start, targets.data_end, percentiles)
+
+    async def channel_percentiles(conn):
+        channel, tenant = targets.channel()
+        start = targets.data_end - month
+        rows = await conn.fetch(sql(channels.CHANNEL_DEVICE_IDS), str(channel), str(tenant))
+        device_ids = [row["id"] for row in rows]
+        return await range_percentiles(conn, tenant, device_ids, metric, start, targets.data_end, percentiles)
+
+    async def percentiles_raw_scan(conn):
+        device, tenant, _ = targets.device()
+        return await conn.fetchrow(
+            """
+            SELECT percentile_cont(ARRAY[0.5, 0.95, 0.99]) WITHIN GROUP (ORDER BY value)
+            FROM device_data
+            WHERE tenant_id = $1 AND device_id = $2 AND metric_name = $3 AND time >= $4 AND time < $5
+            """,
+            tenant, device, metric, targets.data_end - month, targets.data_end,
+        )
+
+    return {
+        "list_devices.first": list_devices_first,
+        "list_devices.deep": list_devices_deep,
+        "list_channels": list_channels,
+        "channel_devices": channel_devices,
+        "channel_summary": channel_summary,
+        "device_data.week": device_data_week,
+        "get_latest_device_metrics": latest_metrics,
+        "get_device_metrics_range": metrics_range,
+        "detect_anomalies": anomalies,
+        "device_percentiles.month": device_percentiles,
+        "channel_percentiles.month": channel_percentiles,
+        "percentiles.raw_scan": percentiles_raw_scan,
+    }
+
+
+def http_cases(targets: Targets, metric: str, base_url: str, token: Optional[str]) -> Dict[str, Callable[[], Any]]:
+    """Case name -> function issuing one HTTP request"""
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+
+    def get(path: str):
+        request = urllib.request.Request(base_url.rstrip("/") + path, headers=headers)
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return response.read()
+
+    def list_devices(deep: bool):
+        tenant = targets.tenant()
+        page = (targets.devices_per_tenant[tenant] - 1) // PAGE_SIZE + 1 if deep else 1
+        return get(f"/api/v1/devices/?tenant_id={tenant}&page={page}&page_size={PAGE_SIZE}")
+
+    def channel_path(suffix: str):
+        channel, tenant = targets.channel()
+        return get(f"/api/v1/channels/{channel}{suffix}?tenant_id={tenant}")
+
+    def device_data_week():
+        device, _, _ = targets.device()
+        start = (targets.data_end - timedelta(days=7)).isoformat().replace("+00:00", "Z")
+        end = targets.data_end.isoformat().replace("+00:00", "Z")
+        return get(f"/api/v1/devices/{device}/data?start_time={start}&end_time={end}&limit=10000")
+
+    def device_percentiles_month():
+        device, _, _ = targets.device()
+        start = (targets.data_end - timedelta(days=30)).isoformat().replace("+00:00", "Z")
+        end = targets.data_end.isoformat().replace("+00:00", "Z")
+        return get(f"/api/v1/devices/{device}/percentiles?metric_name={metric}&start_time={start}&end_time={end}")
+
+    return {
+        "http.list_devices.first": lambda: list_devices(False),
+        "http.list_devices.deep": lambda: list_devices(True),
+        "http.list_channels": lambda: get(f"/api/v1/channels/?tenant_id={targets.tenant()}&page_size={PAGE_SIZE}"),
+        "http.channel_devices": lambda: channel_path("/devices"),
+        "http.channel_summary": lambda: channel_path("/summary"),
+        "http.device_data.week": device_data_week,
+        "http.device_percentiles.month": device_percentiles_month,
+    }
+
+
+async def run(args) -> Dict[str, Any]:
+    conn = await asyncpg.connect(args.dsn, command_timeout=None)
+    try:
+        rows = await conn.fetch(TARGETS_QUERY, ORGANIZATION_SLUG)
+        if not rows:
+            raise SystemExit(f"no '{ORGANIZATION_SLUG}' dataset found; run benchmarks/seed_dataset.py first")
+        tenant_ids = sorted({row["tenant_id"] for row in rows})
+        data_end = await conn.fetchval(
+            "SELECT MAX(time) FROM device_data WHERE tenant_id = $1 AND device_id = $2", tenant_ids[0], rows[0]["id"]
+        )
+        targets = Targets(rows, data_end or datetime.now(timezone.utc), args.seed)
+        metric = args.metric
+
+        results: Dict[str, Any] = {
+            "meta": {
+                "started_at": datetime.now(timezone.utc).isoformat(),
+                "git": _git_revision(),
+                "python": platform.python_version(),
+                "server": await conn.fetchval("SHOW server_version"),
+                "devices": len(targets.devices),
+                "tenants": len(targets.tenants),
+                "channels": len(targets.channels),
+                "data_end": targets.data_end.isoformat(),
+                "runs": args.runs,
+                "seed": args.seed,
+            },
+            "cases": {},
+        }
+
+        for name, case in sql_cases(targets, metric).items():
+            if args.only and not any(part in name for part in args.only):
+                continue
+            for _ in range(args.warmup):
+                await case(conn)
+            latencies = []
+            for _ in range(args.runs):
+                started = time.perf_counter()
+                await case(conn)
+                latencies.append((time.perf_counter() - started) * 1000)
+            results["cases"][name] = summarize(latencies)
+
+        if args.refresh:
+            started = time.perf_counter()
+            await conn.execute("SELECT refresh_device_data_aggregates()")
+            results["cases"]["refresh_rollups"] = summarize([(time.perf_counter() - started) * 1000])
+
+        if args.base_url:
+            for name, case in http_cases(targets, metric, args.base_url, args.token).items():
+                if args.only and not any(part in name for part in args.only):
+                    continue
+                for _ in range(args.warmup):
+                    await asyncio.to_thread(case)
+                latencies = []
+                for _ in range(args.runs):
+                    started = time.perf_counter()
+                    await asyncio.to_thread(case)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                results["cases"][name] = summarize(latencies)
+        return results
+    finally:
+        await conn.close()
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Print p50 changes against a baseline; returns the regressed case names"""
+    regressed = []
+    print(f"\n{'case':<28} {'base p50':>10} {'p50':>10} {'change':>8}")
+    for name, current in results["cases"].items():
+        before = baseline.get("cases", {}).get(name)
+        if before is None:
+            print(f"{name:<28} {'-':>10} {current['p50_ms']:>10.3f} {'new':>8}")
+            continue
+        change = current["p50_ms"] / before["p50_ms"] - 1 if before["p50_ms"] else 0.0
+        flag = ""
+        if change > tolerance:
+            regressed.append(name)
+            flag = "  REGRESSED"
+        print(f"{name:<28} {before['p50_ms']:>10.3f} {current['p50_ms']:>10.3f} {change:>+8.1%}{flag}")
+    return regressed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=os.environ.get("DATABASE_URL"), help="TimescaleDB DSN (default $DATABASE_URL)")
+    parser.add_argument("--runs", type=int, default=50, help="timed requests per case")
+    parser.add_argument("--warmup", type=int, default=5, help="untimed requests per case first")
+    parser.add_argument("--seed", type=int, default=42, help="seed of the id draws")
+    parser.add_argument("--metric", default="temperature", help="metric for the per-metric helpers")
+    parser.add_argument("--only", nargs="+", help="run only cases whose name contains one of these")
+    parser.add_argument("--refresh", action="store_true", help="also time one rollup refresh")
+    parser.add_argument("--base-url", help="also time the endpoints over HTTP on this API")
+    parser.add_argument("--token", help="API token for --base-url")
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    parser.add_argument("--baseline", help="earlier --json result to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p50 slowdown before failing (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+    if not args.dsn:
+        parser.error("--dsn or DATABASE_URL is required")
+
+    results = asyncio.run(run(args))
+
+    meta = results["meta"]
+    print(f"{meta['devices']} devices, {meta['channels']} channels, {meta['tenants']} tenants; {args.runs} runs per case")
+    print(f"{'case':<28} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9} {'max ms':>9}")
+    for name, r in results["cases"].items():
+        print(f"{name:<28} {r['p50_ms']:>9.3f} {r['p95_ms']:>9.3f} {r['mean_ms']:>9.3f} {r['max_ms']:>9.3f}")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressed = compare(results, json.load(f), args.tolerance)
+        if regressed:
+            print(f"\n{len(regressed)} case(s) slower than the baseline by more than {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
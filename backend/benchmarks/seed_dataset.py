@@ -0,0 +1,254 @@
+"""
+Benchmark Dataset Generator
+Deterministic tenants, channels, devices and months of telemetry loaded with COPY
+
+Usage (from backend/, against a scratch TimescaleDB database with the
+migrations applied):
+    python benchmarks/seed_dataset.py --dsn postgresql://postgres@localhost/iotlinker_bench
+    python benchmarks/seed_dataset.py --tenants 20 --channels 5 --devices 10 --metrics 4 \\
+        --days 90 --interval 60 --jobs 8 --refresh          # ~1.6 * 10^8 rows
+
+Everything is derived from --seed: ids are uuid5 names, values a daily
+sine per device and metric plus Gaussian noise, rare spikes (so
+detect_anomalies() has something to find) and an occasional degraded
+quality_score. Telemetry ends at --end (default: the current hour, so the
+NOW()-relative helpers see recent data) and covers --days before it.
+Devices are split across --jobs processes, each streaming its rows with
+binary COPY in --batch sized statements.
+
+All rows hang off the organization with slug "bench-seed"; --reset deletes
+it (cascading to the dataset) before loading. benchmarks/read_path.py
+reads the same organization.
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import random
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import asyncpg
+
+ORGANIZATION_SLUG = "bench-seed"
+NAMESPACE = uuid.UUID("6f1c2a9e-3b7d-4e58-9a41-0c2d8e5f7b13")
+
+# name, unit, base, daily amplitude, noise standard deviation
+METRICS = [
+    ("temperature", "°C", 21.0, 4.0, 0.3),
+    ("humidity", "%", 45.0, 10.0, 1.0),
+    ("pressure", "hPa", 1013.0, 6.0, 0.5),
+    ("battery_voltage", "V", 3.7, 0.2, 0.01),
+    ("co2", "ppm", 600.0, 150.0, 15.0),
+    ("vibration", "mm/s", 2.0, 0.8, 0.2),
+]
+
+ANOMALY_RATE = 0.0005
+DEGRADED_RATE = 0.02
+STATUSES = [("online", 0.7), ("offline", 0.2), ("warning", 0.07), ("error", 0.03)]
+
+DATA_COLUMNS = ["time", "device_id", "tenant_id", "metric_name", "value", "unit", "quality_score"]
+
+# (tenant id, channel id, device id, global device number)
+DeviceSpec = Tuple[uuid.UUID, uuid.UUID, uuid.UUID, int]
+
+
+def _id(kind: str, *parts: int) -> uuid.UUID:
+    return uuid.uuid5(NAMESPACE, ":".join([kind] + [str(part) for part in parts]))
+
+
+def _end_time(value: Optional[str]) -> datetime:
+    if value:
+        end = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        return end if end.tzinfo else end.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def layout(args) -> Tuple[List[tuple], List[tuple], List[tuple], List[DeviceSpec]]:
+    """Tenant, channel and device rows plus the device specs to load telemetry for"""
+    rng = random.Random(f"{args.seed}:catalog")
+    organization_id = _id("organization")
+    tenants, channels, devices, specs = [], [], [], []
+    created = _end_time(args.end) - timedelta(days=args.days)
+    number = 0
+    for t in range(args.tenants):
+        tenant_id = _id("tenant", t)
+        tenants.append((tenant_id, organization_id, f"Bench Tenant {t}", f"bench-t{t}", "professional", 100000))
+        for c in range(args.channels):
+            channel_id = _id("channel", t, c)
+            channels.append((channel_id, tenant_id, f"Channel {c}", f"Benchmark channel {c} of tenant {t}"))
+            for d in range(args.devices):
+                device_id = _id("device", t, c, d)
+                status = rng.choices([s for s, _ in STATUSES], [w for _, w in STATUSES])[0]
+                devices.append((
+                    device_id, tenant_id, channel_id,
+                    f"sensor-{t}-{c}-{d}", f"bench_{t}_{c}_{d}", f"bench_secret_{t}_{c}_{d}",
+                    status, created + timedelta(seconds=number),
+                ))
+                specs.append((tenant_id, channel_id, device_id, number))
+                number += 1
+    return tenants, channels, devices, specs
+
+
+def device_rows(spec: DeviceSpec, args, start: datetime, steps: int) -> Iterator[tuple]:
+    """Telemetry of one device in time order (deterministic per seed and device)"""
+    tenant_id, _, device_id, number = spec
+    rng = random.Random(f"{args.seed}:device:{number}")
+    metrics = [
+        (name, unit, base * rng.uniform(0.9, 1.1), amplitude, noise, rng.uniform(0, 2 * math.pi))
+        for name, unit, base, amplitude, noise in METRICS[:args.metrics]
+    ]
+    interval = args.interval
+    gauss, uniform = rng.gauss, rng.random
+    for step in range(steps):
+        t = start + timedelta(seconds=step * interval)
+        day_angle = 2 * math.pi * (step * interval % 86400) / 86400
+        for name, unit, base, amplitude, noise, phase in metrics:
+            value = base + amplitude * math.sin(day_angle + phase) + gauss(0.0, noise)
+            if uniform() < ANOMALY_RATE:
+                value += (8 if uniform() < 0.5 else -8) * amplitude
+            quality = 100 if uniform() >= DEGRADED_RATE else 40 + int(uniform() * 60)
+            yield (t, device_id, tenant_id, name, value, unit, quality)
+
+
+def _batches(rows: Iterator[tuple], size: int) -> Iterator[List[tuple]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def _load_devices(dsn: str, specs: List[DeviceSpec], args) -> int:
+    end = _end_time(args.end)
+    start = end - timedelta(days=args.days)
+    steps = int(args.days * 86400 // args.interval)
+    conn = await asyncpg.connect(dsn)
+    loaded = 0
+    try:
+        # Rows are generated valid; skip per-row foreign key checks where the role allows
+        try:
+            await conn.execute("SET session_replication_role = replica")
+        except asyncpg.InsufficientPrivilegeError:
+            pass
+        for spec in specs:
+            for batch in _batches(device_rows(spec, args, start, steps), args.batch):
+                await conn.copy_records_to_table("device_data", records=batch, columns=DATA_COLUMNS)
+                loaded += len(batch)
+    finally:
+        await conn.close()
+    return loaded
+
+
+def _load_worker(dsn: str, specs: List[DeviceSpec], args) -> int:
+    return asyncio.run(_load_devices(dsn, specs, args))
+
+
+async def load_catalog(conn: asyncpg.Connection, args, tenants, channels, devices):
+    """Organization, tenants, channels and devices (replaced with --reset)"""
+    if args.reset:
+        started = time.perf_counter()
+        await conn.execute("DELETE FROM organizations WHERE slug = $1", ORGANIZATION_SLUG)
+        print(f"removed the previous dataset in {time.perf_counter() - started:.1f}s")
+    elif await conn.fetchval("SELECT 1 FROM organizations WHERE slug = $1", ORGANIZATION_SLUG):
+        raise SystemExit(f"organization '{ORGANIZATION_SLUG}' already exists; rerun with --reset")
+
+    async with conn.transaction():
+        await conn.execute(
+            "INSERT INTO organizations (id, name, slug, status) VALUES ($1, 'Benchmark Dataset', $2, 'active')",
+            _id("organization"), ORGANIZATION_SLUG,
+        )
+        await conn.copy_records_to_table(
+            "tenants", records=tenants,
+            columns=["id", "organization_id", "name", "subdomain", "tier", "max_devices"],
+        )
+        await conn.copy_records_to_table("channels", records=channels, columns=["id", "tenant_id", "name", "description"])
+        await conn.copy_records_to_table(
+            "devices", records=devices,
+            columns=["id", "tenant_id", "channel_id", "name", "device_key", "device_secret", "status", "created_at"],
+        )
+    # Online devices were last seen at the end of the telemetry
+    await conn.execute(
+        """
+        UPDATE devices d SET last_seen = $2
+        FROM tenants t
+        WHERE d.tenant_id = t.id AND t.organization_id = $1 AND d.status = 'online'
+        """,
+        _id("organization"), _end_time(args.end),
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=os.environ.get("DATABASE_URL"), help="TimescaleDB DSN (default $DATABASE_URL)")
+    parser.add_argument("--tenants", type=int, default=5)
+    parser.add_argument("--channels", type=int, default=4, help="channels per tenant")
+    parser.add_argument("--devices", type=int, default=10, help="devices per channel")
+    parser.add_argument("--metrics", type=int, default=3, choices=range(1, len(METRICS) + 1), help="metrics per device")
+    parser.add_argument("--days", type=float, default=30.0, help="days of telemetry")
+    parser.add_argument("--interval", type=int, default=300, help="seconds between points per device and metric")
+    parser.add_argument("--end", help="end of the telemetry, ISO 8601 (default: the current hour)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="parallel loader processes")
+    parser.add_argument("--batch", type=int, default=100000, help="rows per COPY statement")
+    parser.add_argument("--reset", action="store_true", help="delete a previously seeded dataset first")
+    parser.add_argument("--refresh", action="store_true", help="refresh the hourly/daily rollups afterwards")
+    args = parser.parse_args(argv)
+    if not args.dsn:
+        parser.error("--dsn or DATABASE_URL is required")
+
+    tenants, channels, devices, specs = layout(args)
+    steps = int(args.days * 86400 // args.interval)
+    expected = len(specs) * steps * args.metrics
+    print(
+        f"{len(tenants)} tenants, {len(channels)} channels, {len(devices)} devices; "
+        f"{expected:,} data points over {args.days:g} days"
+    )
+
+    async def prepare():
+        conn = await asyncpg.connect(args.dsn)
+        try:
+            await load_catalog(conn, args, tenants, channels, devices)
+        finally:
+            await conn.close()
+
+    asyncio.run(prepare())
+
+    started = time.perf_counter()
+    jobs = max(1, min(args.jobs, len(specs)))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        loaded = sum(pool.map(_load_worker, [args.dsn] * jobs, [specs[i::jobs] for i in range(jobs)], [args] * jobs))
+    seconds = time.perf_counter() - started
+    print(f"loaded {loaded:,} data points in {seconds:.1f}s ({loaded / max(seconds, 1e-9):,.0f}/s)")
+
+    async def finish() -> Dict[str, Any]:
+        conn = await asyncpg.connect(args.dsn, command_timeout=None)
+        try:
+            timings = {}
+            started = time.perf_counter()
+            await conn.execute("ANALYZE devices")
+            await conn.execute("ANALYZE device_data")
+            timings["analyze"] = time.perf_counter() - started
+            if args.refresh:
+                started = time.perf_counter()
+                await conn.execute("SELECT refresh_device_data_aggregates()")
+                timings["refresh_rollups"] = time.perf_counter() - started
+            return timings
+        finally:
+            await conn.close()
+
+    for step, seconds in asyncio.run(finish()).items():
+        print(f"{step}: {seconds:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Startup Benchmark
+Import-time breakdown and time-to-first-request of an API worker
+
+Usage (from backend/, with the usual .env or environment variables):
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 10 --top 15 --json startup.json
+
+Import time comes from `python -X importtime -c "import main"` (median of
+--runs fresh interpreters). Time to first request starts a real uvicorn
+worker and polls /health (liveness) and /ready (pools and Supabase client
+warmed up) until each answers 200. /ready is reported as null if it does
+not become ready within --timeout, e.g. when no database is reachable.
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times() -> Tuple[float, Dict[str, float]]:
+    """One fresh interpreter: total import seconds of main and cumulative seconds per module"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules: Dict[str, float] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative) / 1e6
+    return modules.get("main", 0.0), modules
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for(url: str, started: float, timeout: float) -> Optional[float]:
+    while time.perf_counter() - started < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter() - started
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.01)
+    return None
+
+
+def first_request_times(timeout: float) -> Dict[str, Optional[float]]:
+    """Seconds from spawning uvicorn until /health and /ready first return 200"""
+    port = _free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        health = _wait_for(f"http://127.0.0.1:{port}/health", started, timeout)
+        ready = _wait_for(f"http://127.0.0.1:{port}/ready", started, timeout) if health else None
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+    return {"health_seconds": health, "ready_seconds": ready}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="interpreter runs for import timing")
+    parser.add_argument("--top", type=int, default=10, help="slowest top-level imports to list")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for /health and /ready")
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    args = parser.parse_args(argv)
+
+    totals, per_module = [], {}
+    for _ in range(args.runs):
+        total, modules = import_times()
+        totals.append(total)
+        for name, seconds in modules.items():
+            per_module.setdefault(name, []).append(seconds)
+
+    medians = {name: statistics.median(values) for name, values in per_module.items()}
+    # Top-level packages only, so nested modules are not double counted
+    top = sorted(
+        ((name, seconds) for name, seconds in medians.items() if "." not in name and name != "main"),
+        key=lambda item: item[1],
+        reverse=True,
+    )[: args.top]
+
+    results = {
+        "import_main_seconds": statistics.median(totals),
+        "slowest_imports": dict(top),
+        **first_request_times(args.timeout),
+    }
+
+    print(f"import main (median of {args.runs}): {results['import_main_seconds'] * 1000:.0f} ms")
+    for name, seconds in top:
+        print(f"  {name:<30} {seconds * 1000:8.1f} ms")
+    for key in ("health_seconds", "ready_seconds"):
+        value = results[key]
+        print(f"{key.replace('_seconds', ''):<8} first 200 after: {'n/a' if value is None else f'{value * 1000:.0f} ms'}")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
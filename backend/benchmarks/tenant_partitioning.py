@@ -0,0 +1,236 @@
+"""
+Tenant Partitioning Benchmark
+Per-tenant range-query latency before and after hash-partitioning device_data on tenant_id
+
+Usage (from backend/, against a scratch TimescaleDB database):
+    python benchmarks/tenant_partitioning.py --dsn postgresql://postgres@localhost/iotlinker_bench
+    python benchmarks/tenant_partitioning.py --tenants 50 --devices 20 --days 14 --json partitioning.json
+
+Seeds one synthetic multi-tenant dataset into two hypertables in a throwaway
+schema: "before" is partitioned by time only (the layout prior to migration
+20241213000012) and "after" is also hash-partitioned on tenant_id. Two query
+shapes run against each with the same random (tenant, device, window) draws:
+
+    device  one device's points in a time window; "before" filters on
+            device_id as the API used to, "after" adds tenant_id as the
+            query helpers now do
+    tenant  count/avg over all of a tenant's points in a time window
+
+Queries are planned with their actual parameters (plan_cache_mode =
+force_custom_plan), so chunk exclusion happens at plan time and the number
+of chunks each query touches can be read from EXPLAIN.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import asyncpg
+
+SCHEMA = "bench_partitioning"
+
+TABLE_DDL = """
+    CREATE TABLE {schema}.{table} (
+        time TIMESTAMPTZ NOT NULL,
+        device_id UUID NOT NULL,
+        tenant_id UUID NOT NULL,
+        metric_name VARCHAR(100) NOT NULL,
+        value DOUBLE PRECISION,
+        PRIMARY KEY ({key})
+    )
+"""
+
+# Deterministic ids: md5 of a label is a valid uuid literal
+SEED_QUERY = """
+    INSERT INTO {schema}.before (time, device_id, tenant_id, metric_name, value)
+    SELECT
+        ts,
+        md5('device:' || t || ':' || d)::uuid,
+        md5('tenant:' || t)::uuid,
+        'temperature',
+        20 + 10 * sin(extract(epoch FROM ts) / 3600 + d)
+    FROM generate_series(1, $1) AS t,
+        generate_series(1, $2) AS d,
+        generate_series($3::timestamptz, $4::timestamptz - interval '1 second', make_interval(secs => $5)) AS ts
+"""
+
+# (shape, layout) -> (SQL, draw fields bound to $1..$n)
+QUERIES = {
+    ("device", "before"): ("""
+        SELECT time, value FROM {schema}.before
+        WHERE device_id = $1 AND time >= $2 AND time < $3
+        ORDER BY time
+    """, ("device", "lo", "hi")),
+    ("device", "after"): ("""
+        SELECT time, value FROM {schema}.after
+        WHERE tenant_id = $1 AND device_id = $2 AND time >= $3 AND time < $4
+        ORDER BY time
+    """, ("tenant", "device", "lo", "hi")),
+    ("tenant", "before"): ("""
+        SELECT COUNT(*), AVG(value) FROM {schema}.before
+        WHERE tenant_id = $1 AND time >= $2 AND time < $3
+    """, ("tenant", "lo", "hi")),
+    ("tenant", "after"): ("""
+        SELECT COUNT(*), AVG(value) FROM {schema}.after
+        WHERE tenant_id = $1 AND time >= $2 AND time < $3
+    """, ("tenant", "lo", "hi")),
+}
+
+
+async def seed(conn: asyncpg.Connection, args) -> Tuple[datetime, datetime, int]:
+    """Create both layouts and load the dataset; returns (start, end, rows)"""
+    end = datetime(2024, 12, 1, tzinfo=timezone.utc)
+    start = end - timedelta(days=args.days)
+
+    await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    await conn.execute(f"CREATE SCHEMA {SCHEMA}")
+    await conn.execute(TABLE_DDL.format(schema=SCHEMA, table="before", key="device_id, time, metric_name"))
+    await conn.execute(TABLE_DDL.format(schema=SCHEMA, table="after", key="device_id, time, metric_name, tenant_id"))
+    await conn.execute(
+        "SELECT create_hypertable($1, 'time', chunk_time_interval => INTERVAL '1 day')",
+        f"{SCHEMA}.before",
+    )
+    await conn.execute(
+        """
+        SELECT create_hypertable($1, 'time', partitioning_column => 'tenant_id',
+            number_partitions => $2, chunk_time_interval => INTERVAL '1 day')
+        """,
+        f"{SCHEMA}.after",
+        args.partitions,
+    )
+    for table in ("before", "after"):
+        await conn.execute(f"CREATE INDEX ON {SCHEMA}.{table} (device_id, time DESC)")
+        await conn.execute(f"CREATE INDEX ON {SCHEMA}.{table} (tenant_id, time DESC)")
+
+    await conn.execute(
+        SEED_QUERY.format(schema=SCHEMA), args.tenants, args.devices, start, end, args.interval
+    )
+    await conn.execute(f"INSERT INTO {SCHEMA}.after SELECT * FROM {SCHEMA}.before")
+    await conn.execute(f"ANALYZE {SCHEMA}.before")
+    await conn.execute(f"ANALYZE {SCHEMA}.after")
+    rows = await conn.fetchval(f"SELECT COUNT(*) FROM {SCHEMA}.before")
+    return start, end, rows
+
+
+def _draws(args, start: datetime, end: datetime) -> List[Tuple[str, str, datetime, datetime]]:
+    """Random (tenant, device, window start, window end) draws, identical for both layouts"""
+    rng = random.Random(args.seed)
+    window = timedelta(hours=args.window_hours)
+    span = (end - start - window).total_seconds()
+    draws = []
+    for _ in range(args.queries):
+        tenant, device = rng.randint(1, args.tenants), rng.randint(1, args.devices)
+        lo = start + timedelta(seconds=rng.uniform(0, span))
+        draws.append((f"tenant:{tenant}", f"device:{tenant}:{device}", lo, lo + window))
+    return draws
+
+
+async def _ids(conn: asyncpg.Connection, labels: List[str]) -> Dict[str, Any]:
+    rows = await conn.fetch("SELECT label, md5(label)::uuid AS id FROM unnest($1::text[]) AS label", labels)
+    return {row["label"]: row["id"] for row in rows}
+
+
+def _chunks_in_plan(node: Dict[str, Any]) -> int:
+    count = 1 if node.get("Relation Name", "").startswith("_hyper") else 0
+    return count + sum(_chunks_in_plan(child) for child in node.get("Plans", ()))
+
+
+async def measure(conn: asyncpg.Connection, shape: str, layout: str, draws, ids) -> Dict[str, float]:
+    """Latency percentiles (ms) and mean chunks touched for one query shape and layout"""
+    query, fields = QUERIES[(shape, layout)]
+    query = query.format(schema=SCHEMA)
+    params = []
+    for tenant, device, lo, hi in draws:
+        values = {"tenant": ids[tenant], "device": ids[device], "lo": lo, "hi": hi}
+        params.append([values[field] for field in fields])
+
+    for args in params[:10]:
+        await conn.fetch(query, *args)
+
+    latencies = []
+    for args in params:
+        started = time.perf_counter()
+        await conn.fetch(query, *args)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    chunks = []
+    for args in params[:20]:
+        plan = json.loads(await conn.fetchval("EXPLAIN (FORMAT JSON) " + query, *args))
+        chunks.append(_chunks_in_plan(plan[0]["Plan"]))
+
+    latencies.sort()
+    return {
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 3),
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "chunks_per_query": round(statistics.fmean(chunks), 1),
+    }
+
+
+async def run(args) -> Dict[str, Any]:
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        await conn.execute("SET plan_cache_mode = force_custom_plan")
+        seeded = time.perf_counter()
+        start, end, rows = await seed(conn, args)
+        seed_seconds = time.perf_counter() - seeded
+
+        draws = _draws(args, start, end)
+        ids = await _ids(conn, sorted({label for draw in draws for label in draw[:2]}))
+        results: Dict[str, Any] = {
+            "rows": rows,
+            "seed_seconds": round(seed_seconds, 1),
+            "tenants": args.tenants,
+            "partitions": args.partitions,
+        }
+        for shape in ("device", "tenant"):
+            for layout in ("before", "after"):
+                results[f"{shape}_{layout}"] = await measure(conn, shape, layout, draws, ids)
+        return results
+    finally:
+        if not args.keep:
+            await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await conn.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=os.environ.get("DATABASE_URL"), help="TimescaleDB DSN (default $DATABASE_URL)")
+    parser.add_argument("--tenants", type=int, default=20)
+    parser.add_argument("--devices", type=int, default=10, help="devices per tenant")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--interval", type=int, default=300, help="seconds between points per device")
+    parser.add_argument("--partitions", type=int, default=4, help="tenant_id hash partitions (migration uses 4)")
+    parser.add_argument("--queries", type=int, default=200, help="queries per shape and layout")
+    parser.add_argument("--window-hours", type=float, default=24.0, help="time window per query")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help=f"keep the {SCHEMA} schema afterwards")
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    args = parser.parse_args(argv)
+    if not args.dsn:
+        parser.error("--dsn or DATABASE_URL is required")
+
+    results = asyncio.run(run(args))
+
+    print(f"{results['rows']} rows, {args.tenants} tenants, {args.partitions} partitions (seeded in {results['seed_seconds']}s)")
+    print(f"{'query':<16} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9} {'chunks':>7}")
+    for shape in ("device", "tenant"):
+        for layout in ("before", "after"):
+            r = results[f"{shape}_{layout}"]
+            print(f"{shape + ' ' + layout:<16} {r['p50_ms']:>9.3f} {r['p95_ms']:>9.3f} {r['mean_ms']:>9.3f} {r['chunks_per_query']:>7.1f}")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
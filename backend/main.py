@@ -1,22 +1,91 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 from contextlib import asynccontextmanager
 
 from app.config import settings, CORS_ORIGINS
-from app.database import init_db_pool, close_db_pool
+from app.database import start_warm_up, close_db_pool, get_pool_stats, get_readiness, replica as replica_monitor
+from app.statements import statements
+from app.cache import get_cache_stats
+from app.services.hot_window import hot_window
+from app.services.bulk_update import runner as bulk_jobs
+from app.invalidation import listener as invalidation_listener
+from app.audit import audit_log
+from app.auth import authenticate, last_used as token_last_used
+from app.metrics import registry as metrics_registry, MetricsMiddleware, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from app.profiling import ProfilingMiddleware
+from app.ratelimit import LoadSheddingMiddleware
+from app.jobs import scheduler, job_queue
 from app.api.v1.channels import router as channels_router
 from app.api.v1.alerts import router as alerts_router
 from app.api.v1.insights import router as insights_router
 from app.api.v1.devices import router as devices_router
+from app.api.v1.tokens import router as tokens_router
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan events"""
-    # Startup: Initialize database connection pool
-    await init_db_pool()
+    # Startup: Open pools and the Supabase client in the background, so the
+    # worker answers /health at once (/ready reports when warm-up is done)
+    start_warm_up()
+    # Startup: Check the read replica's health and lag (if configured)
+    replica_monitor.start()
+    # Startup: Listen for other workers' cache invalidations
+    if settings.INVALIDATION_ENABLED:
+        invalidation_listener.start()
+    # Startup: Flush audit events in the background
+    if settings.AUDIT_ENABLED:
+        audit_log.start()
+    # Startup: Batch API token last_used_at writes
+    token_last_used.start()
+    # Startup: Run queued deferred work (webhook deliveries), including jobs
+    # left over from before a restart
+    job_queue.start()
+    # Startup: Run bulk device updates, resuming any a stopped worker left running
+    bulk_jobs.start()
+    # Startup: Schedule background jobs
+    if settings.JOBS_ENABLED:
+        scheduler.add_job(
+            "predictive_maintenance",
+            "app.jobs.predictive_maintenance:run_predictive_maintenance",
+            interval_seconds=settings.PREDICTION_JOB_INTERVAL_MINUTES * 60,
+            initial_delay_seconds=60,
+        )
+        scheduler.add_job(
+            "retention",
+            "app.jobs.retention:run_retention_pipeline",
+            interval_seconds=settings.RETENTION_JOB_INTERVAL_MINUTES * 60,
+            initial_delay_seconds=300,
+        )
+        if settings.ROLLUP_REFRESH_INTERVAL_MINUTES > 0:
+            scheduler.add_job(
+                "rollup_refresh",
+                "app.jobs.rollups:run_rollup_refresh",
+                interval_seconds=settings.ROLLUP_REFRESH_INTERVAL_MINUTES * 60,
+                initial_delay_seconds=120,
+            )
+        if settings.ARCHIVE_ENABLED:
+            scheduler.add_job(
+                "archive",
+                "app.jobs.archive:run_archive",
+                interval_seconds=settings.ARCHIVE_JOB_INTERVAL_MINUTES * 60,
+                initial_delay_seconds=240,
+            )
+        scheduler.start()
     yield
-    # Shutdown: Close database connection pool
+    # Shutdown: Stop background jobs and the invalidation listener
+    await scheduler.stop()
+    await invalidation_listener.stop()
+    # Shutdown: Hand running queued jobs back to the queue file
+    await job_queue.stop()
+    # Shutdown: Record running bulk jobs' cursors and release them to other workers
+    await bulk_jobs.stop()
+    # Shutdown: Write queued audit events and token usage while the pools are still open
+    await audit_log.stop()
+    await token_last_used.stop()
+    await replica_monitor.stop()
+    # Shutdown: Close database connection pools (cancels an unfinished warm-up)
     await close_db_pool()
 
 
@@ -27,6 +96,9 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Adaptive load shedding (inside CORS so 503s still carry CORS headers)
+app.add_middleware(LoadSheddingMiddleware)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -36,6 +108,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-request query profiling (opt-in)
+if settings.PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
+# Request duration metrics (outermost, so CORS preflights are counted too)
+app.add_middleware(MetricsMiddleware)
+
 
 @app.get("/")
 def read_root():
@@ -61,11 +140,73 @@ async def global_exception_handler(request: Request, exc: Exception):
 
 @app.get("/health")
 def health_check():
+    """Liveness: the process is up and serving"""
     return {"status": "healthy"}
 
 
-# Include API routers
-app.include_router(devices_router)
-app.include_router(channels_router)
-app.include_router(alerts_router)
-app.include_router(insights_router)
\ No newline at end of file
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: pools and the Supabase client are initialised"""
+    readiness = get_readiness()
+    if not readiness["ready"]:
+        # Retry a failed warm-up on the next probe
+        start_warm_up()
+        return JSONResponse(status_code=503, content=readiness)
+    return readiness
+
+
+@app.get("/health/pools")
+def pool_stats():
+    return get_pool_stats()
+
+
+@app.get("/health/replica")
+def replica_status():
+    """Read replica health, lag and where reads went"""
+    return replica_monitor.get_status()
+
+
+@app.get("/health/statements")
+def statement_stats():
+    return statements.get_stats()
+
+
+@app.get("/health/caches")
+def cache_stats():
+    return {"caches": get_cache_stats(), "invalidation": invalidation_listener.get_status()}
+
+
+@app.get("/health/audit")
+def audit_stats():
+    return audit_log.get_status()
+
+
+@app.get("/health/jobs")
+async def job_stats(dead_letters: int = Query(20, ge=0, le=1000)):
+    """Scheduled jobs, the local job queue, bulk jobs and the most recent dead letters"""
+    return {
+        "scheduled": scheduler.get_status(),
+        "queue": job_queue.get_status(),
+        "bulk": bulk_jobs.get_status(),
+        "dead_letters": await job_queue.dead_letters(dead_letters),
+    }
+
+
+@app.get("/health/hot-window")
+def hot_window_stats(top: int = Query(20, ge=0, le=1000)):
+    """Hot-window totals and the largest series by memory"""
+    return hot_window.get_stats(top)
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return Response(metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+# Include API routers (API token auth; see app.auth)
+api_auth = [Depends(authenticate)]
+app.include_router(devices_router, dependencies=api_auth)
+app.include_router(channels_router, dependencies=api_auth)
+app.include_router(alerts_router, dependencies=api_auth)
+app.include_router(insights_router, dependencies=api_auth)
+app.include_router(tokens_router, dependencies=api_auth)
\ No newline at end of file
@@ -0,0 +1,17 @@
+"""
+Test Configuration
+Settings for importing the app without a .env (nothing here connects to a database)
+"""
+
+import os
+import sys
+
+for name, value in {
+    "SUPABASE_URL": "http://localhost:54321",
+    "SUPABASE_ANON_KEY": "test",
+    "SUPABASE_SERVICE_KEY": "test",
+    "DATABASE_URL": "postgresql://test@localhost/test",
+}.items():
+    os.environ.setdefault(name, value)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,28 @@
+"""
+Backfill Record Parsing
+Binary records that cannot be stored are rejected one by one, not the whole upload
+"""
+
+import asyncio
+import struct
+
+from app.services.backfill import binary_records
+
+
+def _record(micros: int, name: bytes = b"temperature", value: float = 1.5, quality: int = 100) -> bytes:
+    return struct.pack("<qdBH", micros, value, quality, len(name)) + name
+
+
+async def _parse(body: bytes):
+    async def pieces():
+        yield body
+
+    return [row async for batch in binary_records(pieces()) for row in batch]
+
+
+def test_out_of_range_timestamp_is_rejected_per_record():
+    body = _record(1_700_000_000_000_000) + _record(2**63 - 1) + _record(-(2**63)) + _record(0)
+    rows = asyncio.run(_parse(body))
+    assert rows[1] == rows[2] == "timestamp: out of range"
+    assert rows[0][0].year == 2023
+    assert rows[3][0].year == 1970
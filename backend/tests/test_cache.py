@@ -0,0 +1,40 @@
+"""
+Cache Suspension
+Only caches relying on invalidations are affected while the LISTEN connection is down
+"""
+
+import pytest
+
+from app import cache, invalidation
+from app.cache import MISSING, TTLCache
+
+
+@pytest.fixture
+def outage():
+    cache.set_invalidations_live(False)
+    yield
+    cache.set_invalidations_live(True)
+
+
+def test_outage_suspends_only_subscribed_caches(outage):
+    subscribed = TTLCache("test_subscribed", 10, 60)
+    short = TTLCache("test_short", 10, 60, outage_ttl_seconds=5)
+    plain = TTLCache("test_plain", 10, 60)
+    invalidation.subscribe("test_entity", subscribed)
+    invalidation.subscribe("test_entity", short)
+
+    for c in (subscribed, short, plain):
+        c.set("key", "value")
+    assert subscribed.get("key") is MISSING
+    assert short.get("key") == "value"
+    assert plain.get("key") == "value"
+
+
+def test_outage_keeps_entries_of_plain_caches():
+    plain = TTLCache("test_plain_kept", 10, 60)
+    plain.set("key", "value")
+    cache.set_invalidations_live(False)
+    try:
+        assert plain.get("key") == "value"
+    finally:
+        cache.set_invalidations_live(True)
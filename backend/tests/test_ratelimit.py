@@ -0,0 +1,38 @@
+"""
+Token Buckets
+Batches are charged per point, including batches larger than the burst, and only once authenticated
+"""
+
+import pytest
+
+from app.config import settings
+from app.ratelimit import IngestLimiter, RateLimitedError, TokenBucket
+
+
+def test_batch_within_burst():
+    bucket = TokenBucket(rate=50, burst=500, now=0)
+    assert bucket.wait_time(400, 0) == 0
+    bucket.take(400)
+    assert bucket.wait_time(400, 0) == 300 / 50
+
+
+def test_batch_larger_than_burst_is_charged_in_full():
+    bucket = TokenBucket(rate=50, burst=500, now=0)
+    # Admitted from a full bucket, leaving a debt of 1500 points
+    assert bucket.wait_time(2000, 0) == 0
+    bucket.take(2000)
+    assert bucket.wait_time(1, 0) == 1501 / 50
+    # The next one waits for the debt to be paid and the bucket to refill
+    assert bucket.wait_time(2000, 10) == (500 + 1500 - 10 * 50) / 50
+
+
+def test_unauthenticated_batches_do_not_drain_the_device_bucket():
+    limiter = IngestLimiter()
+    burst = settings.RATE_LIMIT_DEVICE_BURST
+    # Pre-authentication checks only look at the global bucket
+    for _ in range(10):
+        limiter.check_global(burst)
+    limiter.admit("device", "tenant", burst)
+    with pytest.raises(RateLimitedError) as e:
+        limiter.admit("device", "tenant", burst)
+    assert e.value.status_code == 429
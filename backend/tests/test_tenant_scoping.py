@@ -0,0 +1,99 @@
+"""
+Tenant Scoping
+A token of one tenant must not reach another tenant's devices, channels or tokens
+"""
+
+from uuid import uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from app import auth
+from app.api.v1 import devices
+from app.auth import TokenPrincipal
+
+TENANT_A = str(uuid4())
+TENANT_B = str(uuid4())
+DEVICE_B = str(uuid4())
+CHANNEL_B = str(uuid4())
+
+
+class _Unreachable:
+    """Stands in for the database clients; any use fails the test"""
+
+    def __getattr__(self, name):
+        raise AssertionError(f"{name} used after a cross-tenant request should have been rejected")
+
+
+class _Rows:
+    """Minimal supabase query builder returning fixed rows"""
+
+    def __init__(self, rows):
+        self.data = rows
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        return self
+
+
+class _Supabase:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def table(self, name):
+        return _Rows(self.rows)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    principal = TokenPrincipal(
+        token_id=str(uuid4()), tenant_id=TENANT_A, user_id=None, scopes=frozenset(), expires_at=None
+    )
+
+    async def verify_token(token):
+        return principal
+
+    device = {"id": DEVICE_B, "tenant_id": TENANT_B, "device_key": "k", "channel_id": CHANNEL_B, "device_type_id": None}
+    monkeypatch.setattr(auth, "verify_token", verify_token)
+    monkeypatch.setattr(devices, "_get_ingest_device", lambda supabase, device_id: device)
+    monkeypatch.setattr(devices, "get_supabase", lambda: _Unreachable())
+    monkeypatch.setattr(devices, "get_db_connection", _Unreachable())
+    monkeypatch.setattr(devices, "get_read_connection", _Unreachable())
+    return TestClient(main.app, headers={"Authorization": "Bearer iotl_test"})
+
+
+@pytest.mark.parametrize("method, path", [
+    ("PUT", f"/api/v1/devices/{DEVICE_B}"),
+    ("DELETE", f"/api/v1/devices/{DEVICE_B}"),
+    ("GET", f"/api/v1/devices/{DEVICE_B}/data"),
+    ("GET", f"/api/v1/devices/{DEVICE_B}/data/export"),
+    ("GET", f"/api/v1/devices/{DEVICE_B}/percentiles?metric_name=temperature"),
+])
+def test_device_path_of_another_tenant(client, method, path):
+    response = client.request(method, path, json={"name": "renamed"} if method == "PUT" else None)
+    assert response.status_code == 403
+
+
+def test_get_device_of_another_tenant(client, monkeypatch):
+    monkeypatch.setattr(devices, "get_supabase", lambda: _Supabase([{"id": DEVICE_B, "tenant_id": TENANT_B}]))
+    response = client.get(f"/api/v1/devices/{DEVICE_B}")
+    assert response.status_code == 403
+
+
+@pytest.mark.parametrize("path, body", [
+    ("/api/v1/devices/", {"tenant_id": TENANT_B, "channel_id": CHANNEL_B, "name": "sensor"}),
+    ("/api/v1/devices/bulk-update", {"selector": {"tenant_id": TENANT_B, "channel_id": CHANNEL_B}, "patch": {"status": "offline"}}),
+    ("/api/v1/channels/", {"tenant_id": TENANT_B, "name": "line 2"}),
+    ("/api/v1/tokens/", {"tenant_id": TENANT_B, "name": "ci"}),
+])
+def test_body_tenant_of_another_tenant(client, path, body):
+    response = client.post(path, json=body)
+    assert response.status_code == 403
+
+
+def test_query_tenant_of_another_tenant(client):
+    response = client.get(f"/api/v1/channels/{CHANNEL_B}", params={"tenant_id": TENANT_B})
+    assert response.status_code == 403
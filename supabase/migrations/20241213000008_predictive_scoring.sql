@@ -0,0 +1,24 @@
+-- =====================================================
+-- IoTLinker - Batch Predictive Maintenance Scoring
+-- Description: Upsert key for predictions and per-shard job checkpoints
+-- =====================================================
+
+-- One current prediction per device and prediction type, so the batch
+-- scoring job can bulk-upsert instead of appending a new row every run
+CREATE UNIQUE INDEX IF NOT EXISTS idx_predictions_device_type_unique
+ON predictions(device_id, prediction_type);
+
+-- Checkpoints for resumable batch jobs (one row per completed shard per run)
+CREATE TABLE IF NOT EXISTS job_checkpoints (
+    job_name VARCHAR(100) NOT NULL,
+    run_id VARCHAR(100) NOT NULL,
+    shard_key VARCHAR(255) NOT NULL,
+    completed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    stats JSONB DEFAULT '{}',
+    PRIMARY KEY (job_name, run_id, shard_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_job_checkpoints_completed_at
+ON job_checkpoints(completed_at DESC);
+
+COMMENT ON TABLE job_checkpoints IS 'Per-shard progress of resumable background jobs (e.g. predictive_maintenance)';
@@ -0,0 +1,166 @@
+-- =====================================================
+-- IoTLinker - Tiered Retention & Downsampling
+-- Description: Long-term rollup tiers, per-tenant retention policies and
+--              chunk-based retention (drop_chunks instead of row DELETE)
+-- =====================================================
+
+-- =====================================================
+-- LONG-TERM TIERS
+-- Note: device_data_hourly / device_data_daily are materialized views over
+-- device_data, so they lose history once raw chunks are dropped. These
+-- tables are the durable copies written before a chunk is dropped.
+-- =====================================================
+
+-- 1-minute tier
+CREATE TABLE IF NOT EXISTS device_data_1m (
+    bucket TIMESTAMPTZ NOT NULL,
+    device_id UUID NOT NULL REFERENCES devices(id) ON DELETE CASCADE,
+    tenant_id UUID NOT NULL REFERENCES tenants(id) ON DELETE CASCADE,
+    metric_name VARCHAR(100) NOT NULL,
+    avg_value DOUBLE PRECISION,
+    min_value DOUBLE PRECISION,
+    max_value DOUBLE PRECISION,
+    sample_count BIGINT NOT NULL,
+    avg_quality_score DOUBLE PRECISION,
+    PRIMARY KEY (device_id, metric_name, bucket)
+);
+
+SELECT create_hypertable(
+    'device_data_1m',
+    'bucket',
+    chunk_time_interval => INTERVAL '7 days',
+    if_not_exists => TRUE
+);
+
+CREATE INDEX IF NOT EXISTS idx_device_data_1m_tenant ON device_data_1m(tenant_id, bucket DESC);
+
+-- 1-hour tier
+CREATE TABLE IF NOT EXISTS device_data_1h (
+    bucket TIMESTAMPTZ NOT NULL,
+    device_id UUID NOT NULL REFERENCES devices(id) ON DELETE CASCADE,
+    tenant_id UUID NOT NULL REFERENCES tenants(id) ON DELETE CASCADE,
+    metric_name VARCHAR(100) NOT NULL,
+    avg_value DOUBLE PRECISION,
+    min_value DOUBLE PRECISION,
+    max_value DOUBLE PRECISION,
+    sample_count BIGINT NOT NULL,
+    avg_quality_score DOUBLE PRECISION,
+    PRIMARY KEY (device_id, metric_name, bucket)
+);
+
+CREATE INDEX IF NOT EXISTS idx_device_data_1h_tenant ON device_data_1h(tenant_id, bucket DESC);
+
+-- =====================================================
+-- PER-TENANT RETENTION POLICIES
+-- Tenants without a row use the application defaults
+-- (RETENTION_RAW_DAYS / RETENTION_MINUTE_DAYS / RETENTION_HOURLY_DAYS)
+-- =====================================================
+
+CREATE TABLE IF NOT EXISTS retention_policies (
+    tenant_id UUID PRIMARY KEY REFERENCES tenants(id) ON DELETE CASCADE,
+    raw_days INTEGER NOT NULL DEFAULT 30 CHECK (raw_days > 0),
+    minute_days INTEGER DEFAULT 180 CHECK (minute_days IS NULL OR minute_days > 0),
+    hourly_days INTEGER CHECK (hourly_days IS NULL OR hourly_days > 0), -- NULL = keep forever
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE TRIGGER update_retention_policies_updated_at BEFORE UPDATE ON retention_policies
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+-- =====================================================
+-- DOWNSAMPLING
+-- =====================================================
+
+-- Roll raw rows in [p_start, p_end) into the 1-minute and 1-hour tiers.
+-- Chunks are 1-day aligned, so buckets never straddle a chunk and the
+-- upsert can simply overwrite, which keeps re-runs idempotent.
+-- Returns the number of raw rows covered.
+CREATE OR REPLACE FUNCTION downsample_device_data(
+    p_start TIMESTAMPTZ,
+    p_end TIMESTAMPTZ
+)
+RETURNS BIGINT AS $$
+DECLARE
+    raw_rows BIGINT;
+BEGIN
+    INSERT INTO device_data_1m (
+        bucket, device_id, tenant_id, metric_name,
+        avg_value, min_value, max_value, sample_count, avg_quality_score
+    )
+    SELECT
+        time_bucket('1 minute', time), device_id, tenant_id, metric_name,
+        AVG(value), MIN(value), MAX(value), COUNT(*), AVG(quality_score)
+    FROM device_data
+    WHERE time >= p_start AND time < p_end
+    GROUP BY 1, device_id, tenant_id, metric_name
+    ON CONFLICT (device_id, metric_name, bucket) DO UPDATE SET
+        avg_value = EXCLUDED.avg_value,
+        min_value = EXCLUDED.min_value,
+        max_value = EXCLUDED.max_value,
+        sample_count = EXCLUDED.sample_count,
+        avg_quality_score = EXCLUDED.avg_quality_score;
+
+    INSERT INTO device_data_1h (
+        bucket, device_id, tenant_id, metric_name,
+        avg_value, min_value, max_value, sample_count, avg_quality_score
+    )
+    SELECT
+        time_bucket('1 hour', time), device_id, tenant_id, metric_name,
+        AVG(value), MIN(value), MAX(value), COUNT(*), AVG(quality_score)
+    FROM device_data
+    WHERE time >= p_start AND time < p_end
+    GROUP BY 1, device_id, tenant_id, metric_name
+    ON CONFLICT (device_id, metric_name, bucket) DO UPDATE SET
+        avg_value = EXCLUDED.avg_value,
+        min_value = EXCLUDED.min_value,
+        max_value = EXCLUDED.max_value,
+        sample_count = EXCLUDED.sample_count,
+        avg_quality_score = EXCLUDED.avg_quality_score;
+
+    SELECT COALESCE(SUM(sample_count), 0) INTO raw_rows
+    FROM device_data_1h
+    WHERE bucket >= p_start AND bucket < p_end;
+
+    RETURN raw_rows;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =====================================================
+-- CHUNK-BASED CLEANUP
+-- Replaces the row-level DELETE version: expired chunks are downsampled
+-- and then dropped whole. Rows in a chunk that is only partly expired are
+-- kept until the whole chunk is past the horizon (at most one extra day).
+-- Materialized views are no longer refreshed here; run_device_data_maintenance
+-- already refreshes them once afterwards.
+-- =====================================================
+
+CREATE OR REPLACE FUNCTION cleanup_old_device_data(
+    retention_days INTEGER DEFAULT 90
+)
+RETURNS INTEGER AS $$
+DECLARE
+    horizon TIMESTAMPTZ := NOW() - (retention_days || ' days')::INTERVAL;
+    expired RECORD;
+    reclaimed BIGINT := 0;
+BEGIN
+    FOR expired IN
+        SELECT range_start, range_end
+        FROM timescaledb_information.chunks
+        WHERE hypertable_name = 'device_data' AND range_end <= horizon
+        ORDER BY range_start
+    LOOP
+        reclaimed := reclaimed + downsample_device_data(expired.range_start, expired.range_end);
+    END LOOP;
+
+    PERFORM drop_chunks('device_data', older_than => horizon);
+
+    RETURN reclaimed::INTEGER;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON TABLE device_data_1m IS '1-minute long-term tier, written before raw chunks are dropped';
+COMMENT ON TABLE device_data_1h IS '1-hour long-term tier, written before raw chunks are dropped';
+COMMENT ON TABLE retention_policies IS 'Per-tenant retention for raw data and downsampled tiers';
+COMMENT ON FUNCTION downsample_device_data IS 'Roll raw device_data in a time range into the 1m and 1h tiers';
+COMMENT ON FUNCTION cleanup_old_device_data IS 'Downsample and drop device_data chunks older than specified days (default 90)';
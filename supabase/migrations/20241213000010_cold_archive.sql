@@ -0,0 +1,21 @@
+-- =====================================================
+-- IoTLinker - Cold-Tier Parquet Archive
+-- Description: Manifest of device_data chunks exported to Parquet
+-- Note: TimescaleDB compression is not available under the Apache license,
+-- so old chunks are exported to columnar files and dropped instead.
+-- =====================================================
+
+-- One row per archived file (partitioned by tenant and day)
+CREATE TABLE IF NOT EXISTS device_data_archive (
+    tenant_id UUID NOT NULL REFERENCES tenants(id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    uri TEXT NOT NULL,
+    row_count BIGINT NOT NULL DEFAULT 0,
+    size_bytes BIGINT NOT NULL DEFAULT 0,
+    archived_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (tenant_id, day, uri)
+);
+
+CREATE INDEX IF NOT EXISTS idx_device_data_archive_day ON device_data_archive(day DESC);
+
+COMMENT ON TABLE device_data_archive IS 'Parquet files holding device_data chunks dropped from the hypertable';
@@ -0,0 +1,24 @@
+-- =====================================================
+-- IoTLinker - Bulk Device Operations
+-- Description: Progress tracking for chunked fleet-wide device updates
+-- =====================================================
+
+-- One row per bulk job; any API worker can report progress from it
+CREATE TABLE IF NOT EXISTS bulk_jobs (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    tenant_id UUID NOT NULL REFERENCES tenants(id) ON DELETE CASCADE,
+    kind VARCHAR(50) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'running' CHECK (status IN ('running', 'completed', 'failed')),
+    request JSONB NOT NULL DEFAULT '{}',
+    total BIGINT,
+    processed BIGINT NOT NULL DEFAULT 0,
+    cursor_id UUID, -- last device id processed (keyset position, for resuming)
+    error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    finished_at TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS idx_bulk_jobs_tenant_created ON bulk_jobs(tenant_id, created_at DESC);
+
+COMMENT ON TABLE bulk_jobs IS 'Chunked bulk operations on devices (e.g. fleet-wide configuration rollouts)';
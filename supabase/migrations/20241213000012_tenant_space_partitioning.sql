@@ -0,0 +1,262 @@
+-- =====================================================
+-- IoTLinker - Tenant Space Partitioning
+-- Description: Hash-partition device_data by tenant_id in addition to time
+-- =====================================================
+-- TimescaleDB can only add a space dimension to an empty hypertable, so the
+-- partitioned layout is built next to the existing one and swapped in:
+--
+--   1. This migration creates device_data_by_tenant (1-day time chunks x
+--      4 tenant_id hash partitions) and a trigger mirroring every new
+--      device_data row into it.
+--   2. CALL backfill_device_data_by_tenant(); (outside a transaction block)
+--      copies existing chunks one at a time, committing after each. It can
+--      be interrupted and re-run.
+--   3. SELECT swap_device_data_by_tenant(); renames the tables in one short
+--      transaction and recreates the dependent views.
+--
+-- Installations without any device_data chunk are swapped at the end of
+-- this migration directly.
+-- The old table is kept as device_data_unpartitioned until dropped by hand.
+--
+-- A tenant's rows live in a single partition per day, so per-tenant range
+-- queries only scan that tenant's chunks, provided they filter on tenant_id
+-- (the API query helpers always do).
+-- =====================================================
+
+-- Unique indexes on a space-partitioned hypertable must include every
+-- partitioning column, so tenant_id is appended to the primary key. A device
+-- belongs to exactly one tenant, so uniqueness is unchanged.
+CREATE TABLE IF NOT EXISTS device_data_by_tenant (
+    time TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    device_id UUID NOT NULL REFERENCES devices(id) ON DELETE CASCADE,
+    tenant_id UUID NOT NULL REFERENCES tenants(id) ON DELETE CASCADE,
+    metric_name VARCHAR(100) NOT NULL,
+    value DOUBLE PRECISION,
+    unit VARCHAR(50),
+    metadata JSONB DEFAULT '{}',
+    quality_score INTEGER DEFAULT 100 CHECK (quality_score >= 0 AND quality_score <= 100),
+    PRIMARY KEY (device_id, time, metric_name, tenant_id)
+);
+
+-- 4 partitions keep the chunk count per day low while still cutting a
+-- tenant's scan to about a quarter of the day's rows.
+SELECT create_hypertable(
+    'device_data_by_tenant',
+    'time',
+    partitioning_column => 'tenant_id',
+    number_partitions => 4,
+    chunk_time_interval => INTERVAL '1 day',
+    if_not_exists => TRUE
+);
+
+CREATE INDEX IF NOT EXISTS idx_device_data_by_tenant_device_time ON device_data_by_tenant(device_id, time DESC);
+CREATE INDEX IF NOT EXISTS idx_device_data_by_tenant_tenant_time ON device_data_by_tenant(tenant_id, time DESC);
+CREATE INDEX IF NOT EXISTS idx_device_data_by_tenant_metric_time ON device_data_by_tenant(metric_name, time DESC);
+
+-- Same policies as device_data (see enable_rls); they follow the table on rename
+ALTER TABLE device_data_by_tenant ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY device_data_tenant_isolation ON device_data_by_tenant
+    FOR SELECT
+    USING (tenant_id = get_current_tenant_id());
+
+CREATE POLICY device_data_insert ON device_data_by_tenant
+    FOR INSERT
+    WITH CHECK (
+        tenant_id = get_current_tenant_id() AND
+        EXISTS (
+            SELECT 1 FROM devices d
+            WHERE d.id = device_data_by_tenant.device_id
+                AND d.tenant_id = device_data_by_tenant.tenant_id
+        )
+    );
+
+CREATE POLICY device_data_admin_update ON device_data_by_tenant
+    FOR UPDATE
+    USING (is_admin());
+
+CREATE POLICY device_data_admin_delete ON device_data_by_tenant
+    FOR DELETE
+    USING (is_admin());
+
+-- =====================================================
+-- MIRRORING AND BACKFILL
+-- =====================================================
+
+-- Copies new rows while the backfill runs. device_data is insert-only for
+-- users; admin updates/deletes made during the migration window are not
+-- mirrored.
+CREATE OR REPLACE FUNCTION mirror_device_data_by_tenant()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO device_data_by_tenant VALUES (NEW.*)
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+DROP TRIGGER IF EXISTS trg_mirror_device_data_by_tenant ON device_data;
+CREATE TRIGGER trg_mirror_device_data_by_tenant
+    AFTER INSERT ON device_data
+    FOR EACH ROW EXECUTE FUNCTION mirror_device_data_by_tenant();
+
+-- Source chunks already copied (by chunk time range)
+CREATE TABLE IF NOT EXISTS device_data_repartition_progress (
+    range_start TIMESTAMPTZ PRIMARY KEY,
+    range_end TIMESTAMPTZ NOT NULL,
+    row_count BIGINT NOT NULL DEFAULT 0,
+    copied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Copy every not yet copied device_data chunk, oldest first, one
+-- transaction per chunk. Rows inserted after a chunk was copied reach the
+-- new table through the mirror trigger, so a copied chunk stays complete.
+CREATE OR REPLACE PROCEDURE backfill_device_data_by_tenant()
+LANGUAGE plpgsql AS $$
+DECLARE
+    c RECORD;
+    copied BIGINT;
+BEGIN
+    FOR c IN
+        SELECT ch.range_start, ch.range_end
+        FROM timescaledb_information.chunks ch
+        WHERE ch.hypertable_name = 'device_data'
+            AND NOT EXISTS (
+                SELECT 1 FROM device_data_repartition_progress p
+                WHERE p.range_start = ch.range_start
+            )
+        ORDER BY ch.range_start
+    LOOP
+        INSERT INTO device_data_by_tenant
+        SELECT * FROM device_data
+        WHERE time >= c.range_start AND time < c.range_end
+        ON CONFLICT DO NOTHING;
+        GET DIAGNOSTICS copied = ROW_COUNT;
+
+        INSERT INTO device_data_repartition_progress (range_start, range_end, row_count)
+        VALUES (c.range_start, c.range_end, copied);
+        RAISE NOTICE 'Copied % rows for [%, %)', copied, c.range_start, c.range_end;
+        COMMIT;
+    END LOOP;
+END;
+$$;
+
+-- =====================================================
+-- SWAP
+-- =====================================================
+
+-- Rename the partitioned table into place. Fails (and changes nothing) while
+-- any source chunk is still uncopied. The materialized views are recreated
+-- empty, with the indexes of 20241213000002 (the tenant/bucket ones serve
+-- the tenant summaries and the predictive feature windows);
+-- refresh_device_data_aggregates() populates them on its next run.
+CREATE OR REPLACE FUNCTION swap_device_data_by_tenant()
+RETURNS void AS $$
+DECLARE
+    missing INTEGER;
+BEGIN
+    LOCK TABLE device_data IN ACCESS EXCLUSIVE MODE;
+
+    SELECT COUNT(*) INTO missing
+    FROM timescaledb_information.chunks ch
+    WHERE ch.hypertable_name = 'device_data'
+        AND NOT EXISTS (
+            SELECT 1 FROM device_data_repartition_progress p
+            WHERE p.range_start = ch.range_start
+        );
+    IF missing > 0 THEN
+        RAISE EXCEPTION '% device_data chunks not copied yet; run CALL backfill_device_data_by_tenant() first', missing;
+    END IF;
+
+    DROP TRIGGER IF EXISTS trg_mirror_device_data_by_tenant ON device_data;
+    DROP MATERIALIZED VIEW IF EXISTS device_data_hourly;
+    DROP MATERIALIZED VIEW IF EXISTS device_data_daily;
+
+    ALTER TABLE device_data RENAME TO device_data_unpartitioned;
+    ALTER INDEX IF EXISTS idx_device_data_device_time RENAME TO idx_device_data_unpartitioned_device_time;
+    ALTER INDEX IF EXISTS idx_device_data_tenant_time RENAME TO idx_device_data_unpartitioned_tenant_time;
+    ALTER INDEX IF EXISTS idx_device_data_metric_time RENAME TO idx_device_data_unpartitioned_metric_time;
+
+    ALTER TABLE device_data_by_tenant RENAME TO device_data;
+    ALTER INDEX idx_device_data_by_tenant_device_time RENAME TO idx_device_data_device_time;
+    ALTER INDEX idx_device_data_by_tenant_tenant_time RENAME TO idx_device_data_tenant_time;
+    ALTER INDEX idx_device_data_by_tenant_metric_time RENAME TO idx_device_data_metric_time;
+
+    COMMENT ON TABLE device_data IS 'Time-series sensor data from IoT devices (TimescaleDB hypertable, space-partitioned by tenant_id)';
+    COMMENT ON TABLE device_data_unpartitioned IS 'Pre-partitioning device_data; drop once the swap is verified';
+
+    CREATE MATERIALIZED VIEW device_data_hourly AS
+    SELECT
+        time_bucket('1 hour', time) AS bucket,
+        device_id,
+        tenant_id,
+        metric_name,
+        AVG(value) AS avg_value,
+        MIN(value) AS min_value,
+        MAX(value) AS max_value,
+        COUNT(*) AS sample_count,
+        AVG(quality_score) AS avg_quality_score
+    FROM device_data
+    GROUP BY bucket, device_id, tenant_id, metric_name
+    WITH NO DATA;
+
+    CREATE UNIQUE INDEX idx_device_data_hourly_unique
+    ON device_data_hourly(bucket, device_id, tenant_id, metric_name);
+    CREATE INDEX idx_device_data_hourly_bucket ON device_data_hourly(bucket DESC);
+    CREATE INDEX idx_device_data_hourly_device ON device_data_hourly(device_id, bucket DESC);
+    CREATE INDEX idx_device_data_hourly_tenant ON device_data_hourly(tenant_id, bucket DESC);
+
+    CREATE MATERIALIZED VIEW device_data_daily AS
+    SELECT
+        time_bucket('1 day', time) AS bucket,
+        device_id,
+        tenant_id,
+        metric_name,
+        AVG(value) AS avg_value,
+        MIN(value) AS min_value,
+        MAX(value) AS max_value,
+        COUNT(*) AS sample_count,
+        AVG(quality_score) AS avg_quality_score
+    FROM device_data
+    GROUP BY bucket, device_id, tenant_id, metric_name
+    WITH NO DATA;
+
+    CREATE UNIQUE INDEX idx_device_data_daily_unique
+    ON device_data_daily(bucket, device_id, tenant_id, metric_name);
+    CREATE INDEX idx_device_data_daily_bucket ON device_data_daily(bucket DESC);
+    CREATE INDEX idx_device_data_daily_device ON device_data_daily(device_id, bucket DESC);
+    CREATE INDEX idx_device_data_daily_tenant ON device_data_daily(tenant_id, bucket DESC);
+END;
+$$ LANGUAGE plpgsql;
+
+-- CONCURRENTLY cannot refresh a view that was never populated (e.g. right
+-- after the swap), so the first refresh of each view is a plain one
+CREATE OR REPLACE FUNCTION refresh_device_data_aggregates()
+RETURNS void AS $$
+BEGIN
+    IF (SELECT ispopulated FROM pg_matviews WHERE matviewname = 'device_data_hourly') THEN
+        REFRESH MATERIALIZED VIEW CONCURRENTLY device_data_hourly;
+    ELSE
+        REFRESH MATERIALIZED VIEW device_data_hourly;
+    END IF;
+    IF (SELECT ispopulated FROM pg_matviews WHERE matviewname = 'device_data_daily') THEN
+        REFRESH MATERIALIZED VIEW CONCURRENTLY device_data_daily;
+    ELSE
+        REFRESH MATERIALIZED VIEW device_data_daily;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Fresh installations have nothing to copy
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM timescaledb_information.chunks WHERE hypertable_name = 'device_data'
+    ) THEN
+        PERFORM swap_device_data_by_tenant();
+    END IF;
+END;
+$$;
+
+COMMENT ON PROCEDURE backfill_device_data_by_tenant IS 'Copy device_data chunks into the tenant-partitioned layout (resumable)';
+COMMENT ON FUNCTION swap_device_data_by_tenant IS 'Swap the tenant-partitioned hypertable in as device_data';
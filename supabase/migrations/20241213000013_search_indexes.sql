@@ -0,0 +1,44 @@
+-- =====================================================
+-- IoTLinker - Device and Channel Search
+-- Description: Trigram and prefix indexes replacing ILIKE '%term%' scans
+-- =====================================================
+-- pg_trgm GIN indexes serve ILIKE '%term%' (terms of 3+ characters),
+-- anchored ILIKE 'te%' and fuzzy word_similarity matches. btree_gin lets
+-- tenant_id sit in the same GIN index, so a search only visits the
+-- tenant's entries instead of intersecting with idx_devices_tenant_id.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+
+-- Text a device is searched by: name, description and metadata tags
+-- (metadata->'tags', e.g. ["boiler", "floor-2"]). IMMUTABLE so it can be
+-- indexed; queries must call it with the same arguments to use the index.
+CREATE OR REPLACE FUNCTION device_search_text(
+    p_name TEXT,
+    p_description TEXT,
+    p_metadata JSONB
+)
+RETURNS TEXT AS $$
+    SELECT lower(
+        p_name || ' ' || COALESCE(p_description, '') || ' ' || COALESCE(p_metadata->>'tags', '')
+    );
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+CREATE INDEX IF NOT EXISTS idx_devices_search_trgm
+ON devices USING GIN (tenant_id, device_search_text(name, description, metadata) gin_trgm_ops);
+
+-- Also used by PostgREST's ilike on name (GET /devices?search=)
+CREATE INDEX IF NOT EXISTS idx_devices_name_trgm
+ON devices USING GIN (tenant_id, name gin_trgm_ops);
+
+-- Prefix (type-ahead) lookups: lower(name) LIKE 'ter%' is a b-tree range scan
+CREATE INDEX IF NOT EXISTS idx_devices_tenant_name_prefix
+ON devices(tenant_id, lower(name) text_pattern_ops);
+
+CREATE INDEX IF NOT EXISTS idx_channels_name_trgm
+ON channels USING GIN (tenant_id, name gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_channels_description_trgm
+ON channels USING GIN (tenant_id, description gin_trgm_ops);
+
+COMMENT ON FUNCTION device_search_text IS 'Lower-cased name, description and metadata tags of a device (search index expression)';
@@ -0,0 +1,24 @@
+-- =====================================================
+-- IoTLinker - Store-and-Forward Backfill
+-- Description: Resumable upload sessions for buffered edge-device readings
+-- =====================================================
+
+-- One row per backfill upload. committed_records is the server-acknowledged
+-- offset: records of the (uncompressed) stream already written, advanced in
+-- the same transaction as each chunk of points, so an interrupted upload
+-- resumes exactly where it stopped.
+CREATE TABLE IF NOT EXISTS backfill_sessions (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    device_id UUID NOT NULL REFERENCES devices(id) ON DELETE CASCADE,
+    tenant_id UUID NOT NULL REFERENCES tenants(id) ON DELETE CASCADE,
+    status VARCHAR(20) NOT NULL DEFAULT 'open' CHECK (status IN ('open', 'completed')),
+    committed_records BIGINT NOT NULL DEFAULT 0,
+    stored_points BIGINT NOT NULL DEFAULT 0,
+    rejected_records BIGINT NOT NULL DEFAULT 0,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_backfill_sessions_device ON backfill_sessions(device_id, created_at DESC);
+
+COMMENT ON TABLE backfill_sessions IS 'Resumable store-and-forward uploads (committed_records = acknowledged offset)';
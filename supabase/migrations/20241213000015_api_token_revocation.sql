@@ -0,0 +1,35 @@
+-- =====================================================
+-- IoTLinker - API Token Revocation Notifications
+-- Description: Notify API workers when a token changes, so cached verifications are dropped at once
+-- =====================================================
+
+-- API workers cache verified tokens by token_hash (see app/auth.py) and
+-- listen on the cache invalidation channel. Any change that can revoke or
+-- re-scope a token, from the API or straight in SQL, publishes the token's
+-- hash there. last_used_at updates (batched by the API) do not fire it.
+CREATE OR REPLACE FUNCTION notify_api_token_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM pg_notify(
+            'iotlinker_invalidate',
+            json_build_object('entity', 'api_token', 'id', OLD.token_hash)::text
+        );
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM pg_notify(
+            'iotlinker_invalidate',
+            json_build_object('entity', 'api_token', 'id', NEW.token_hash)::text
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_api_tokens_notify ON api_tokens;
+CREATE TRIGGER trg_api_tokens_notify
+AFTER INSERT OR DELETE OR UPDATE OF token_hash, tenant_id, user_id, scopes, expires_at, is_active
+ON api_tokens
+FOR EACH ROW EXECUTE FUNCTION notify_api_token_change();
+
+COMMENT ON FUNCTION notify_api_token_change IS 'Publishes api_token invalidations for cached token verifications';
@@ -0,0 +1,27 @@
+-- =====================================================
+-- IoTLinker - Device Type Schema Notifications
+-- Description: Notify API workers when a device type changes, so compiled sensor_schema validators are rebuilt
+-- =====================================================
+
+-- API workers compile each device type's sensor_schema once and cache the
+-- validator by device type id (see app/services/sensor_schema.py). Device
+-- types are edited in SQL or the dashboard, not through the API, so the
+-- table publishes its own invalidations on the cache invalidation channel.
+CREATE OR REPLACE FUNCTION notify_device_type_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify(
+        'iotlinker_invalidate',
+        json_build_object('entity', 'device_type', 'id', OLD.id)::text
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_device_types_notify ON device_types;
+CREATE TRIGGER trg_device_types_notify
+AFTER DELETE OR UPDATE OF sensor_schema
+ON device_types
+FOR EACH ROW EXECUTE FUNCTION notify_device_type_change();
+
+COMMENT ON FUNCTION notify_device_type_change IS 'Publishes device_type invalidations for cached sensor_schema validators';
@@ -0,0 +1,293 @@
+-- =====================================================
+-- IoTLinker - Rollup Percentile Sketches
+-- Description: Mergeable DDSketch quantile sketches per bucket in the hourly/daily
+--              rollups and the 1-hour tier, so percentiles over any range need no raw scan
+-- =====================================================
+
+-- =====================================================
+-- SKETCH ENCODING
+-- A DDSketch with 1% relative accuracy (alpha = 0.01): values fall into
+-- logarithmic bins of ratio gamma = (1 + alpha) / (1 - alpha), so any
+-- quantile read back from the bins is within 1% of the exact value.
+-- Sketches of the same metric merge by adding bin counts, across buckets
+-- and devices alike. app/services/ddsketch.py decodes and merges them and
+-- must agree with these functions (same gamma, key bias and layout).
+--
+-- Key of a value:  0 for |v| < 1e-9, else
+--                  sign(v) * (ceil(ln|v| / ln(gamma)) + 2048)
+-- Encoding:        one version byte (1), then per non-empty bin in key
+--                  order an int4 key and an int4 count, big-endian.
+-- A bucket holds a few dozen bins for typical sensor ranges (a factor of 2
+-- between its smallest and largest value is 35 bins, 281 bytes).
+-- =====================================================
+
+-- Bin key of a value (NULL for NaN and infinities, which are not sketched)
+CREATE OR REPLACE FUNCTION ddsketch_key(v DOUBLE PRECISION)
+RETURNS INTEGER AS $$
+    SELECT CASE
+        WHEN v = 'NaN'::float8 OR v = 'Infinity'::float8 OR v = '-Infinity'::float8 THEN NULL
+        WHEN abs(v) < 1e-9 THEN 0
+        ELSE (sign(v) * (ceil(ln(abs(v)) / 0.020000666706669435::float8) + 2048))::integer
+    END
+$$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE;
+
+-- One encoded bin; sketches are '\x01'::bytea || string_agg(ddsketch_entry(...) ORDER BY key)
+CREATE OR REPLACE FUNCTION ddsketch_entry(sketch_key INTEGER, sample_count BIGINT)
+RETURNS BYTEA AS $$
+    SELECT int4send(sketch_key) || int4send(sample_count::integer)
+$$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE;
+
+-- =====================================================
+-- ROLLUP VIEWS
+-- Recreated with a value_sketch column. Rows are first grouped per bin,
+-- then per bucket, so avg/min/max/count come out as before. The indexes of
+-- 20241213000002 are recreated alongside a per-series one for the
+-- percentile queries. The views are created empty;
+-- refresh_device_data_aggregates() (run by the API's rollup_refresh job)
+-- populates them.
+-- =====================================================
+
+CREATE OR REPLACE FUNCTION create_device_data_rollups()
+RETURNS void AS $$
+BEGIN
+    DROP MATERIALIZED VIEW IF EXISTS device_data_hourly;
+    DROP MATERIALIZED VIEW IF EXISTS device_data_daily;
+
+    CREATE MATERIALIZED VIEW device_data_hourly AS
+    WITH bins AS (
+        SELECT
+            time_bucket('1 hour', time) AS bucket,
+            device_id,
+            tenant_id,
+            metric_name,
+            ddsketch_key(value) AS sketch_key,
+            SUM(value) AS value_sum,
+            COUNT(value) AS value_count,
+            MIN(value) AS min_value,
+            MAX(value) AS max_value,
+            COUNT(*) AS sample_count,
+            SUM(quality_score) AS quality_sum,
+            COUNT(quality_score) AS quality_count
+        FROM device_data
+        GROUP BY 1, device_id, tenant_id, metric_name, 5
+    )
+    SELECT
+        bucket,
+        device_id,
+        tenant_id,
+        metric_name,
+        SUM(value_sum) / NULLIF(SUM(value_count), 0)::float8 AS avg_value,
+        MIN(min_value) AS min_value,
+        MAX(max_value) AS max_value,
+        SUM(sample_count)::bigint AS sample_count,
+        SUM(quality_sum) / NULLIF(SUM(quality_count), 0) AS avg_quality_score,
+        '\x01'::bytea || string_agg(ddsketch_entry(sketch_key, sample_count), ''::bytea ORDER BY sketch_key) AS value_sketch
+    FROM bins
+    GROUP BY bucket, device_id, tenant_id, metric_name
+    WITH NO DATA;
+
+    CREATE UNIQUE INDEX idx_device_data_hourly_unique
+    ON device_data_hourly(bucket, device_id, tenant_id, metric_name);
+    CREATE INDEX idx_device_data_hourly_series
+    ON device_data_hourly(device_id, metric_name, bucket);
+    CREATE INDEX idx_device_data_hourly_bucket ON device_data_hourly(bucket DESC);
+    CREATE INDEX idx_device_data_hourly_device ON device_data_hourly(device_id, bucket DESC);
+    CREATE INDEX idx_device_data_hourly_tenant ON device_data_hourly(tenant_id, bucket DESC);
+
+    CREATE MATERIALIZED VIEW device_data_daily AS
+    WITH bins AS (
+        SELECT
+            time_bucket('1 day', time) AS bucket,
+            device_id,
+            tenant_id,
+            metric_name,
+            ddsketch_key(value) AS sketch_key,
+            SUM(value) AS value_sum,
+            COUNT(value) AS value_count,
+            MIN(value) AS min_value,
+            MAX(value) AS max_value,
+            COUNT(*) AS sample_count,
+            SUM(quality_score) AS quality_sum,
+            COUNT(quality_score) AS quality_count
+        FROM device_data
+        GROUP BY 1, device_id, tenant_id, metric_name, 5
+    )
+    SELECT
+        bucket,
+        device_id,
+        tenant_id,
+        metric_name,
+        SUM(value_sum) / NULLIF(SUM(value_count), 0)::float8 AS avg_value,
+        MIN(min_value) AS min_value,
+        MAX(max_value) AS max_value,
+        SUM(sample_count)::bigint AS sample_count,
+        SUM(quality_sum) / NULLIF(SUM(quality_count), 0) AS avg_quality_score,
+        '\x01'::bytea || string_agg(ddsketch_entry(sketch_key, sample_count), ''::bytea ORDER BY sketch_key) AS value_sketch
+    FROM bins
+    GROUP BY bucket, device_id, tenant_id, metric_name
+    WITH NO DATA;
+
+    CREATE UNIQUE INDEX idx_device_data_daily_unique
+    ON device_data_daily(bucket, device_id, tenant_id, metric_name);
+    CREATE INDEX idx_device_data_daily_series
+    ON device_data_daily(device_id, metric_name, bucket);
+    CREATE INDEX idx_device_data_daily_bucket ON device_data_daily(bucket DESC);
+    CREATE INDEX idx_device_data_daily_device ON device_data_daily(device_id, bucket DESC);
+    CREATE INDEX idx_device_data_daily_tenant ON device_data_daily(tenant_id, bucket DESC);
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT create_device_data_rollups();
+
+-- The tenant partitioning swap (if still to come) recreates the views
+-- through the same function, so they keep their sketches
+CREATE OR REPLACE FUNCTION swap_device_data_by_tenant()
+RETURNS void AS $$
+DECLARE
+    missing INTEGER;
+BEGIN
+    LOCK TABLE device_data IN ACCESS EXCLUSIVE MODE;
+
+    SELECT COUNT(*) INTO missing
+    FROM timescaledb_information.chunks ch
+    WHERE ch.hypertable_name = 'device_data'
+        AND NOT EXISTS (
+            SELECT 1 FROM device_data_repartition_progress p
+            WHERE p.range_start = ch.range_start
+        );
+    IF missing > 0 THEN
+        RAISE EXCEPTION '% device_data chunks not copied yet; run CALL backfill_device_data_by_tenant() first', missing;
+    END IF;
+
+    DROP TRIGGER IF EXISTS trg_mirror_device_data_by_tenant ON device_data;
+    DROP MATERIALIZED VIEW IF EXISTS device_data_hourly;
+    DROP MATERIALIZED VIEW IF EXISTS device_data_daily;
+
+    ALTER TABLE device_data RENAME TO device_data_unpartitioned;
+    ALTER INDEX IF EXISTS idx_device_data_device_time RENAME TO idx_device_data_unpartitioned_device_time;
+    ALTER INDEX IF EXISTS idx_device_data_tenant_time RENAME TO idx_device_data_unpartitioned_tenant_time;
+    ALTER INDEX IF EXISTS idx_device_data_metric_time RENAME TO idx_device_data_unpartitioned_metric_time;
+
+    ALTER TABLE device_data_by_tenant RENAME TO device_data;
+    ALTER INDEX idx_device_data_by_tenant_device_time RENAME TO idx_device_data_device_time;
+    ALTER INDEX idx_device_data_by_tenant_tenant_time RENAME TO idx_device_data_tenant_time;
+    ALTER INDEX idx_device_data_by_tenant_metric_time RENAME TO idx_device_data_metric_time;
+
+    COMMENT ON TABLE device_data IS 'Time-series sensor data from IoT devices (TimescaleDB hypertable, space-partitioned by tenant_id)';
+    COMMENT ON TABLE device_data_unpartitioned IS 'Pre-partitioning device_data; drop once the swap is verified';
+
+    PERFORM create_device_data_rollups();
+END;
+$$ LANGUAGE plpgsql;
+
+-- =====================================================
+-- 1-HOUR TIER
+-- Sketches outlive the raw chunks like the other tier columns. Buckets
+-- downsampled before this migration get theirs below where the raw rows
+-- still exist; the percentile endpoints report the others as unsketched.
+-- =====================================================
+
+ALTER TABLE device_data_1h ADD COLUMN IF NOT EXISTS value_sketch BYTEA;
+
+CREATE OR REPLACE FUNCTION downsample_device_data(
+    p_start TIMESTAMPTZ,
+    p_end TIMESTAMPTZ
+)
+RETURNS BIGINT AS $$
+DECLARE
+    raw_rows BIGINT;
+BEGIN
+    INSERT INTO device_data_1m (
+        bucket, device_id, tenant_id, metric_name,
+        avg_value, min_value, max_value, sample_count, avg_quality_score
+    )
+    SELECT
+        time_bucket('1 minute', time), device_id, tenant_id, metric_name,
+        AVG(value), MIN(value), MAX(value), COUNT(*), AVG(quality_score)
+    FROM device_data
+    WHERE time >= p_start AND time < p_end
+    GROUP BY 1, device_id, tenant_id, metric_name
+    ON CONFLICT (device_id, metric_name, bucket) DO UPDATE SET
+        avg_value = EXCLUDED.avg_value,
+        min_value = EXCLUDED.min_value,
+        max_value = EXCLUDED.max_value,
+        sample_count = EXCLUDED.sample_count,
+        avg_quality_score = EXCLUDED.avg_quality_score;
+
+    INSERT INTO device_data_1h (
+        bucket, device_id, tenant_id, metric_name,
+        avg_value, min_value, max_value, sample_count, avg_quality_score, value_sketch
+    )
+    WITH bins AS (
+        SELECT
+            time_bucket('1 hour', time) AS bucket, device_id, tenant_id, metric_name,
+            ddsketch_key(value) AS sketch_key,
+            SUM(value) AS value_sum, COUNT(value) AS value_count,
+            MIN(value) AS min_value, MAX(value) AS max_value, COUNT(*) AS sample_count,
+            SUM(quality_score) AS quality_sum, COUNT(quality_score) AS quality_count
+        FROM device_data
+        WHERE time >= p_start AND time < p_end
+        GROUP BY 1, device_id, tenant_id, metric_name, 5
+    )
+    SELECT
+        bucket, device_id, tenant_id, metric_name,
+        SUM(value_sum) / NULLIF(SUM(value_count), 0)::float8,
+        MIN(min_value), MAX(max_value), SUM(sample_count),
+        SUM(quality_sum) / NULLIF(SUM(quality_count), 0),
+        '\x01'::bytea || string_agg(ddsketch_entry(sketch_key, sample_count), ''::bytea ORDER BY sketch_key)
+    FROM bins
+    GROUP BY bucket, device_id, tenant_id, metric_name
+    ON CONFLICT (device_id, metric_name, bucket) DO UPDATE SET
+        avg_value = EXCLUDED.avg_value,
+        min_value = EXCLUDED.min_value,
+        max_value = EXCLUDED.max_value,
+        sample_count = EXCLUDED.sample_count,
+        avg_quality_score = EXCLUDED.avg_quality_score,
+        value_sketch = EXCLUDED.value_sketch;
+
+    SELECT COALESCE(SUM(sample_count), 0) INTO raw_rows
+    FROM device_data_1h
+    WHERE bucket >= p_start AND bucket < p_end;
+
+    RETURN raw_rows;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Sketches of buckets downsampled before this migration, from the raw rows
+-- still in device_data (grouped as in downsample_device_data). Only
+-- buckets whose raw rows are all still there (same sample_count) get one.
+WITH pending AS (
+    SELECT MIN(bucket) AS first_bucket, MAX(bucket) + INTERVAL '1 hour' AS end_bucket
+    FROM device_data_1h
+    WHERE value_sketch IS NULL
+),
+bins AS (
+    SELECT
+        time_bucket('1 hour', d.time) AS bucket, d.device_id, d.metric_name,
+        ddsketch_key(d.value) AS sketch_key, COUNT(*) AS sample_count
+    FROM device_data d, pending
+    WHERE d.time >= pending.first_bucket AND d.time < pending.end_bucket
+    GROUP BY 1, 2, 3, 4
+),
+sketches AS (
+    SELECT
+        bucket, device_id, metric_name, SUM(sample_count) AS sample_count,
+        '\x01'::bytea || string_agg(ddsketch_entry(sketch_key, sample_count), ''::bytea ORDER BY sketch_key) AS value_sketch
+    FROM bins
+    GROUP BY bucket, device_id, metric_name
+)
+UPDATE device_data_1h t
+SET value_sketch = s.value_sketch
+FROM sketches s
+WHERE t.value_sketch IS NULL
+    AND t.device_id = s.device_id
+    AND t.metric_name = s.metric_name
+    AND t.bucket = s.bucket
+    AND t.sample_count = s.sample_count;
+
+COMMENT ON FUNCTION ddsketch_key IS 'DDSketch bin key of a value (1% relative accuracy), see app/services/ddsketch.py';
+COMMENT ON FUNCTION create_device_data_rollups IS 'Drop and recreate device_data_hourly/daily (empty) with percentile sketches';
+COMMENT ON FUNCTION ddsketch_entry IS 'One encoded DDSketch bin (int4 key, int4 count)';
+COMMENT ON MATERIALIZED VIEW device_data_hourly IS 'Hourly aggregated device metrics with a DDSketch per bucket (refreshed by refresh_device_data_aggregates)';
+COMMENT ON MATERIALIZED VIEW device_data_daily IS 'Daily aggregated device metrics with a DDSketch per bucket (refreshed by refresh_device_data_aggregates)';
+COMMENT ON COLUMN device_data_1h.value_sketch IS 'DDSketch of the bucket''s values (NULL for buckets downsampled before sketches existed whose raw rows were already dropped)';
@@ -0,0 +1,82 @@
+-- =====================================================
+-- IoTLinker - Per-Tenant Raw Retention
+-- Description: Tenant-scoped downsampling, so raw_days shorter than the chunk-drop horizon can be enforced per tenant
+-- =====================================================
+
+-- Raw chunks hold many tenants, so they are only dropped once the longest
+-- raw retention has passed. Tenants with a shorter one have their older
+-- rows rolled up and deleted by the API's retention job, a slice at a
+-- time, with p_tenant_id restricting the rollup to that tenant. Without
+-- it the function is unchanged (whole time range, every tenant).
+DROP FUNCTION IF EXISTS downsample_device_data(TIMESTAMPTZ, TIMESTAMPTZ);
+
+CREATE OR REPLACE FUNCTION downsample_device_data(
+    p_start TIMESTAMPTZ,
+    p_end TIMESTAMPTZ,
+    p_tenant_id UUID DEFAULT NULL
+)
+RETURNS BIGINT AS $$
+DECLARE
+    raw_rows BIGINT;
+BEGIN
+    INSERT INTO device_data_1m (
+        bucket, device_id, tenant_id, metric_name,
+        avg_value, min_value, max_value, sample_count, avg_quality_score
+    )
+    SELECT
+        time_bucket('1 minute', time), device_id, tenant_id, metric_name,
+        AVG(value), MIN(value), MAX(value), COUNT(*), AVG(quality_score)
+    FROM device_data
+    WHERE time >= p_start AND time < p_end
+        AND (p_tenant_id IS NULL OR tenant_id = p_tenant_id)
+    GROUP BY 1, device_id, tenant_id, metric_name
+    ON CONFLICT (device_id, metric_name, bucket) DO UPDATE SET
+        avg_value = EXCLUDED.avg_value,
+        min_value = EXCLUDED.min_value,
+        max_value = EXCLUDED.max_value,
+        sample_count = EXCLUDED.sample_count,
+        avg_quality_score = EXCLUDED.avg_quality_score;
+
+    INSERT INTO device_data_1h (
+        bucket, device_id, tenant_id, metric_name,
+        avg_value, min_value, max_value, sample_count, avg_quality_score, value_sketch
+    )
+    WITH bins AS (
+        SELECT
+            time_bucket('1 hour', time) AS bucket, device_id, tenant_id, metric_name,
+            ddsketch_key(value) AS sketch_key,
+            SUM(value) AS value_sum, COUNT(value) AS value_count,
+            MIN(value) AS min_value, MAX(value) AS max_value, COUNT(*) AS sample_count,
+            SUM(quality_score) AS quality_sum, COUNT(quality_score) AS quality_count
+        FROM device_data
+        WHERE time >= p_start AND time < p_end
+            AND (p_tenant_id IS NULL OR tenant_id = p_tenant_id)
+        GROUP BY 1, device_id, tenant_id, metric_name, 5
+    )
+    SELECT
+        bucket, device_id, tenant_id, metric_name,
+        SUM(value_sum) / NULLIF(SUM(value_count), 0)::float8,
+        MIN(min_value), MAX(max_value), SUM(sample_count),
+        SUM(quality_sum) / NULLIF(SUM(quality_count), 0),
+        '\x01'::bytea || string_agg(ddsketch_entry(sketch_key, sample_count), ''::bytea ORDER BY sketch_key)
+    FROM bins
+    GROUP BY bucket, device_id, tenant_id, metric_name
+    ON CONFLICT (device_id, metric_name, bucket) DO UPDATE SET
+        avg_value = EXCLUDED.avg_value,
+        min_value = EXCLUDED.min_value,
+        max_value = EXCLUDED.max_value,
+        sample_count = EXCLUDED.sample_count,
+        avg_quality_score = EXCLUDED.avg_quality_score,
+        value_sketch = EXCLUDED.value_sketch;
+
+    SELECT COALESCE(SUM(sample_count), 0) INTO raw_rows
+    FROM device_data_1h
+    WHERE bucket >= p_start AND bucket < p_end
+        AND (p_tenant_id IS NULL OR tenant_id = p_tenant_id);
+
+    RETURN raw_rows;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON FUNCTION downsample_device_data IS 'Roll raw device_data in a time range (optionally of one tenant) into the 1m and 1h tiers';
+COMMENT ON COLUMN retention_policies.raw_days IS 'Days of raw data; longer than RETENTION_RAW_DAYS keeps the shared chunks longer, shorter is enforced by per-tenant deletes';
@@ -0,0 +1,16 @@
+-- =====================================================
+-- IoTLinker - Bulk Job Leases
+-- Description: Let any API worker resume a running bulk job whose worker stopped or died
+-- =====================================================
+
+-- The worker running a job extends its lease with every chunk. A worker
+-- shutting down records the cursor and clears the lease; one that dies
+-- lets it expire. Either way another worker claims the job (FOR UPDATE
+-- SKIP LOCKED, so only one does) and continues after cursor_id.
+ALTER TABLE bulk_jobs ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ;
+
+CREATE INDEX IF NOT EXISTS idx_bulk_jobs_running
+    ON bulk_jobs(lease_expires_at)
+    WHERE status = 'running';
+
+COMMENT ON COLUMN bulk_jobs.lease_expires_at IS 'Until when the worker running the job owns it; NULL or past means any worker may resume it';